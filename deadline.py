@@ -0,0 +1,112 @@
+import os
+import time
+import asyncio
+import logging
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Этапы обработки запроса, у каждого свой бюджет времени
+BUDGET_DOWNLOAD = "download"   # Получение скриншота из Telegram
+BUDGET_LLM = "llm"             # Запрос к Claude
+BUDGET_EXTRACT = "extract"     # Извлечение файлов из ответа
+BUDGET_VALIDATE = "validate"   # Проверка и исправление скриптов
+BUDGET_SEND = "send"           # Упаковка и отправка архива
+
+# Бюджеты по умолчанию (в секундах), переопределяются переменными DEADLINE_<ЭТАП>
+DEFAULT_BUDGETS = {
+    BUDGET_DOWNLOAD: 30,
+    BUDGET_LLM: 240,
+    BUDGET_EXTRACT: 10,
+    BUDGET_VALIDATE: 30,
+    BUDGET_SEND: 60
+}
+
+
+class DeadlineExceeded(Exception):
+    """Этап обработки не уложился в отведенное время"""
+
+    def __init__(self, stage, budget):
+        self.stage = stage
+        self.budget = budget
+        super().__init__(f"Этап '{stage}' не завершился за {budget:.1f} с")
+
+
+class Deadline:
+    """
+    Крайний срок обработки запроса с бюджетами времени для каждого этапа
+
+    Создается при начале обработки задачи и передается через все этапы.
+    Каждый этап ограничен своим бюджетом, но не дольше, чем осталось
+    до общего крайнего срока.
+    """
+
+    def __init__(self, total=None, budgets=None):
+        """
+        Инициализация
+
+        Args:
+            total (float, optional): Общее время на запрос (DEADLINE_TOTAL или 360 секунд)
+            budgets (dict, optional): Бюджеты этапов (по умолчанию DEFAULT_BUDGETS и DEADLINE_<ЭТАП>)
+        """
+        self.total = total or float(os.getenv("DEADLINE_TOTAL", "360"))
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + self.total
+
+        self.budgets = {
+            stage: float(os.getenv(f"DEADLINE_{stage.upper()}", str(default)))
+            for stage, default in DEFAULT_BUDGETS.items()
+        }
+        if budgets:
+            self.budgets.update(budgets)
+
+    def remaining(self):
+        """Время до общего крайнего срока (в секундах)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        """Истек ли общий крайний срок"""
+        return self.remaining() <= 0
+
+    def budget(self, stage):
+        """
+        Возвращает время, доступное этапу
+
+        Args:
+            stage (str): Один из BUDGET_*
+
+        Returns:
+            float: Бюджет этапа, урезанный до оставшегося общего времени
+        """
+        return min(self.budgets.get(stage, self.total), self.remaining())
+
+    async def run(self, stage, awaitable):
+        """
+        Выполняет этап с ограничением по времени
+
+        Args:
+            stage (str): Один из BUDGET_*
+            awaitable: Корутина или задача этапа
+
+        Returns:
+            Результат этапа
+
+        Raises:
+            DeadlineExceeded: Если этап не уложился в бюджет
+        """
+        budget = self.budget(stage)
+        if budget <= 0:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded(stage, 0)
+
+        try:
+            return await asyncio.wait_for(awaitable, budget)
+        except asyncio.TimeoutError:
+            logger.warning(f"Этап '{stage}' превысил бюджет {budget:.1f} с")
+            raise DeadlineExceeded(stage, budget) from None
@@ -23,6 +23,9 @@ logger = logging.getLogger(__name__)
 def reset_bot_sessions():
     """
     Сбрасывает все активные сессии бота через Telegram API
+
+    Returns:
+        bool: True, если getWebhookInfo подтвердил, что webhook снят
     """
     try:
         # Получаем токен из переменных окружения
@@ -37,16 +40,24 @@ def reset_bot_sessions():
         
         # Отправляем запрос на сброс webhook
         logger.info("Сброс webhook и активных сессий...")
-        response = requests.get(delete_webhook_url, timeout=30)
-        
-        if response.status_code == 200:
-            logger.info("Webhook успешно сброшен")
-            # Делаем паузу для полного завершения предыдущих сессий
-            time.sleep(10)
-            return True
-        else:
-            logger.error(f"Ошибка при сбросе webhook: {response.status_code} - {response.text}")
-            return False
+        # Одна сессия на все запросы: соединение с api.telegram.org переиспользуется
+        with requests.Session() as http:
+            response = http.get(delete_webhook_url, timeout=(5, 30))
+            
+            if response.status_code == 200:
+                # Вместо фиксированной паузы подтверждаем сброс через getWebhookInfo
+                deadline = time.monotonic() + 3
+                while time.monotonic() < deadline:
+                    info = http.get(f'{base_url}/getWebhookInfo', timeout=(5, 10)).json()
+                    if not info.get('result', {}).get('url'):
+                        logger.info("Webhook успешно сброшен")
+                        return True
+                    time.sleep(0.2)
+                logger.warning("Сброс webhook не подтвержден: webhook все еще установлен")
+                return False
+            else:
+                logger.error(f"Ошибка при сбросе webhook: {response.status_code} - {response.text}")
+                return False
             
     except Exception as e:
         logger.error(f"Ошибка при сбросе сессий бота: {e}")
@@ -105,8 +116,6 @@ def main():
         # Сначала сбрасываем все активные сессии
         if not reset_bot_sessions():
             logger.warning("Не удалось сбросить активные сессии бота")
-            # Делаем дополнительную паузу перед запуском
-            time.sleep(15)
         
         # Запускаем бот оптимизации
         logger.info("Запуск бота оптимизации")
@@ -119,10 +128,6 @@ def main():
         else:
             logger.warning("Файл optimization_bot.py не найден")
         
-        # Небольшая пауза перед запуском для стабилизации системы
-        logger.info("Ожидание 3 секунд перед запуском бота...")
-        time.sleep(3)
-        
         # Запускаем файл optimization_bot.py
         try:
             logger.info("Запуск optimization_bot.py")
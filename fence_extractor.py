@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Потоковое извлечение блоков кода из ответа Claude
+
+Ответ поступает фрагментами. FenceExtractor собирает строки и отдает
+каждый блок ```язык ... ``` сразу после закрывающей ограды, не дожидаясь
+конца ответа, чтобы проверка скрипта начиналась, пока Claude еще пишет
+остальные файлы.
+"""
+
+FENCE = "```"
+
+
+class FenceExtractor:
+    """Построчный разбор блоков кода в потоке текста"""
+
+    def __init__(self):
+        self._buffer = ""
+        self._language = None   # Язык открытого блока (None - блок не открыт)
+        self._lines = []
+
+    def feed(self, text):
+        """
+        Принимает очередной фрагмент ответа
+
+        Args:
+            text (str): Фрагмент текста
+
+        Returns:
+            list: Блоки (язык, содержимое), закрытые в этом фрагменте
+        """
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+
+        blocks = []
+        for line in lines:
+            block = self._process_line(line.rstrip("\r"))
+            if block is not None:
+                blocks.append(block)
+        return blocks
+
+    def finish(self):
+        """
+        Завершает разбор в конце ответа
+
+        Последняя строка ответа может прийти без перевода строки - если это
+        закрывающая ограда, блок отдается здесь.
+
+        Returns:
+            list: Блоки (язык, содержимое), закрытые последней строкой
+        """
+        line, self._buffer = self._buffer, ""
+        block = self._process_line(line.rstrip("\r")) if line else None
+        return [block] if block is not None else []
+
+    def _process_line(self, line):
+        """Обрабатывает одну полную строку, возвращает закрытый блок или None"""
+        if self._language is None:
+            if line.startswith(FENCE):
+                self._language = line[len(FENCE):].strip().lower()
+                self._lines = []
+            return None
+
+        if line.strip() == FENCE:
+            block = (self._language, "".join(f"{body}\n" for body in self._lines))
+            self._language = None
+            self._lines = []
+            return block
+
+        self._lines.append(line)
+        return None
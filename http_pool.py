@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Общий пул HTTP-соединений для запросов к Telegram
+
+Все вызовы Bot API и загрузки файлов идут через одну aiohttp-сессию с
+ограниченным пулом соединений, keep-alive и тайм-аутами, поэтому TLS-
+рукопожатие с api.telegram.org выполняется один раз на соединение, а не
+на каждый запрос. Здесь же кэшируется соответствие file_id -> file_path,
+чтобы повторно присланный скриншот не требовал лишнего вызова getFile.
+"""
+
+import os
+import io
+import time
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import aiohttp
+from telebot import asyncio_helper
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+TELEGRAM_FILE_URL = "https://api.telegram.org/file/bot{0}/{1}"
+
+# Размер фрагмента при потоковой загрузке файла (кратен 3, чтобы base64 кодировался без остатка)
+DOWNLOAD_CHUNK_SIZE = 3 * 16 * 1024
+
+
+class FileTooLargeError(Exception):
+    """Файл превышает допустимый размер загрузки"""
+
+    def __init__(self, size, limit):
+        self.size = size
+        self.limit = limit
+        super().__init__(f"Размер файла {size} байт превышает лимит {limit} байт")
+
+
+class Base64StreamEncoder:
+    """
+    Потоковый кодировщик base64
+
+    Принимает файл фрагментами и кодирует их по мере поступления, поэтому
+    исходные байты целиком в памяти не накапливаются. Первые байты файла
+    сохраняются в header, чтобы по ним можно было определить формат, а
+    попутно считается SHA-256 содержимого.
+    """
+
+    HEADER_SIZE = 16
+
+    def __init__(self):
+        # Закодированный текст пишется в один буфер, отдельные фрагменты не хранятся
+        self._output = io.StringIO()
+        self._tail = b""
+        self.size = 0
+        self.header = b""
+        self.digest = hashlib.sha256()
+
+    def update(self, chunk):
+        """
+        Кодирует очередной фрагмент
+
+        Args:
+            chunk (bytes): Фрагмент файла
+        """
+        if len(self.header) < self.HEADER_SIZE:
+            self.header += chunk[:self.HEADER_SIZE - len(self.header)]
+        self.size += len(chunk)
+        self.digest.update(chunk)
+        data = self._tail + chunk if self._tail else chunk
+        # base64 кодирует группы по 3 байта, остаток ждет следующего фрагмента
+        cut = len(data) - len(data) % 3
+        self._tail = data[cut:]
+        if cut:
+            self._output.write(base64.b64encode(data[:cut]).decode("ascii"))
+
+    def finish(self):
+        """
+        Завершает кодирование
+
+        Returns:
+            str: Файл в base64
+        """
+        if self._tail:
+            self._output.write(base64.b64encode(self._tail).decode("ascii"))
+            self._tail = b""
+        result = self._output.getvalue()
+        self._output = io.StringIO()
+        return result
+
+
+class PooledSessionManager(asyncio_helper.SessionManager):
+    """
+    Менеджер aiohttp-сессии pyTelegramBotAPI с настроенным пулом соединений
+
+    Заменяет стандартный asyncio_helper.session_manager, поэтому вызовы бота
+    (send_message, get_file и т.д.) и загрузка файлов используют одни и те же
+    соединения.
+    """
+
+    def __init__(self, pool_size=None, keepalive_timeout=None, connect_timeout=None, read_timeout=None):
+        """
+        Инициализация
+
+        Args:
+            pool_size (int, optional): Максимум одновременных соединений (HTTP_POOL_SIZE или 20)
+            keepalive_timeout (float, optional): Сколько держать простаивающее соединение (HTTP_KEEPALIVE_TIMEOUT или 60)
+            connect_timeout (float, optional): Тайм-аут установки соединения (HTTP_CONNECT_TIMEOUT или 10)
+            read_timeout (float, optional): Тайм-аут чтения ответа (HTTP_READ_TIMEOUT или 60)
+        """
+        super().__init__()
+        self.pool_size = pool_size or int(os.getenv("HTTP_POOL_SIZE", "20"))
+        self.keepalive_timeout = keepalive_timeout or float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+        self.connect_timeout = connect_timeout or float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+        self.read_timeout = read_timeout or float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+
+    async def create_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+            ssl=self.ssl_context
+        )
+        # Общий тайм-аут задается в каждом запросе, здесь только соединение и чтение
+        timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+
+class FilePathCache:
+    """
+    Кэш file_id -> file_path с ограничением по размеру и времени жизни
+
+    Telegram гарантирует, что ссылка на файл действительна не меньше часа,
+    поэтому по умолчанию записи живут 50 минут.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        """
+        Инициализация
+
+        Args:
+            max_entries (int, optional): Максимум записей (FILE_PATH_CACHE_SIZE или 1000)
+            ttl (float, optional): Время жизни записи в секундах (FILE_PATH_CACHE_TTL или 3000)
+        """
+        self.max_entries = max_entries or int(os.getenv("FILE_PATH_CACHE_SIZE", "1000"))
+        self.ttl = ttl or float(os.getenv("FILE_PATH_CACHE_TTL", "3000"))
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_id):
+        """Возвращает file_path или None, если записи нет или она устарела"""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None or time.monotonic() > entry[1]:
+                self._entries.pop(file_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(file_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, file_id, file_path):
+        """Запоминает file_path для file_id"""
+        with self._lock:
+            self._entries[file_id] = (file_path, time.monotonic() + self.ttl)
+            self._entries.move_to_end(file_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, file_id):
+        """Удаляет запись (например, если ссылка перестала работать)"""
+        with self._lock:
+            self._entries.pop(file_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TelegramHttpClient:
+    """Загрузка файлов Telegram через общий пул соединений"""
+
+    def __init__(self, token, session_manager=None, file_paths=None):
+        """
+        Инициализация
+
+        Args:
+            token (str): Токен бота
+            session_manager (PooledSessionManager, optional): Менеджер сессии (по умолчанию новый)
+            file_paths (FilePathCache, optional): Кэш file_path (по умолчанию новый)
+        """
+        self.token = token
+        self.session_manager = session_manager or PooledSessionManager()
+        self.file_paths = file_paths or FilePathCache()
+
+    def install(self):
+        """Подключает пул к pyTelegramBotAPI, чтобы вызовы бота шли через те же соединения"""
+        asyncio_helper.REQUEST_LIMIT = self.session_manager.pool_size
+        asyncio_helper.session_manager = self.session_manager
+
+    async def get_file_path(self, file_id):
+        """
+        Возвращает file_path файла, используя кэш
+
+        Args:
+            file_id (str): file_id в Telegram
+
+        Returns:
+            str: Путь к файлу на серверах Telegram
+        """
+        return self.file_paths.get(file_id) or await self._fetch_file_path(file_id)
+
+    async def _fetch_file_path(self, file_id):
+        """Запрашивает file_path через getFile и сохраняет его в кэш"""
+        result = await asyncio_helper.get_file(self.token, file_id)
+        file_path = result["file_path"]
+        self.file_paths.put(file_id, file_path)
+        return file_path
+
+    async def download_file(self, file_id, timeout=None, max_bytes=None, encoder=None):
+        """
+        Загружает файл по file_id потоково, фрагментами
+
+        Если сохраненная ссылка устарела, file_path запрашивается заново.
+
+        Args:
+            file_id (str): file_id в Telegram
+            timeout (float, optional): Общий тайм-аут загрузки (в секундах)
+            max_bytes (int, optional): Максимальный размер файла
+            encoder (Base64StreamEncoder, optional): Кодировщик, которому передаются фрагменты
+
+        Returns:
+            io.BytesIO или str: Содержимое файла (позиция в начале), а при указании encoder - результат encoder.finish()
+
+        Raises:
+            FileTooLargeError: Если файл больше max_bytes
+        """
+        file_path = self.file_paths.get(file_id)
+        from_cache = file_path is not None
+        request_timeout = aiohttp.ClientTimeout(
+            total=timeout,
+            sock_connect=self.session_manager.connect_timeout,
+            sock_read=self.session_manager.read_timeout
+        )
+
+        while True:
+            if file_path is None:
+                file_path = await self._fetch_file_path(file_id)
+            # FILE_URL задается при работе через локальный сервер Bot API
+            url = (asyncio_helper.FILE_URL or TELEGRAM_FILE_URL).format(self.token, file_path)
+
+            session = await self.session_manager.get_session()
+            async with session.get(url, timeout=request_timeout, proxy=asyncio_helper.proxy) as response:
+                if response.status in (400, 404) and from_cache:
+                    logger.info("Сохраненная ссылка на файл устарела, запрашиваем новую")
+                    self.file_paths.invalidate(file_id)
+                    file_path, from_cache = None, False
+                    continue
+                response.raise_for_status()
+                return await self._read_body(response, max_bytes, encoder)
+
+    async def _read_body(self, response, max_bytes, encoder):
+        """Читает тело ответа фрагментами, не превышая max_bytes"""
+        # Заведомо большой файл отклоняем до чтения тела
+        if max_bytes and response.content_length and response.content_length > max_bytes:
+            raise FileTooLargeError(response.content_length, max_bytes)
+
+        # Фрагменты пишутся прямо в BytesIO, который затем читает Pillow: файл копируется один раз
+        buffer = io.BytesIO() if encoder is None else None
+        received = 0
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            received += len(chunk)
+            if max_bytes and received > max_bytes:
+                raise FileTooLargeError(received, max_bytes)
+            if encoder is None:
+                buffer.write(chunk)
+            else:
+                encoder.update(chunk)
+
+        if encoder is not None:
+            return encoder.finish()
+        buffer.seek(0)
+        return buffer
+
+    def get_stats(self):
+        """
+        Возвращает статистику пула и кэша
+
+        Returns:
+            dict: Размер пула, попадания и промахи кэша file_path
+        """
+        return {
+            "pool_size": self.session_manager.pool_size,
+            "file_path_entries": len(self.file_paths),
+            "file_path_hits": self.file_paths.hits,
+            "file_path_misses": self.file_paths.misses
+        }
+
+    async def close(self):
+        """Закрывает сессию и все соединения пула"""
+        session = self.session_manager.session
+        if session is not None and not session.closed:
+            await session.close()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Подготовка скриншотов перед отправкой в Claude
+
+Скриншот уменьшается до IMAGE_MAX_DIMENSION по длинной стороне (этого
+достаточно, чтобы текст системной информации оставался читаемым) и
+пережимается. Это уменьшает объем загрузки, число токенов изображения и
+время ответа Claude. Pillow необязателен: без него изображение
+отправляется как есть, определяется только его формат.
+"""
+
+import os
+import io
+import logging
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Сигнатуры форматов, которые принимает Claude
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+PIL_MEDIA_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp"
+}
+
+# Claude сам уменьшает изображения больше 1568 пикселей по длинной стороне
+CLAUDE_MAX_DIMENSION = 1568
+# Примерное число пикселей на один токен изображения
+PIXELS_PER_TOKEN = 750
+# Размер по умолчанию: текст системной информации на таком скриншоте еще читается
+DEFAULT_MAX_DIMENSION = 1280
+# Сторона сетки перцептивного хэша (256 бит, устойчив к пережатию и уменьшению)
+DHASH_SIZE = 16
+
+
+def detect_media_type(header, default="image/jpeg"):
+    """
+    Определяет формат изображения по первым байтам
+
+    Args:
+        header (bytes): Начало файла (достаточно 12 байт)
+        default (str): Формат, если сигнатура не распознана
+
+    Returns:
+        str: MIME-тип изображения
+    """
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, media_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return media_type
+    return default
+
+
+def estimate_image_tokens(width, height):
+    """
+    Оценивает число токенов, которое Claude потратит на изображение
+
+    Args:
+        width (int): Ширина в пикселях
+        height (int): Высота в пикселях
+
+    Returns:
+        int: Примерное число токенов
+    """
+    longest = max(width, height)
+    if longest > CLAUDE_MAX_DIMENSION:
+        scale = CLAUDE_MAX_DIMENSION / longest
+        width, height = int(width * scale), int(height * scale)
+    return (width * height) // PIXELS_PER_TOKEN
+
+
+def compute_dhash(image, hash_size=DHASH_SIZE):
+    """
+    Вычисляет разностный перцептивный хэш (dHash) изображения
+
+    Хэш совпадает у пережатых и уменьшенных копий одного скриншота.
+
+    Args:
+        image: Изображение Pillow
+        hash_size (int): Сторона сетки сравнения
+
+    Returns:
+        str: Хэш в шестнадцатеричном виде
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+class PreparedImage:
+    """Изображение, готовое к отправке в Claude"""
+
+    def __init__(self, data, media_type, original_bytes, tokens_before=None, tokens_after=None, perceptual_hash=None):
+        self.data = data
+        self.media_type = media_type
+        self.original_bytes = original_bytes
+        self.tokens_before = tokens_before
+        self.tokens_after = tokens_after
+        self.perceptual_hash = perceptual_hash
+
+    @property
+    def bytes_saved(self):
+        return self.original_bytes - len(self.data)
+
+    @property
+    def tokens_saved(self):
+        if self.tokens_before is None or self.tokens_after is None:
+            return 0
+        return self.tokens_before - self.tokens_after
+
+
+class ImagePreprocessor:
+    """Уменьшение и пережатие скриншотов (при наличии Pillow)"""
+
+    def __init__(self, max_dimension=None, jpeg_quality=None, enabled=None):
+        """
+        Инициализация
+
+        Args:
+            max_dimension (int, optional): Максимальный размер по длинной стороне (IMAGE_MAX_DIMENSION или 1280)
+            jpeg_quality (int, optional): Качество JPEG при пережатии (IMAGE_JPEG_QUALITY или 85)
+            enabled (bool, optional): Включена ли обработка (IMAGE_PREPROCESS или true)
+        """
+        self.max_dimension = max_dimension or int(os.getenv("IMAGE_MAX_DIMENSION", str(DEFAULT_MAX_DIMENSION)))
+        self.jpeg_quality = jpeg_quality or int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+        if enabled is None:
+            enabled = os.getenv("IMAGE_PREPROCESS", "true").lower() in ("1", "true", "yes")
+        self.enabled = enabled
+
+        if self.enabled and Image is None:
+            logger.warning("Pillow не установлен, скриншоты отправляются в Claude без обработки")
+
+    @property
+    def available(self):
+        """Можно ли обрабатывать изображения"""
+        return self.enabled and Image is not None
+
+    def process(self, data):
+        """
+        Уменьшает и пережимает изображение
+
+        Если обработка недоступна или не дает выигрыша, возвращается исходное
+        изображение с определенным форматом.
+
+        Args:
+            data (bytes или io.BytesIO): Исходное изображение; BytesIO читается без копирования
+
+        Returns:
+            PreparedImage: Подготовленное изображение
+        """
+        if isinstance(data, io.BytesIO):
+            source, data = data, data.getbuffer()
+        else:
+            source = io.BytesIO(data)
+
+        media_type = detect_media_type(bytes(data[:12]))
+        if not self.available:
+            return PreparedImage(data, media_type, len(data))
+
+        try:
+            source.seek(0)
+            with Image.open(source) as image:
+                media_type = PIL_MEDIA_TYPES.get(image.format, media_type)
+                tokens_before = estimate_image_tokens(*image.size)
+                perceptual_hash = compute_dhash(image)
+
+                resized = max(image.size) > self.max_dimension
+                if resized:
+                    image.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
+
+                # Копия в RGB закрывается отдельно: with закрывает только исходное изображение
+                converted = image.convert("RGB") if image.mode not in ("RGB", "L") else None
+                try:
+                    target = converted if converted is not None else image
+                    tokens_after = estimate_image_tokens(*target.size)
+
+                    candidates = [(self._encode(target, "JPEG", quality=self.jpeg_quality, optimize=True), "image/jpeg")]
+                    if media_type == "image/png":
+                        # Скриншоты с крупными однотонными областями часто меньше в PNG
+                        candidates.append((self._encode(target, "PNG", optimize=True), "image/png"))
+                finally:
+                    if converted is not None:
+                        converted.close()
+        except Exception as e:
+            logger.warning(f"Не удалось обработать изображение, отправляю исходное: {e}")
+            return PreparedImage(data, media_type, len(data))
+
+        compressed, compressed_type = min(candidates, key=lambda candidate: len(candidate[0]))
+        if len(compressed) >= len(data) and tokens_after >= tokens_before:
+            # Обработка ничего не дала
+            prepared = PreparedImage(data, media_type, len(data), tokens_before, tokens_before, perceptual_hash)
+        else:
+            prepared = PreparedImage(compressed, compressed_type, len(data), tokens_before, tokens_after, perceptual_hash)
+
+        logger.info(
+            f"Изображение подготовлено: {prepared.original_bytes} -> {len(prepared.data)} байт "
+            f"(экономия {prepared.bytes_saved} байт), токенов ~{prepared.tokens_before} -> ~{prepared.tokens_after} "
+            f"(экономия ~{prepared.tokens_saved})"
+        )
+        return prepared
+
+    @staticmethod
+    def _encode(image, image_format, **options):
+        """Сохраняет изображение в заданном формате и возвращает байты"""
+        output = io.BytesIO()
+        image.save(output, format=image_format, **options)
+        return output.getvalue()
@@ -0,0 +1,499 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Типы задач
+JOB_KIND_GENERATE = "generate"
+JOB_KIND_FIX = "fix"
+
+# Классы приоритета задач (меньше - важнее)
+PRIORITY_ADMIN = 0      # Запросы администраторов
+PRIORITY_FIX = 1        # Исправление ошибок у пользователей, застрявших на запуске скрипта
+PRIORITY_GENERATE = 2   # Новая генерация скриптов
+
+PRIORITY_NAMES = {
+    PRIORITY_ADMIN: "admin",
+    PRIORITY_FIX: "fix",
+    PRIORITY_GENERATE: "generate"
+}
+
+# Состояния задачи (сохраняются в JobStore)
+JOB_STATE_QUEUED = "queued"
+JOB_STATE_RUNNING = "running"
+JOB_STATE_DONE = "done"
+JOB_STATE_FAILED = "failed"
+JOB_STATE_CANCELLED = "cancelled"
+
+
+class QueueFullError(Exception):
+    """Очередь задач переполнена"""
+
+
+class Job:
+    """Задача генерации или исправления скриптов для одного пользователя"""
+
+    def __init__(self, kind, chat_id, file_id, user_text=None, priority=None, file_unique_id=None,
+                 user_id=None, job_id=None, attempts=0, fallback_file_ids=None):
+        """
+        Инициализация задачи
+
+        Args:
+            kind (str): Тип задачи (JOB_KIND_GENERATE или JOB_KIND_FIX)
+            chat_id (int): ID чата пользователя
+            file_id (str): file_id скриншота в Telegram
+            user_text (str, optional): Текст пользователя для промпта
+            priority (int, optional): Класс приоритета (по умолчанию определяется типом задачи)
+            file_unique_id (str, optional): Постоянный идентификатор файла скриншота
+            user_id (int, optional): ID пользователя Telegram
+            job_id (str, optional): ID задачи (при восстановлении из JobStore)
+            attempts (int): Количество уже сделанных попыток выполнения
+            fallback_file_ids (list, optional): file_id больших размеров того же фото (от меньшего к большему)
+        """
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        if priority is None:
+            priority = PRIORITY_FIX if kind == JOB_KIND_FIX else PRIORITY_GENERATE
+        self.priority = priority
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.fallback_file_ids = list(fallback_file_ids or [])
+        self.user_text = user_text
+        self.attempts = attempts
+        self.status_message_id = None
+        self.dedup_key = None      # Ключ для поиска повторных отправок того же запроса
+        self.duplicates = 0        # Сколько повторных отправок присоединено к задаче
+        self.cancelled = False
+        self.task = None           # asyncio.Task выполнения задачи
+        self.progress = None       # ProgressReporter статусного сообщения
+        self.abort_event = threading.Event()  # Сигнал прерывания для кода в рабочих потоках
+        self.deadline = None       # Deadline обработки (создается при начале выполнения)
+        self.response_text = None  # Полученный ответ Claude (сохраняется на случай перезапуска)
+        self.created_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def wait_time(self):
+        """Время ожидания задачи в очереди (в секундах)"""
+        end = self.started_at if self.started_at is not None else time.monotonic()
+        return end - self.created_at
+
+    def __repr__(self):
+        return f"Job(id={self.id}, kind={self.kind}, chat_id={self.chat_id})"
+
+
+class JobQueue:
+    """
+    Очередь задач с ограниченным пулом обработчиков
+
+    Задачи распределяются по классам приоритета: сначала администраторы,
+    затем исправление ошибок, затем новая генерация. Внутри класса чаты
+    обслуживаются по кругу, поэтому пользователь, отправивший много
+    скриншотов подряд, не задерживает остальных.
+    """
+
+    def __init__(self, handler, workers=None, max_size=None, store=None):
+        """
+        Инициализация очереди
+
+        Args:
+            handler: Корутина handler(job), выполняющая задачу
+            workers (int, optional): Количество обработчиков (по умолчанию BOT_WORKERS или 4)
+            max_size (int, optional): Максимальный размер очереди (по умолчанию BOT_QUEUE_MAX_SIZE или 100)
+            store (JobStore, optional): Хранилище, в котором сохраняются задачи и их состояния
+        """
+        self.handler = handler
+        self.store = store
+        # Запись в хранилище идет в одном фоновом потоке в порядке постановки:
+        # цикл событий не ждет диск, а изменения задачи не обгоняют ее вставку
+        self._store_executor = None
+        self.workers = workers or int(os.getenv("BOT_WORKERS", "4"))
+        self.max_size = max_size or int(os.getenv("BOT_QUEUE_MAX_SIZE", "100"))
+
+        # Ожидающие задачи: приоритет -> (chat_id -> задачи чата по порядку)
+        self._lanes = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self._pending_count = 0
+        # Счетчик готовых задач создается в start(), чтобы привязаться к работающему циклу событий
+        self._ready = None
+        self._active = {}    # Выполняемые задачи: id -> Job
+        self._wait_stats = {priority: {"count": 0, "total": 0.0, "max": 0.0} for priority in PRIORITY_NAMES}
+        self._worker_tasks = []
+        self._stopping = False
+        self._draining = False
+        self.coalesced_count = 0
+        self.cancelled_count = 0
+
+    async def start(self):
+        """Запускает обработчики очереди"""
+        if self._worker_tasks:
+            return
+
+        self._stopping = False
+        self._draining = False
+        self._ready = asyncio.Semaphore(self._pending_count)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(index), name=f"job-worker-{index}")
+            for index in range(self.workers)
+        ]
+        logger.info(f"Очередь задач запущена: {self.workers} обработчиков, максимум {self.max_size} задач")
+
+    async def stop(self):
+        """Останавливает обработчики очереди"""
+        self._stopping = True
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        logger.info("Очередь задач остановлена")
+
+    async def drain(self, timeout):
+        """
+        Перестает брать новые задачи и ждет завершения выполняемых
+
+        Ожидающие задачи остаются в хранилище и будут выполнены после перезапуска.
+
+        Args:
+            timeout (float): Максимальное время ожидания (в секундах)
+
+        Returns:
+            int: Количество задач, не успевших завершиться
+        """
+        self._draining = True
+        tasks = [job.task for job in self._active.values() if job.task is not None]
+        if tasks:
+            logger.info(f"Ожидаем завершения {len(tasks)} задач (не более {timeout:.0f} с)")
+            await asyncio.wait(tasks, timeout=timeout)
+
+        unfinished = len(self._active)
+        if unfinished:
+            logger.warning(f"{unfinished} задач не успели завершиться и будут продолжены после перезапуска")
+        return unfinished
+
+    def save_response(self, job, response_text):
+        """
+        Запоминает ответ Claude для задачи и сохраняет его в хранилище
+
+        Args:
+            job (Job): Задача
+            response_text (str): Текст ответа
+        """
+        job.response_text = response_text
+        self._store_write("save_response", job)
+
+    def save_status_message(self, job):
+        """
+        Сохраняет в хранилище ID статусного сообщения задачи
+
+        Args:
+            job (Job): Задача
+        """
+        self._store_write("set_status_message", job)
+
+    async def close_store(self):
+        """Дописывает ожидающие изменения и закрывает хранилище"""
+        if self._store_executor is not None:
+            await asyncio.to_thread(self._store_executor.shutdown)
+            self._store_executor = None
+        if self.store:
+            await asyncio.to_thread(self.store.close)
+            self.store = None
+
+    def submit(self, job):
+        """
+        Ставит задачу в очередь
+
+        Args:
+            job (Job): Задача
+
+        Returns:
+            int: Позиция задачи в очереди (0 - задача будет взята в работу сразу)
+
+        Raises:
+            QueueFullError: Если очередь переполнена
+        """
+        if self._ready is None:
+            raise RuntimeError("Очередь задач не запущена")
+
+        # Задача с тем же id уже в очереди (например, восстановлена после перезапуска)
+        if job.id in self._active or any(other.id == job.id for other in self._scheduled_order()):
+            logger.info(f"Задача {job} уже в очереди, повторная постановка пропущена")
+            return self.position(job)
+
+        if self._pending_count >= self.max_size:
+            raise QueueFullError(f"В очереди уже {self.max_size} задач")
+
+        lane = self._lanes.setdefault(job.priority, OrderedDict())
+        lane.setdefault(job.chat_id, deque()).append(job)
+        self._pending_count += 1
+        self._ready.release()
+
+        self._store_write("add", job)
+
+        position = self.position(job)
+        logger.info(f"Задача {job} поставлена в очередь, позиция {position}")
+        return position
+
+    def position(self, job):
+        """
+        Возвращает позицию задачи в очереди
+
+        Args:
+            job (Job): Задача
+
+        Returns:
+            int: Число задач до нее в ожидании свободного обработчика плюс один,
+                 или 0, если задача уже выполняется или будет взята сразу
+        """
+        try:
+            index = self._scheduled_order().index(job)
+        except ValueError:
+            return 0
+
+        free_workers = max(0, self.workers - len(self._active))
+        return max(0, index - free_workers + 1)
+
+    def find_in_flight(self, chat_id, kind=None):
+        """
+        Возвращает ожидающие и выполняемые задачи чата
+
+        Args:
+            chat_id (int): ID чата
+            kind (str, optional): Тип задачи (если не указан - любые)
+
+        Returns:
+            list: Задачи в порядке постановки в очередь
+        """
+        jobs = list(self._active.values()) + self._scheduled_order()
+        return [
+            job for job in jobs
+            if job.chat_id == chat_id and not job.cancelled and (kind is None or job.kind == kind)
+        ]
+
+    def find_duplicate(self, job):
+        """
+        Ищет в обработке задачу того же чата с тем же ключом dedup_key
+
+        Args:
+            job (Job): Новая задача
+
+        Returns:
+            Job: Уже выполняемая или ожидающая задача или None
+        """
+        if job.dedup_key is None:
+            return None
+
+        for other in self.find_in_flight(job.chat_id, job.kind):
+            if other.dedup_key == job.dedup_key:
+                return other
+        return None
+
+    def attach_duplicate(self, leader):
+        """
+        Учитывает повторную отправку, присоединенную к задаче leader
+
+        Args:
+            leader (Job): Задача, результат которой получит повторная отправка
+        """
+        leader.duplicates += 1
+        self.coalesced_count += 1
+        logger.info(f"Повторная отправка присоединена к задаче {leader}")
+
+    def cancel(self, job):
+        """
+        Отменяет ожидающую или выполняемую задачу
+
+        Args:
+            job (Job): Задача
+
+        Returns:
+            bool: True, если задача была отменена
+        """
+        if job.cancelled or job.finished_at is not None:
+            return False
+
+        job.cancelled = True
+        job.abort_event.set()
+        self.cancelled_count += 1
+
+        # Ожидающая задача просто удаляется из очереди, выполняемая - прерывается
+        if self._remove_pending(job):
+            self._save_state(job, JOB_STATE_CANCELLED)
+        elif job.task is not None:
+            job.task.cancel()
+
+        logger.info(f"Задача {job} отменена")
+        return True
+
+    def get_stats(self):
+        """
+        Возвращает статистику очереди
+
+        Returns:
+            dict: Количество ожидающих и выполняемых задач, число обработчиков
+        """
+        wait_by_class = {}
+        for priority, stats in self._wait_stats.items():
+            count = stats["count"]
+            wait_by_class[PRIORITY_NAMES.get(priority, str(priority))] = {
+                "pending": sum(len(jobs) for jobs in self._lanes.get(priority, {}).values()),
+                "count": count,
+                "avg_wait": stats["total"] / count if count else 0.0,
+                "max_wait": stats["max"]
+            }
+
+        return {
+            "pending": self._pending_count,
+            "active": len(self._active),
+            "workers": self.workers,
+            "coalesced": self.coalesced_count,
+            "cancelled": self.cancelled_count,
+            "wait_by_class": wait_by_class
+        }
+
+    def _scheduled_order(self):
+        """
+        Возвращает ожидающие задачи в том порядке, в котором их возьмут обработчики
+
+        Returns:
+            list: Задачи
+        """
+        order = []
+        for priority in sorted(self._lanes):
+            queues = [list(jobs) for jobs in self._lanes[priority].values()]
+            # Обход по кругу: по одной задаче от каждого чата
+            for round_index in range(max((len(jobs) for jobs in queues), default=0)):
+                order.extend(jobs[round_index] for jobs in queues if round_index < len(jobs))
+        return order
+
+    def _pop_next(self):
+        """
+        Забирает следующую задачу: самый важный класс, следующий по кругу чат
+
+        Returns:
+            Job: Задача или None, если ожидающих задач нет
+        """
+        for priority in sorted(self._lanes):
+            lane = self._lanes[priority]
+            if not lane:
+                continue
+
+            chat_id, jobs = next(iter(lane.items()))
+            job = jobs.popleft()
+            if jobs:
+                # Остальные задачи чата - после задач других чатов
+                lane.move_to_end(chat_id)
+            else:
+                del lane[chat_id]
+            self._pending_count -= 1
+            return job
+        return None
+
+    def _remove_pending(self, job):
+        """
+        Удаляет задачу из ожидающих
+
+        Returns:
+            bool: True, если задача ожидала в очереди
+        """
+        lane = self._lanes.get(job.priority, {})
+        jobs = lane.get(job.chat_id)
+        if not jobs or job not in jobs:
+            return False
+
+        jobs.remove(job)
+        if not jobs:
+            del lane[job.chat_id]
+        self._pending_count -= 1
+        return True
+
+    def _save_state(self, job, state):
+        """Сохраняет состояние задачи в хранилище"""
+        if state == JOB_STATE_RUNNING:
+            self._store_write("mark_running", job)
+        else:
+            self._store_write("mark_finished", job, state)
+
+    def _store_write(self, method, *args):
+        """
+        Ставит запись в хранилище в очередь фонового потока
+
+        Args:
+            method (str): Имя метода JobStore
+            *args: Аргументы метода
+        """
+        if not self.store:
+            return
+        if self._store_executor is None:
+            self._store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+        self._store_executor.submit(self._call_store, self.store, method, *args)
+
+    @staticmethod
+    def _call_store(store, method, *args):
+        """Выполняет запись в фоновом потоке (ошибки хранилища не прерывают работу)"""
+        try:
+            getattr(store, method)(*args)
+        except Exception as e:
+            logger.error(f"Не удалось выполнить {method} в хранилище задач для {args[0]}: {e}")
+
+    def _record_wait(self, job):
+        """Учитывает время ожидания задачи в статистике ее класса"""
+        stats = self._wait_stats.setdefault(job.priority, {"count": 0, "total": 0.0, "max": 0.0})
+        wait_time = job.wait_time
+        stats["count"] += 1
+        stats["total"] += wait_time
+        stats["max"] = max(stats["max"], wait_time)
+
+    async def _worker(self, index):
+        """Цикл обработчика: берет задачи из очереди и выполняет их"""
+        while True:
+            await self._ready.acquire()
+            if self._draining:
+                # Идет остановка: новые задачи не начинаем, ждем отмены обработчика
+                self._ready.release()
+                await asyncio.Event().wait()
+
+            job = self._pop_next()
+            if job is None:
+                # Задачу отменили, пока она ждала в очереди
+                continue
+
+            self._active[job.id] = job
+            job.started_at = time.monotonic()
+            self._record_wait(job)
+            self._save_state(job, JOB_STATE_RUNNING)
+            state = JOB_STATE_DONE
+
+            try:
+                logger.info(f"Обработчик {index} начал задачу {job} (ожидание {job.wait_time:.1f} с)")
+                # Отдельная задача, чтобы отмена одного запроса не останавливала обработчик
+                job.task = asyncio.create_task(self.handler(job))
+                await job.task
+            except asyncio.CancelledError:
+                if not job.cancelled or self._stopping:
+                    # Остановка процесса: задача остается незавершенной и будет выполнена после перезапуска
+                    state = None
+                    raise
+                state = JOB_STATE_CANCELLED
+                logger.info(f"Обработчик {index} прервал отмененную задачу {job}")
+            except Exception as e:
+                state = JOB_STATE_FAILED
+                logger.error(f"Ошибка при выполнении задачи {job}: {e}", exc_info=True)
+            finally:
+                job.finished_at = time.monotonic()
+                self._active.pop(job.id, None)
+                if state:
+                    self._save_state(job, state)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Хранение задач очереди в SQLite
+
+Задачи записываются в базу при постановке в очередь и обновляются при
+каждом изменении состояния. После перезапуска процесса незавершенные
+задачи (ожидающие и выполнявшиеся в момент остановки) загружаются снова,
+поэтому пользователю не нужно повторно отправлять скриншот. Если ответ
+Claude был получен до остановки, он сохраняется вместе с задачей и
+повторно не запрашивается - остается только проверить и отправить
+скрипты. Доставка -
+"хотя бы один раз": задача, прерванная на отправке архива, будет выполнена
+повторно, но не более JOB_MAX_ATTEMPTS раз.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+from job_queue import (
+    Job, JOB_STATE_QUEUED, JOB_STATE_RUNNING, JOB_STATE_DONE, JOB_STATE_FAILED
+)
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Состояния, в которых задача считается незавершенной
+UNFINISHED_STATES = (JOB_STATE_QUEUED, JOB_STATE_RUNNING)
+
+
+class JobStore:
+    """Таблица задач в SQLite (режим WAL)"""
+
+    def __init__(self, path=None, max_attempts=None, retention=None):
+        """
+        Инициализация
+
+        Args:
+            path (str, optional): Путь к базе (JOB_DB_PATH или jobs.db)
+            max_attempts (int, optional): Максимум попыток выполнения задачи (JOB_MAX_ATTEMPTS или 3)
+            retention (float, optional): Сколько хранить завершенные задачи в секундах (JOB_RETENTION или 7 дней)
+        """
+        self.path = path or os.getenv("JOB_DB_PATH", "jobs.db")
+        self.max_attempts = max_attempts or int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        self.retention = retention or float(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL NORMAL не теряет согласованность базы при сбое процесса
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, "
+            "kind TEXT NOT NULL, "
+            "chat_id INTEGER NOT NULL, "
+            "user_id INTEGER, "
+            "file_id TEXT NOT NULL, "
+            "file_unique_id TEXT, "
+            "fallback_file_ids TEXT, "
+            "user_text TEXT, "
+            "priority INTEGER NOT NULL, "
+            "status_message_id INTEGER, "
+            "state TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "response_text TEXT, "
+            "created_at REAL NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        # Базы, созданные до появления новых столбцов
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        for column in ("response_text", "fallback_file_ids"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self._conn.commit()
+
+    def _execute(self, sql, params=()):
+        """Выполняет запрос и фиксирует изменения"""
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor
+
+    def add(self, job):
+        """
+        Сохраняет новую задачу (повторная запись задачи с тем же id игнорируется)
+
+        Args:
+            job (Job): Задача
+        """
+        now = time.time()
+        self._execute(
+            "INSERT OR IGNORE INTO jobs (id, kind, chat_id, user_id, file_id, file_unique_id, fallback_file_ids, "
+            "user_text, priority, status_message_id, state, attempts, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                job.id, job.kind, job.chat_id, job.user_id, job.file_id, job.file_unique_id,
+                json.dumps(job.fallback_file_ids) if job.fallback_file_ids else None,
+                job.user_text, job.priority, job.status_message_id, JOB_STATE_QUEUED, job.attempts, now, now
+            )
+        )
+
+    def set_status_message(self, job):
+        """Сохраняет ID статусного сообщения задачи"""
+        self._execute(
+            "UPDATE jobs SET status_message_id = ?, updated_at = ? WHERE id = ?",
+            (job.status_message_id, time.time(), job.id)
+        )
+
+    def save_response(self, job):
+        """Сохраняет полученный ответ Claude, чтобы не запрашивать его повторно после перезапуска"""
+        self._execute(
+            "UPDATE jobs SET response_text = ?, updated_at = ? WHERE id = ?",
+            (job.response_text, time.time(), job.id)
+        )
+
+    def mark_running(self, job):
+        """Отмечает начало очередной попытки выполнения задачи"""
+        job.attempts += 1
+        self._execute(
+            "UPDATE jobs SET state = ?, attempts = ?, updated_at = ? WHERE id = ?",
+            (JOB_STATE_RUNNING, job.attempts, time.time(), job.id)
+        )
+
+    def mark_finished(self, job, state=JOB_STATE_DONE):
+        """
+        Отмечает завершение задачи
+
+        Args:
+            job (Job): Задача
+            state (str): JOB_STATE_DONE, JOB_STATE_FAILED или JOB_STATE_CANCELLED
+        """
+        self._execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (state, time.time(), job.id))
+
+    def load_unfinished(self):
+        """
+        Загружает задачи, не завершенные до остановки процесса
+
+        Задачи, исчерпавшие попытки, отмечаются как неудавшиеся и не возвращаются.
+
+        Returns:
+            tuple: (задачи для повторного выполнения, задачи с исчерпанными попытками)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, chat_id, user_id, file_id, file_unique_id, fallback_file_ids, user_text, priority, "
+                "status_message_id, attempts, response_text FROM jobs WHERE state IN (?, ?) ORDER BY created_at",
+                UNFINISHED_STATES
+            ).fetchall()
+
+        resumed, exhausted = [], []
+        for row in rows:
+            (job_id, kind, chat_id, user_id, file_id, file_unique_id, fallback_file_ids, user_text, priority,
+             status_message_id, attempts, response_text) = row
+            job = Job(
+                kind, chat_id, file_id,
+                user_text=user_text,
+                priority=priority,
+                file_unique_id=file_unique_id,
+                user_id=user_id,
+                job_id=job_id,
+                attempts=attempts,
+                fallback_file_ids=json.loads(fallback_file_ids) if fallback_file_ids else None
+            )
+            job.status_message_id = status_message_id
+            job.response_text = response_text
+
+            if attempts >= self.max_attempts:
+                self.mark_finished(job, JOB_STATE_FAILED)
+                exhausted.append(job)
+            else:
+                resumed.append(job)
+
+        if rows:
+            logger.info(f"Незавершенных задач: {len(resumed)} будут выполнены повторно, {len(exhausted)} исчерпали попытки")
+        return resumed, exhausted
+
+    def purge(self):
+        """Удаляет завершенные задачи старше срока хранения"""
+        cursor = self._execute(
+            "DELETE FROM jobs WHERE state NOT IN (?, ?) AND updated_at < ?",
+            (*UNFINISHED_STATES, time.time() - self.retention)
+        )
+        return cursor.rowcount
+
+    def close(self):
+        """Закрывает соединение с базой"""
+        with self._lock:
+            self._conn.close()
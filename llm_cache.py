@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Кэш ответов Claude
+
+Повторные запросы с тем же промптом, изображением и текстом пользователя
+(повторы после ошибок, стандартный текст "Создай скрипт оптимизации
+Windows") получают сохраненный ответ без обращения к API. Ключ включает
+модель, max_tokens, версию промптов PromptOptimizer и системный промпт,
+поэтому после обновления промптов старые ответы не используются.
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+from result_cache import TieredCache
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def normalize_messages(messages):
+    """
+    Приводит сообщения к виду, в котором несущественные различия не влияют на ключ
+
+    В текстовых блоках схлопываются пробелы и переводы строк, изображения
+    заменяются хэшем содержимого.
+
+    Args:
+        messages (list): Сообщения для Messages API
+
+    Returns:
+        list: Нормализованные сообщения
+    """
+    normalized = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+
+        blocks = []
+        for block in content:
+            if block.get("type") == "text":
+                blocks.append({"type": "text", "text": " ".join(block["text"].split())})
+            elif block.get("type") == "image":
+                source = block["source"]
+                digest = hashlib.sha256(source.get("data", "").encode("ascii")).hexdigest()
+                blocks.append({"type": "image", "media_type": source.get("media_type"), "sha256": digest})
+            else:
+                blocks.append(block)
+        normalized.append({"role": message["role"], "content": blocks})
+    return normalized
+
+
+class LLMResponseCache:
+    """Двухуровневый кэш ответов Claude (память и SQLite)"""
+
+    def __init__(self, cache=None):
+        """
+        Инициализация
+
+        Args:
+            cache (TieredCache, optional): Хранилище (по умолчанию настраивается переменными LLM_CACHE_*)
+        """
+        if cache is None:
+            cache = TieredCache(
+                "llm",
+                path=os.getenv("LLM_CACHE_DB_PATH", "llm_cache.db"),
+                max_entries=int(os.getenv("LLM_CACHE_SIZE", "100")),
+                max_disk_entries=int(os.getenv("LLM_CACHE_DISK_ENTRIES", "2000")),
+                ttl=float(os.getenv("LLM_CACHE_TTL", "86400"))
+            )
+        self.cache = cache
+
+    @staticmethod
+    def make_key(model, max_tokens, prompt_version, messages, system=None):
+        """
+        Формирует ключ запроса
+
+        Args:
+            model (str): Модель Claude
+            max_tokens (int): Лимит токенов ответа
+            prompt_version: Версия промптов PromptOptimizer
+            messages (list): Сообщения для Messages API
+            system (list, optional): Блоки системного промпта
+
+        Returns:
+            str: SHA-256 нормализованного запроса
+        """
+        payload = json.dumps(
+            {
+                "model": model,
+                "max_tokens": max_tokens,
+                "prompt_version": prompt_version,
+                "system": " ".join(" ".join(block["text"].split()) for block in system or []),
+                "messages": normalize_messages(messages)
+            },
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Возвращает сохраненный текст ответа или None"""
+        response_text = self.cache.get(key)
+        if response_text is not None:
+            logger.info("Ответ Claude взят из кэша")
+        return response_text
+
+    def put(self, key, response_text):
+        """Сохраняет текст ответа"""
+        self.cache.put(key, response_text)
+
+    def get_stats(self):
+        """
+        Возвращает статистику кэша
+
+        Returns:
+            dict: Записи, попадания по уровням, промахи, доля попаданий и вытеснения
+        """
+        return self.cache.get_stats()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Общий асинхронный клиент Anthropic
+
+Запросы к Claude выполняются через AsyncAnthropic в цикле событий, а не
+в потоках: параллельные генерации занимают соединения и корутины, а не
+потоки ОС. Клиент один на процесс (на каждый API ключ), его пул HTTP-
+соединений ограничен по размеру, а тайм-ауты установки соединения и
+чтения заданы явно. При запуске клиент прогревается легким запросом,
+чтобы TLS-соединение с API было готово к первой генерации.
+"""
+
+import os
+import logging
+import threading
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Максимум одновременных соединений с API
+ANTHROPIC_POOL_SIZE = int(os.getenv("ANTHROPIC_POOL_SIZE", "20"))
+# Сколько держать простаивающее соединение (в секундах)
+ANTHROPIC_KEEPALIVE_TIMEOUT = float(os.getenv("ANTHROPIC_KEEPALIVE_TIMEOUT", "60"))
+# Тайм-аут установки соединения (в секундах)
+ANTHROPIC_CONNECT_TIMEOUT = float(os.getenv("ANTHROPIC_CONNECT_TIMEOUT", "10"))
+# Тайм-аут чтения (в секундах): максимальная пауза между фрагментами потокового ответа
+ANTHROPIC_READ_TIMEOUT = float(os.getenv("ANTHROPIC_READ_TIMEOUT", "120"))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def create_async_client(api_key):
+    """
+    Создает асинхронный клиент Anthropic с ограниченным пулом соединений
+
+    Args:
+        api_key (str): API ключ Anthropic
+
+    Returns:
+        anthropic.AsyncAnthropic: Клиент
+    """
+    import httpx
+    import anthropic
+
+    http_client = anthropic.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=ANTHROPIC_POOL_SIZE,
+            max_keepalive_connections=ANTHROPIC_POOL_SIZE,
+            keepalive_expiry=ANTHROPIC_KEEPALIVE_TIMEOUT
+        ),
+        timeout=request_timeout(ANTHROPIC_READ_TIMEOUT)
+    )
+    # Повторы выполняет llm_resilience, собственные повторы клиента отключены
+    return anthropic.AsyncAnthropic(api_key=api_key, http_client=http_client, max_retries=0)
+
+
+def get_shared_client(api_key):
+    """
+    Возвращает общий для процесса клиент для API ключа, создавая его при первом обращении
+
+    Args:
+        api_key (str): API ключ Anthropic
+
+    Returns:
+        anthropic.AsyncAnthropic: Клиент
+    """
+    client = _clients.get(api_key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(api_key)
+            if client is None:
+                client = create_async_client(api_key)
+                _clients[api_key] = client
+                logger.info(f"Создан асинхронный клиент Anthropic, пул до {ANTHROPIC_POOL_SIZE} соединений")
+    return client
+
+
+def request_timeout(total):
+    """
+    Тайм-аут одного запроса: не дольше total, соединение - не дольше ANTHROPIC_CONNECT_TIMEOUT
+
+    Args:
+        total (float): Время, оставшееся на запрос (в секундах)
+
+    Returns:
+        httpx.Timeout: Тайм-аут для параметра timeout клиента
+    """
+    import httpx
+
+    read_timeout = min(total, ANTHROPIC_READ_TIMEOUT)
+    return httpx.Timeout(read_timeout, connect=min(ANTHROPIC_CONNECT_TIMEOUT, read_timeout))
+
+
+async def warm_up(client):
+    """
+    Устанавливает соединение с API заранее (список моделей, токены не расходуются)
+
+    Args:
+        client (anthropic.AsyncAnthropic): Клиент
+
+    Returns:
+        bool: True, если API ответил
+    """
+    try:
+        await client.models.list(limit=1, timeout=request_timeout(ANTHROPIC_CONNECT_TIMEOUT))
+        logger.info("Соединение с Anthropic API прогрето")
+        return True
+    except Exception as e:
+        logger.warning(f"Не удалось прогреть соединение с Anthropic API: {e}")
+        return False
+
+
+async def close_shared_clients():
+    """Закрывает общие клиенты и их соединения"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        await client.close()
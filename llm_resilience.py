@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Устойчивость запросов к Claude
+
+Ошибки API приводятся к типизированным классам (исчерпан баланс, API
+перегружен, превышен лимит запросов, тайм-аут или обрыв соединения,
+ошибка сервера). Временные ошибки повторяются с экспоненциальной
+задержкой со случайным разбросом, при этом учитывается заголовок
+retry-after. Предохранитель (circuit breaker) после серии сбоев на время
+перестает обращаться к API, и запросы сразу получают шаблонные скрипты
+вместо ожидания.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Состояния предохранителя
+CIRCUIT_CLOSED = "closed"         # Запросы идут как обычно
+CIRCUIT_OPEN = "open"             # Запросы сразу отклоняются
+CIRCUIT_HALF_OPEN = "half_open"   # Пропускается один пробный запрос
+
+
+class LLMError(Exception):
+    """Базовый класс ошибок запроса к Claude"""
+
+    # Имеет ли смысл повторить запрос
+    retryable = False
+    # Засчитывается ли ошибка предохранителю
+    trips_breaker = True
+
+    def __init__(self, message, retry_after=None):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class LLMCreditBalanceError(LLMError):
+    """Баланс API-кредитов исчерпан"""
+
+
+class LLMOverloadedError(LLMError):
+    """API перегружен (529 или 503)"""
+    retryable = True
+
+
+class LLMRateLimitError(LLMError):
+    """Превышен лимит запросов (429)"""
+    retryable = True
+
+
+class LLMTimeoutError(LLMError):
+    """Тайм-аут или обрыв соединения с API"""
+    retryable = True
+
+
+class LLMServerError(LLMError):
+    """Внутренняя ошибка сервера API (5xx)"""
+    retryable = True
+
+
+class LLMCircuitOpenError(LLMError):
+    """Предохранитель разомкнут, запрос к API не отправлялся"""
+    trips_breaker = False
+
+
+def _retry_after(error):
+    """Извлекает задержку (в секундах) из заголовков retry-after-ms / retry-after ответа"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        # retry-after в формате HTTP-даты не используется API Anthropic
+        pass
+    return None
+
+
+def classify_error(error):
+    """
+    Приводит исключение запроса к Claude к типизированной ошибке
+
+    Args:
+        error (Exception): Исключение клиента Anthropic
+
+    Returns:
+        LLMError: Типизированная ошибка или None, если ошибка не относится к доступности API
+                  (например, некорректный запрос)
+    """
+    if isinstance(error, LLMError):
+        return error
+
+    message = str(error)
+    status_code = getattr(error, "status_code", None)
+    retry_after = _retry_after(error)
+
+    if "credit balance is too low" in message.lower():
+        return LLMCreditBalanceError(message)
+    if status_code == 429:
+        return LLMRateLimitError(message, retry_after)
+    if status_code in (503, 529) or "overloaded" in message.lower():
+        return LLMOverloadedError(message, retry_after)
+    if status_code is not None and status_code >= 500:
+        return LLMServerError(message, retry_after)
+    if status_code is None and isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return LLMTimeoutError(message)
+
+    try:
+        import anthropic
+    except ImportError:
+        return None
+    # APITimeoutError - подкласс APIConnectionError
+    if isinstance(error, anthropic.APIConnectionError):
+        return LLMTimeoutError(message)
+    return None
+
+
+class RetryPolicy:
+    """Экспоненциальная задержка со случайным разбросом между повторами"""
+
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None):
+        """
+        Инициализация
+
+        Args:
+            max_attempts (int, optional): Максимум попыток, включая первую (LLM_RETRY_ATTEMPTS или 3)
+            base_delay (float, optional): Начальная задержка в секундах (LLM_RETRY_BASE_DELAY или 1)
+            max_delay (float, optional): Максимальная задержка в секундах (LLM_RETRY_MAX_DELAY или 30)
+        """
+        self.max_attempts = max_attempts or int(os.getenv("LLM_RETRY_ATTEMPTS", "3"))
+        self.base_delay = base_delay or float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+        self.max_delay = max_delay or float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Возвращает задержку перед следующей попыткой
+
+        Args:
+            attempt (int): Номер неудавшейся попытки (с нуля)
+            retry_after (float, optional): Задержка, запрошенная сервером
+
+        Returns:
+            float: Задержка в секундах; не меньше retry_after, если он указан
+        """
+        # "Полный разброс": случайная задержка от нуля до экспоненциальной границы
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Предохранитель запросов к API
+
+    После failure_threshold сбоев подряд размыкается на reset_timeout секунд:
+    запросы сразу отклоняются. Затем пропускает один пробный запрос - при
+    успехе замыкается, при сбое снова размыкается.
+    """
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        """
+        Инициализация
+
+        Args:
+            failure_threshold (int, optional): Сбоев подряд до размыкания (LLM_BREAKER_THRESHOLD или 5)
+            reset_timeout (float, optional): Время в разомкнутом состоянии в секундах (LLM_BREAKER_RESET_TIMEOUT или 60)
+        """
+        self.failure_threshold = failure_threshold or int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+        self.reset_timeout = reset_timeout or float(os.getenv("LLM_BREAKER_RESET_TIMEOUT", "60"))
+
+        self.consecutive_failures = 0
+        self.opened_count = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        """Текущее состояние (CIRCUIT_*)"""
+        if self._opened_at is None:
+            return CIRCUIT_CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return CIRCUIT_HALF_OPEN
+        return CIRCUIT_OPEN
+
+    def allow(self):
+        """
+        Проверяет, можно ли отправить запрос
+
+        Returns:
+            bool: True, если запрос разрешен
+        """
+        state = self.state
+        if state == CIRCUIT_CLOSED:
+            return True
+        if state == CIRCUIT_HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            logger.info("Предохранитель Claude API: пробный запрос")
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        """Отмечает успешный запрос"""
+        if self._opened_at is not None:
+            logger.info("Предохранитель Claude API замкнут, API снова доступен")
+        self.consecutive_failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        """Отмечает сбой запроса"""
+        self.consecutive_failures += 1
+        if self._probe_in_flight or (self._opened_at is None and self.consecutive_failures >= self.failure_threshold):
+            self._opened_at = time.monotonic()
+            self.opened_count += 1
+            logger.warning(
+                f"Предохранитель Claude API разомкнут на {self.reset_timeout:.0f} с "
+                f"после {self.consecutive_failures} сбоев подряд"
+            )
+        self._probe_in_flight = False
+
+    def release(self):
+        """Снимает отметку пробного запроса, если он завершился без результата (например, по тайм-ауту этапа)"""
+        self._probe_in_flight = False
+
+    def get_stats(self):
+        """
+        Возвращает статистику предохранителя
+
+        Returns:
+            dict: Состояние, сбои подряд, число размыканий и отклоненных запросов
+        """
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened_count": self.opened_count,
+            "rejected": self.rejected
+        }
+
+
+class ResilientCaller:
+    """Выполнение запросов к Claude с повторами и предохранителем"""
+
+    def __init__(self, retry_policy=None, breaker=None):
+        """
+        Инициализация
+
+        Args:
+            retry_policy (RetryPolicy, optional): Политика повторов (по умолчанию из переменных LLM_RETRY_*)
+            breaker (CircuitBreaker, optional): Предохранитель (по умолчанию из переменных LLM_BREAKER_*)
+        """
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = 0
+        self.errors_by_type = {}
+
+    async def call(self, attempt_factory, time_left=None):
+        """
+        Выполняет запрос с повторами временных ошибок
+
+        Args:
+            attempt_factory: функция без аргументов, возвращающая корутину одной попытки
+            time_left: функция без аргументов, возвращающая оставшееся на запрос время
+                       (повтор не начинается, если задержка его превышает)
+
+        Returns:
+            Результат успешной попытки
+
+        Raises:
+            LLMCircuitOpenError: Если предохранитель разомкнут
+            LLMError: Если ошибка не временная или попытки исчерпаны
+        """
+        if not self.breaker.allow():
+            raise LLMCircuitOpenError("Claude API временно недоступен, запрос не отправлялся")
+
+        attempt = 0
+        while True:
+            try:
+                result = await attempt_factory()
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                error = classify_error(e)
+                if error is None:
+                    # Ошибка не связана с доступностью API (например, некорректный запрос)
+                    self.breaker.release()
+                    raise
+
+                name = type(error).__name__
+                self.errors_by_type[name] = self.errors_by_type.get(name, 0) + 1
+                if error.trips_breaker:
+                    self.breaker.record_failure()
+
+                attempt += 1
+                if not error.retryable or attempt >= self.retry_policy.max_attempts:
+                    raise error from e
+
+                delay = self.retry_policy.delay(attempt - 1, error.retry_after)
+                if time_left is not None and delay >= time_left():
+                    logger.warning(f"{name}: повтор через {delay:.1f} с не уложится в оставшееся время")
+                    raise error from e
+                if not self.breaker.allow():
+                    raise LLMCircuitOpenError("Claude API временно недоступен, повтор не отправлялся") from e
+
+                self.retries += 1
+                logger.warning(
+                    f"{name} при запросе к Claude, попытка {attempt} из {self.retry_policy.max_attempts}, "
+                    f"повтор через {delay:.1f} с"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    def get_stats(self):
+        """
+        Возвращает статистику запросов
+
+        Returns:
+            dict: Статистика предохранителя, число повторов и ошибки по типам
+        """
+        stats = self.breaker.get_stats()
+        stats.update({
+            "retries": self.retries,
+            "errors_by_type": dict(self.errors_by_type)
+        })
+        return stats
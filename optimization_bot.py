@@ -1,3 +1,9 @@
+import time
+from startup_timing import StartupTimer
+
+# Замер времени запуска начинается до загрузки остальных модулей
+startup_timer = StartupTimer()
+
 import os
 import platform
 import socket
@@ -5,19 +11,24 @@ import atexit
 import logging
 import json
 import base64
+import hashlib
 import re
 from io import BytesIO
 from datetime import datetime
 import zipfile
 import asyncio
-import anthropic
-import requests
+import threading
+import secrets
+import signal
+import queue
 from dotenv import load_dotenv
-import telebot
 from telebot import types
 from telebot.async_telebot import AsyncTeleBot
-import time
-from telebot.apihelper import ApiTelegramException
+from telebot import asyncio_helper
+from telebot.asyncio_helper import ApiTelegramException
+
+# Тяжелые модули (anthropic, requests, валидатор, метрики, оптимизатор промптов)
+# импортируются при первом использовании, чтобы бот быстро начинал работу
 
 # Проверка на запуск только одного экземпляра бота - кросс-платформенная реализация
 def ensure_single_instance():
@@ -105,13 +116,39 @@ lock_handle = None
 # Глобальная переменная для сокета
 single_instance_socket = None
 
-# Импортируем наши модули
-from script_validator import ScriptValidator
-from script_metrics import ScriptMetrics
-from prompt_optimizer import PromptOptimizer
+# Шаблоны промптов
+from prompt_templates import OPTIMIZATION_PROMPT_TEMPLATE, ERROR_FIX_PROMPT_TEMPLATE
+
+# Очередь задач генерации и исправления
+from job_queue import Job, JobQueue, QueueFullError, JOB_KIND_GENERATE, JOB_KIND_FIX, PRIORITY_ADMIN
+
+# Отправка сообщений с учетом лимитов Telegram
+from telegram_dispatch import OutboundDispatcher, PRIORITY_RESULT
+
+# Ограничения времени на этапы обработки запроса
+from deadline import (
+    Deadline, DeadlineExceeded, BUDGET_DOWNLOAD, BUDGET_LLM, BUDGET_EXTRACT, BUDGET_VALIDATE, BUDGET_SEND
+)
+
+# Общий асинхронный клиент Anthropic
+from llm_client import close_shared_clients
+
+# Повторы, предохранитель и типизированные ошибки запросов к Claude
+from llm_resilience import LLMError, LLMCreditBalanceError, LLMCircuitOpenError
+
+# Хранилище сессий пользователей
+from session_store import create_session_store
 
-# Импортируем модуль для валидации скриптов
-from validate_and_fix_scripts import validate_and_fix_scripts
+# Общий пул HTTP-соединений к Telegram и кэш file_path
+from http_pool import TelegramHttpClient, Base64StreamEncoder, FileTooLargeError
+
+# Потоковое извлечение блоков кода из ответа Claude
+from fence_extractor import FenceExtractor
+
+# Отображение хода обработки в статусном сообщении
+from progress_reporter import (
+    ProgressReporter, STAGE_DOWNLOADING, STAGE_GENERATING, STAGE_VALIDATING, STAGE_PACKAGING
+)
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -126,14 +163,45 @@ logger = logging.getLogger(__name__)
 # Инициализация бота
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
+# ID администраторов (можно указать несколько через запятую)
+ADMIN_USER_IDS = {
+    int(user_id) for user_id in os.getenv('ADMIN_USER_ID', '').split(',') if user_id.strip().isdigit()
+}
+# Максимальный размер скриншота (в байтах); Bot API отдает файлы до 20 МБ
+IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', str(10 * 1024 * 1024)))
+# Минимальный размер фото, на котором текст системной информации еще читается
+# (длинная и короткая стороны в пикселях); из размеров Telegram берется наименьший подходящий
+PHOTO_MIN_WIDTH = int(os.getenv('PHOTO_MIN_WIDTH', '800'))
+PHOTO_MIN_HEIGHT = int(os.getenv('PHOTO_MIN_HEIGHT', '450'))
+
+# Модель Claude и лимит токенов ответа
+CLAUDE_MODEL = "claude-3-opus-20240229"
+CLAUDE_MAX_TOKENS = 4000
+
+# Ответ Claude, означающий, что текст на скриншоте не читается и нужен больший размер фото
+UNREADABLE_IMAGE_MARKER = "IMAGE_UNREADABLE"
+UNREADABLE_IMAGE_HINT = (
+    f"\n\nЕсли текст на изображении невозможно разобрать, ответь только словом {UNREADABLE_IMAGE_MARKER}."
+)
+
+def is_unreadable_response(response_text):
+    """Проверяет, сообщил ли Claude, что не может прочитать скриншот"""
+    return UNREADABLE_IMAGE_MARKER in response_text and "```" not in response_text
+
+# Создаем экземпляр бота: все обработчики - корутины в одном цикле событий
+bot = AsyncTeleBot(TELEGRAM_TOKEN)
+
+# Вызовы Bot API и загрузка файлов используют общий пул соединений с keep-alive
+telegram_http = TelegramHttpClient(TELEGRAM_TOKEN)
+telegram_http.install()
 
-# Создаем экземпляр бота
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
+# Все исходящие сообщения проходят через диспетчер с ограничением частоты
+outbound = OutboundDispatcher(bot)
 
-# Словари для хранения состояний пользователей
-user_states = {}  # Хранение состояний пользователей
-user_files = {}   # Хранение файлов пользователей
-user_messages = {}  # Хранение текста сообщений
+# Сессии пользователей с ограничением по времени простоя и объему
+sessions = create_session_store()
+user_states = sessions.view("state")      # Хранение состояний пользователей
+user_messages = sessions.view("message")  # Хранение текста сообщений
 
 # Статистика по генерации скриптов и ошибкам
 script_gen_count = 0
@@ -147,131 +215,17 @@ error_stats = {
     "other": 0
 }
 
-# Шаблон промпта для генерации скрипта оптимизации
-OPTIMIZATION_PROMPT_TEMPLATE = """Ты эксперт по оптимизации Windows. Тебе предоставлен скриншот системной информации. Твоя задача - создать скрипты для оптимизации этой системы.
-
-Обязательно следуй этим требованиям к скриптам:
-
-1. PowerShell скрипт (.ps1):
-   - Всегда начинай с установки кодировки UTF-8: `$OutputEncoding = [System.Text.Encoding]::UTF8`
-   - Проверяй права администратора в самом начале скрипта
-   - Все блоки try ДОЛЖНЫ иметь соответствующие блоки catch
-   - НИКОГДА не используй формат ${1}:TEMP в путях - это приводит к ошибкам!
-   - ВСЕГДА используй ТОЛЬКО формат $env:VARIABLENAME для переменных окружения (например: $env:TEMP, $env:APPDATA, $env:USERPROFILE)
-   - Внутри строк с двоеточием используй `${variable}` вместо `$variable`
-   - Проверяй существование файлов с помощью Test-Path перед их использованием
-   - Добавляй ключ -Force для команд Remove-Item
-   - Обеспечь балансировку всех фигурных скобок
-   - Для вывода сообщений об ошибках используй формат: `"Сообщение: ${variable}"`
-
-2. Batch файл (.bat):
-   - НИ В КОЕМ СЛУЧАЕ не используй русские символы в BAT-файлах!
-   - Обязательно начинай с `@echo off` и `chcp 65001 >nul`
-   - Проверяй права администратора
-   - Используй ТОЛЬКО английский текст в bat-файле
-   - Добавляй корректные параметры при вызове PowerShell: `-ExecutionPolicy Bypass -NoProfile -File`
-   - Используй перенаправление ошибок `>nul 2>&1` для команд
-
-3. ReadMe файл (README.md):
-   - Подробная документация по использованию скриптов
-   - Описание выполняемых оптимизаций
-   - Требования и предупреждения
-
-Предоставь три файла:
-1. WindowsOptimizer.ps1 - скрипт оптимизации PowerShell, который анализирует систему и оптимизирует её
-2. Start-Optimizer.bat - bat-файл для запуска PowerShell скрипта с нужными параметрами (ТОЛЬКО с английским текстом)
-3. README.md - инструкция по использованию скриптов
-
-Вот шаблон Batch-файла, которого нужно строго придерживаться:
-```batch
-@echo off
-chcp 65001 >nul
-title Windows Optimization
-
-:: Check administrator rights
-net session >nul 2>&1
-if %errorlevel% neq 0 (
-    echo Administrator rights required.
-    echo Please run this file as administrator.
-    pause
-    exit /b 1
-)
-
-:: Script file check
-if not exist "WindowsOptimizer.ps1" (
-    echo File WindowsOptimizer.ps1 not found.
-    echo Please make sure it is in the same folder.
-    pause
-    exit
-)
-
-:: Run PowerShell script with needed parameters
-echo Starting Windows optimization script...
-echo ==========================================
-
-powershell -ExecutionPolicy Bypass -NoProfile -File "WindowsOptimizer.ps1" -Encoding UTF8
-
-echo ==========================================
-echo Optimization script completed.
-pause
-```
-"""
-
-# Шаблон промпта для исправления ошибок в скрипте
-ERROR_FIX_PROMPT_TEMPLATE = """Ты эксперт по PowerShell и Batch скриптам. Перед тобой скриншот с ошибками выполнения скрипта оптимизации Windows. Твоя задача - проанализировать ошибки и исправить код скрипта.
-
-Вот основные типы ошибок, которые могут встречаться:
-
-1. Синтаксические ошибки:
-   - Несбалансированные скобки
-   - Неверное использование переменных
-   - Ошибки в конструкциях try-catch
-   - Неэкранированные специальные символы
-
-2. Проблемы с доступом:
-   - Отсутствие проверки прав администратора
-   - Попытка доступа к несуществующим файлам или службам
-   - Отсутствие параметра -Force для Remove-Item
-
-3. Проблемы кодировки:
-   - Отсутствие установки правильной кодировки
-   - Неверное отображение кириллических символов
-
-Важные правила при исправлении:
-
-1. Для PowerShell:
-   - Всегда добавляй в начало скрипта: `$OutputEncoding = [System.Text.Encoding]::UTF8`
-   - Все блоки try ДОЛЖНЫ иметь соответствующие блоки catch
-   - Переменные в строках с двоеточием используй в формате `${variable}` вместо `$variable`
-   - Используй проверки Test-Path перед операциями с файлами
-   - Балансируй все фигурные скобки
-
-2. Для Batch:
-   - Начинай с `@echo off` и `chcp 65001 >nul`
-   - Добавляй корректные параметры при вызове PowerShell
-
-Предоставь исправленные версии файлов с учетом обнаруженных на скриншоте проблем.
-
-ОБЯЗАТЕЛЬНО ПРОВЕРЬТЕ:
-- Проверку прав администратора
-- Наличие и корректность блоков обработки ошибок
-- Кодировку UTF-8 для PowerShell скриптов
-- Балансировку всех скобок в скрипте
-- Правильный формат переменных в строках с двоеточием (${variable})
-"""
-
-def validate_and_fix_scripts(files):
+def repair_and_validate_scripts(files, validator):
     """
-    Валидирует и исправляет скрипты
+    Валидирует и исправляет каждый скрипт по отдельности (без улучшений всего набора)
     
     Args:
         files: словарь с файлами (имя файла -> содержимое)
+        validator: экземпляр ScriptValidator
     
     Returns:
         tuple: (исправленные файлы, результаты валидации, кол-во исправленных ошибок)
     """
-    validator = ScriptValidator()
-    
     # Валидируем скрипты
     validation_results = validator.validate_scripts(files)
     
@@ -289,34 +243,43 @@ def validate_and_fix_scripts(files):
     fixed_errors = sum(len(errors) for errors in fixed_validation_results.values())
     errors_corrected = total_errors - fixed_errors
     
-    # Улучшаем скрипты, добавляя полезные функции
-    enhanced_files = validator.enhance_scripts(fixed_files)
-    
     logger.info(f"Исправлено {errors_corrected} проблем, осталось {fixed_errors} проблем")
     
-    return enhanced_files, fixed_validation_results, errors_corrected
+    return fixed_files, fixed_validation_results, errors_corrected
+
+def validate_and_fix_scripts(files, validator=None):
+    """
+    Валидирует и исправляет скрипты
+    
+    Args:
+        files: словарь с файлами (имя файла -> содержимое)
+        validator: экземпляр ScriptValidator (если None, будет создан новый)
+    
+    Returns:
+        tuple: (исправленные файлы, результаты валидации, кол-во исправленных ошибок)
+    """
+    if validator is None:
+        from script_validator import ScriptValidator
+        validator = ScriptValidator()
+    
+    fixed_files, validation_results, errors_corrected = repair_and_validate_scripts(files, validator)
+    
+    # Улучшаем скрипты, добавляя полезные функции (в том числе связывающие файлы набора)
+    enhanced_files = validator.enhance_scripts(fixed_files)
+    
+    return enhanced_files, validation_results, errors_corrected
 
 def create_safe_anthropic_client(api_key):
     """
-    Создает клиент Anthropic с безопасными параметрами
+    Возвращает общий асинхронный клиент Anthropic (см. llm_client)
     """
+    from llm_client import get_shared_client
+    
     try:
         if not api_key:
             raise ValueError("API ключ не может быть пустым")
         
-        # Импортируем антропик заново для чистой инициализации
-        import importlib
-        import sys
-        
-        # Удаляем модуль из sys.modules если он там есть
-        if 'anthropic' in sys.modules:
-            del sys.modules['anthropic']
-        
-        # Импортируем модуль заново
-        anthropic = importlib.import_module('anthropic')
-        
-        # Создаем клиент только с безопасными параметрами
-        client = anthropic.Anthropic(api_key=api_key)
+        client = get_shared_client(api_key)
         
         logger.info("Клиент Anthropic успешно инициализирован")
         return client
@@ -336,126 +299,570 @@ class OptimizationBot:
             api_key: API ключ для Anthropic Claude
             validator: экземпляр ScriptValidator (если None, будет создан новый)
         """
+        from script_validator import ScriptValidator
+        from script_metrics import ScriptMetrics
+        from prompt_optimizer import PromptOptimizer
+        from image_preprocessor import ImagePreprocessor
+        from result_cache import ScreenshotResultCache
+        from llm_cache import LLMResponseCache
+        from llm_resilience import ResilientCaller
+        
         self.api_key = api_key
         self.validator = validator or ScriptValidator()
+        self.image_preprocessor = ImagePreprocessor()
+        self.result_cache = ScreenshotResultCache()
+        self.llm_cache = LLMResponseCache()
+        self.resilience = ResilientCaller()
         self.metrics = ScriptMetrics()
         self.prompt_optimizer = PromptOptimizer(metrics=self.metrics)
         self.client = create_safe_anthropic_client(api_key)
         self.prompts = self.prompt_optimizer.get_optimized_prompts()
+        
+        # Блокировка для перезагрузки компонентов общего экземпляра
+        self._reload_lock = threading.RLock()
+    
+    def reload_prompts(self):
+        """Перечитывает промпты из файлов (например, после /update_prompts)"""
+        from prompt_optimizer import PromptOptimizer
+        
+        with self._reload_lock:
+            prompt_optimizer = PromptOptimizer(metrics=self.metrics)
+            prompts = prompt_optimizer.get_optimized_prompts()
+            # Заменяем ссылки целиком, чтобы выполняемые запросы видели согласованные данные
+            self.prompt_optimizer = prompt_optimizer
+            self.prompts = prompts
+        logger.info(f"Промпты перезагружены, версия {prompts.get('version')}")
+    
+    def reload_metrics(self):
+        """Перечитывает метрики из файла"""
+        from script_metrics import ScriptMetrics
+        
+        with self._reload_lock:
+            self.metrics = ScriptMetrics()
+            self.prompt_optimizer.metrics = self.metrics
+        logger.info("Метрики перезагружены")
+    
+    def reload_client(self, api_key=None):
+        """
+        Пересоздает клиент Anthropic (например, после смены API ключа)
+        
+        Args:
+            api_key: новый API ключ (если None, используется текущий)
+        """
+        with self._reload_lock:
+            client = create_safe_anthropic_client(api_key or self.api_key)
+            self.api_key = api_key or self.api_key
+            self.client = client
+        logger.info("Клиент Anthropic пересоздан")
+    
+    async def _stream_message(self, messages, progress=None, abort_event=None, timeout=None, on_block=None, system=None):
+        """
+        Потоковый запрос к Claude через общий асинхронный клиент
+        
+        Args:
+            messages: сообщения для Messages API
+            progress: ProgressReporter, получающий фрагменты ответа
+            abort_event: threading.Event, при установке которого запрос прерывается
+            timeout: таймаут HTTP-запроса к API в секундах (если None, действует тайм-аут клиента)
+            on_block: функция on_block(язык, содержимое), вызываемая для каждого блока кода
+                      сразу после его закрывающей ограды
+            system: блоки системного промпта (см. _cached_system_prompt)
+            
+        Returns:
+            Итоговое сообщение Claude
+            
+        Raises:
+            asyncio.CancelledError: Если запрос прерван через abort_event
+            DeadlineExceeded: Если на запрос не осталось времени
+        """
+        from anthropic import NOT_GIVEN
+        from llm_client import request_timeout
+        
+        if timeout is not None and timeout <= 0:
+            # Нулевой тайм-аут означал бы запрос без ограничения времени
+            raise DeadlineExceeded(BUDGET_LLM, 0)
+        
+        options = {"system": system} if system else {}
+        extractor = FenceExtractor() if on_block else None
+        async with self.client.messages.stream(
+            model=CLAUDE_MODEL,
+            max_tokens=CLAUDE_MAX_TOKENS,
+            messages=messages,
+            timeout=request_timeout(timeout) if timeout is not None else NOT_GIVEN,
+            **options
+        ) as stream:
+            async for text in stream.text_stream:
+                if abort_event is not None and abort_event.is_set():
+                    # Выход из контекста закрывает HTTP-соединение. Прерывание - это отмена,
+                    # а не ответ: предохранитель и учет токенов его не видят
+                    logger.info("Потоковый запрос к Claude прерван")
+                    raise asyncio.CancelledError()
+                if progress:
+                    progress.add_output(text)
+                if extractor:
+                    for language, content in extractor.feed(text):
+                        on_block(language, content)
+            if extractor:
+                # Закрывающая ограда в последней строке ответа без перевода строки
+                for language, content in extractor.finish():
+                    on_block(language, content)
+            return await stream.get_final_message()
+    
+    async def warm_up(self):
+        """Заранее устанавливает соединение с Anthropic API"""
+        from llm_client import warm_up
+        
+        await warm_up(self.client)
+    
+    async def _download_image(self, file_id, deadline):
+        """
+        Загружает и подготавливает скриншот в пределах бюджета этапа загрузки
+        
+        При наличии Pillow скриншот уменьшается и пережимается (см.
+        image_preprocessor). Без него изображение загружается фрагментами и
+        сразу кодируется в base64, исходные байты целиком в памяти не хранятся.
+        
+        Args:
+            file_id: file_id скриншота в Telegram
+            deadline: Deadline запроса
+            
+        Returns:
+            tuple: (изображение в base64, MIME-тип изображения, ImageFingerprint исходного скриншота)
+            
+        Raises:
+            FileTooLargeError: Если скриншот больше IMAGE_MAX_BYTES
+        """
+        from image_preprocessor import detect_media_type
+        from result_cache import ImageFingerprint
+        
+        preprocessor = self.image_preprocessor
+        
+        async def download():
+            # file_path берется из кэша, соединение - из общего пула
+            if not preprocessor.available:
+                encoder = Base64StreamEncoder()
+                img_base64 = await telegram_http.download_file(
+                    file_id, timeout=deadline.budget(BUDGET_DOWNLOAD), max_bytes=IMAGE_MAX_BYTES, encoder=encoder
+                )
+                fingerprint = ImageFingerprint(encoder.digest.hexdigest())
+                return img_base64, detect_media_type(encoder.header), fingerprint
+            
+            img_buffer = await telegram_http.download_file(
+                file_id, timeout=deadline.budget(BUDGET_DOWNLOAD), max_bytes=IMAGE_MAX_BYTES
+            )
+            # Обработка изображения загружает процессор, выполняем ее вне цикла событий
+            prepared = await asyncio.to_thread(preprocessor.process, img_buffer)
+            fingerprint = ImageFingerprint(hashlib.sha256(img_buffer.getbuffer()).hexdigest(), prepared.perceptual_hash)
+            del img_buffer
+            return base64.b64encode(prepared.data).decode('ascii'), prepared.media_type, fingerprint
+        
+        return await deadline.run(BUDGET_DOWNLOAD, download())
+    
+    @staticmethod
+    def _cached_system_prompt(prompt):
+        """
+        Системный промпт со статическим шаблоном, помеченным для кэширования на стороне API
+        
+        Шаблон одинаков во всех запросах одной версии, поэтому повторные запросы
+        читают его из кэша промптов, а заново обрабатываются только скриншот и
+        текст пользователя.
+        
+        Args:
+            prompt: текст шаблона промпта
+            
+        Returns:
+            list: Блоки системного промпта для Messages API
+        """
+        return [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+    
+    async def _request_claude(self, messages, deadline, progress=None, abort_event=None, prevalidated=None,
+                              system=None, template_name=None):
+        """
+        Отправляет потоковый запрос к Claude в пределах бюджета этапа генерации
+        
+        Такой же запрос (модель, max_tokens, версия промптов, сообщения),
+        уже выполненный ранее, получает ответ из кэша. Временные ошибки API
+        повторяются в пределах того же бюджета (см. llm_resilience). Расход
+        токенов, включая чтение и запись кэша промптов, записывается в метрики
+        по шаблону и версии промптов.
+        
+        Args:
+            messages: сообщения для Messages API
+            deadline: Deadline запроса
+            progress: ProgressReporter для отображения количества токенов
+            abort_event: threading.Event для прерывания запроса
+            prevalidated: словарь для проверок файлов, запускаемых во время генерации
+                          (см. _make_block_handler); при повторе запроса очищается
+            system: блоки системного промпта
+            template_name: имя шаблона промпта (для метрик)
+            
+        Returns:
+            str: Текст ответа Claude
+            
+        Raises:
+            LLMError: Если API недоступен, попытки исчерпаны или разомкнут предохранитель
+        """
+        from llm_cache import LLMResponseCache
+        
+        prompt_version = self.prompts.get("version")
+        cache_key = LLMResponseCache.make_key(CLAUDE_MODEL, CLAUDE_MAX_TOKENS, prompt_version, messages, system)
+        cached_text = await asyncio.to_thread(self.llm_cache.get, cache_key)
+        if cached_text is not None:
+            return cached_text
+        
+        budget = deadline.budget(BUDGET_LLM)
+        started_at = time.monotonic()
+        
+        def time_left():
+            return budget - (time.monotonic() - started_at)
+        
+        def attempt():
+            if progress:
+                # Токены прерванной попытки не относятся к новому ответу
+                progress.reset_output()
+            on_block = None
+            if prevalidated is not None:
+                # Блоки прерванной попытки больше не нужны, новая попытка проверяет свои
+                self._cancel_prevalidation(prevalidated)
+                on_block = self._make_block_handler(prevalidated)
+            # Каждая попытка ограничена временем, оставшимся от бюджета этапа
+            return self._stream_message(messages, progress, abort_event, time_left(), on_block, system)
+        
+        # При превышении бюджета отмена корутины закрывает потоковое соединение
+        response = await deadline.run(BUDGET_LLM, self.resilience.call(attempt, time_left))
+        
+        usage = {
+            "input_tokens": response.usage.input_tokens,
+            "output_tokens": response.usage.output_tokens,
+            "cache_read_input_tokens": getattr(response.usage, "cache_read_input_tokens", None) or 0,
+            "cache_creation_input_tokens": getattr(response.usage, "cache_creation_input_tokens", None) or 0
+        }
+        logger.info(
+            f"Токены запроса: вход {usage['input_tokens']}, выход {usage['output_tokens']}, "
+            f"из кэша промпта {usage['cache_read_input_tokens']}, записано в кэш {usage['cache_creation_input_tokens']}"
+        )
+        await asyncio.to_thread(
+            self.metrics.record_prompt_cache_usage,
+            template_name or "unknown", prompt_version, usage, time.monotonic() - started_at
+        )
+        
+        response_text = response.content[0].text
+        await asyncio.to_thread(self.llm_cache.put, cache_key, response_text)
+        return response_text
+    
+    def _make_block_handler(self, prevalidated):
+        """
+        Создает обработчик блоков кода, запускающий проверку файла во время генерации
+        
+        Первый блок каждого языка сопоставляется с файлом так же, как в extract_files,
+        и сразу отправляется на проверку и исправление в пул потоков, пока Claude
+        пишет остальные файлы. Улучшения, зависящие от всего набора (Run-Optimizer.ps1,
+        раздел README об альтернативном запуске), выполняются позже в _validate_files.
+        
+        Обработчик вызывается в цикле событий (из _stream_message), поэтому
+        проверка запускается обычной задачей asyncio.
+        
+        Args:
+            prevalidated: словарь, куда записывается имя файла -> (содержимое, задача проверки)
+            
+        Returns:
+            function: Обработчик on_block(язык, содержимое) для _stream_message
+        """
+        def on_block(language, content):
+            if language == "powershell":
+                filename, content = "WindowsOptimizer.ps1", self._prepare_powershell(content)
+            elif language == "batch":
+                filename, content = "Start-Optimizer.bat", self._prepare_batch(content)
+            elif language == "markdown":
+                filename = "README.md"
+            else:
+                return
+            if filename in prevalidated:
+                return
+            
+            task = asyncio.ensure_future(
+                asyncio.to_thread(repair_and_validate_scripts, {filename: content}, self.validator)
+            )
+            prevalidated[filename] = (content, task)
+            logger.info(f"Блок {filename} получен, проверка начата до окончания ответа")
+        
+        return on_block
+    
+    @staticmethod
+    def _cancel_prevalidation(prevalidated):
+        """
+        Отменяет проверки, запущенные во время генерации, и очищает словарь
+        
+        Проверки, еще ожидающие свободного потока, не запускаются; уже
+        выполняющиеся завершатся в потоке, но их результат не используется.
+        
+        Args:
+            prevalidated: словарь имя файла -> (содержимое, задача проверки)
+        """
+        for _, task in prevalidated.values():
+            if not task.cancel() and not task.cancelled():
+                # Результат завершенной проверки не нужен, ошибку не оставляем неполученной
+                task.exception()
+        prevalidated.clear()
+    
+    async def _validate_files(self, files, deadline, prevalidated=None):
+        """
+        Проверяет и исправляет скрипты в пределах бюджета этапа проверки
+        
+        Файлы, проверка которых уже запущена во время генерации (см.
+        _make_block_handler) и содержимое которых совпало с извлеченным,
+        повторно не проверяются. Улучшения выполняются один раз для всего
+        собранного набора, так как часть из них зависит от нескольких файлов.
+        
+        Args:
+            files: словарь с файлами
+            deadline: Deadline запроса
+            prevalidated: словарь имя файла -> (содержимое, задача проверки)
+            
+        Returns:
+            tuple: (файлы, результаты проверки, количество исправлений); если проверка
+                   не уложилась в бюджет - исходные файлы без проверки
+        """
+        prevalidated = prevalidated or {}
+        
+        async def validate():
+            pending = []
+            remaining = {}
+            for filename, content in files.items():
+                entry = prevalidated.get(filename)
+                if entry is not None and entry[0] == content:
+                    pending.append(entry[1])
+                else:
+                    remaining[filename] = content
+            if remaining:
+                pending.append(asyncio.to_thread(repair_and_validate_scripts, remaining, self.validator))
+            
+            fixed_files, validation_results, errors_corrected = {}, {}, 0
+            for fixed, results, corrected in await asyncio.gather(*pending):
+                fixed_files.update(fixed)
+                validation_results.update(results)
+                errors_corrected += corrected
+            
+            # Порядок файлов как в извлеченном наборе
+            fixed_files = {filename: fixed_files[filename] for filename in files}
+            enhanced_files = await asyncio.to_thread(self.validator.enhance_scripts, fixed_files)
+            return enhanced_files, validation_results, errors_corrected
+        
+        try:
+            return await deadline.run(BUDGET_VALIDATE, validate())
+        except DeadlineExceeded:
+            logger.warning("Проверка скриптов не уложилась в бюджет, отправляю скрипты без исправлений")
+            return files, {}, 0
+    
+    async def _handle_llm_error(self, chat_id, error, deadline, **metrics_fields):
+        """
+        Резервный вариант при недоступности Claude API: шаблонные скрипты с пояснением причины
+        
+        Args:
+            chat_id: ID чата пользователя
+            error: LLMError, из-за которой запрос не выполнен
+            deadline: Deadline запроса
+            **metrics_fields: дополнительные поля записи в метриках
+            
+        Returns:
+            dict: Словарь с файлами
+        """
+        fallback = "базовые скрипты вместо исправленных" if metrics_fields.get("is_error_fix") else "базовые скрипты оптимизации"
+        
+        if isinstance(error, LLMCreditBalanceError):
+            logger.error(f"Ошибка недостаточного баланса API: {error}")
+            notice = "К сожалению, баланс API-кредитов исчерпан. Пожалуйста, обратитесь к администратору для пополнения баланса."
+            notice += "\n\nПока что будет использован резервный подход с шаблонными скриптами."
+        elif isinstance(error, LLMCircuitOpenError):
+            logger.warning(f"Запрос к Claude не отправлен: {error}")
+            notice = f"⚠️ Claude временно недоступен. Отправляю проверенные {fallback}."
+        else:
+            logger.error(f"Claude API недоступен ({type(error).__name__}): {error}")
+            notice = f"⚠️ Claude сейчас перегружен или не отвечает. Отправляю проверенные {fallback}."
+        
+        return await self._use_template_scripts(chat_id, notice, deadline, api_error=True, **metrics_fields)
+    
+    async def _use_template_scripts(self, chat_id, notice, deadline, **metrics_fields):
+        """
+        Резервный вариант: проверенные шаблонные скрипты вместо ответа Claude
+        
+        Args:
+            chat_id: ID чата пользователя
+            notice: сообщение пользователю о причине
+            deadline: Deadline запроса
+            **metrics_fields: дополнительные поля записи в метриках
+            
+        Returns:
+            dict: Словарь с файлами
+        """
+        await outbound.send_message(chat_id, notice)
+        
+        # Используем альтернативный подход с шаблонами
+        files = self._get_template_scripts()
+        
+        # Проверяем и улучшаем шаблонные скрипты
+        fixed_files, validation_results, errors_corrected = await self._validate_files(files, deadline)
+        
+        # Обновляем статистику
+        await asyncio.to_thread(self.metrics.record_script_generation, {
+            "timestamp": datetime.now().isoformat(),
+            "errors": validation_results,
+            "error_count": sum(len(issues) for issues in validation_results.values()),
+            "fixed_count": errors_corrected,
+            "model": "template_fallback",
+            **metrics_fields
+        })
+        
+        return fixed_files
     
-    async def generate_new_script(self, message):
-        """Генерация нового скрипта оптимизации на основе скриншота системы"""
+    async def generate_new_script(self, chat_id, file_id, user_text=None, progress=None, abort_event=None, deadline=None,
+                                  response_text=None, on_response=None, fallback_file_ids=None):
+        """Генерация нового скрипта оптимизации на основе скриншота системы
+        
+        Args:
+            chat_id: ID чата пользователя
+            file_id: file_id скриншота в Telegram
+            user_text: текст пользователя для промпта
+            progress: ProgressReporter для отображения этапов обработки
+            abort_event: threading.Event для прерывания запроса к Claude
+            deadline: Deadline запроса (если None, используются бюджеты по умолчанию)
+            response_text: ранее полученный ответ Claude (загрузка и запрос к Claude пропускаются)
+            on_response: функция on_response(response_text), вызываемая сразу после получения ответа
+            fallback_file_ids: file_id больших размеров того же фото на случай, если Claude не прочитает скриншот
+        """
+        deadline = deadline or Deadline()
+        # Проверки файлов, запущенные во время генерации
+        prevalidated = {}
         
         try:
-            logger.info(f"Начинаю генерацию скрипта для пользователя {message.chat.id}")
+            logger.info(f"Начинаю генерацию скрипта для пользователя {chat_id}")
             
             # Проверяем наличие фото
-            if not message.photo:
+            if not file_id:
                 return "Не найдено изображение. Пожалуйста, отправьте скриншот системной информации."
             
-            # Получаем файл фото
-            file_id = message.photo[-1].file_id
-            file_info = bot.get_file(file_id)
-            file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file_info.file_path}"
-            
-            # Загружаем изображение
-            img_data = requests.get(file_url).content
+            # Формируем сообщение для API
+            user_message = user_text or "Создай скрипт оптимизации Windows"
+            prompt_version = self.prompts.get("version")
+            fingerprint = None
             
-            # Кодируем изображение в base64
-            img_base64 = base64.b64encode(img_data).decode('utf-8')
+            if response_text is not None:
+                logger.info("Использую сохраненный ответ Claude, повторный запрос не нужен")
+            else:
+                if progress:
+                    await progress.set_stage(STAGE_DOWNLOADING)
             
-            # Формируем сообщение для API
-            user_message = user_messages.get(message.chat.id, "Создай скрипт оптимизации Windows")
-            
-            # Используем оптимизированный промпт, если он доступен
-            prompt = self.prompts.get("OPTIMIZATION_PROMPT_TEMPLATE", OPTIMIZATION_PROMPT_TEMPLATE)
-            
-            messages = [
-                {
-                    "role": "user", 
-                    "content": [
-                        {"type": "text", "text": prompt + "\n\n" + user_message},
-                        {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": img_base64}}
-                    ]
-                }
-            ]
+                # Загружаем скриншот
+                try:
+                    img_base64, media_type, fingerprint = await self._download_image(file_id, deadline)
+                except DeadlineExceeded:
+                    return "Не удалось загрузить скриншот из Telegram. Пожалуйста, отправьте его еще раз."
+                except FileTooLargeError as e:
+                    logger.warning(f"Скриншот пользователя {chat_id} отклонен: {e}")
+                    return "Скриншот слишком большой. Пожалуйста, отправьте его как фото, а не файлом, или уменьшите размер."
+                
+                # Такой же скриншот с тем же запросом уже обрабатывался - отдаем проверенный набор
+                cached_files = await asyncio.to_thread(self.result_cache.get, fingerprint, prompt_version, user_message)
+                if cached_files:
+                    logger.info(f"Скрипты для пользователя {chat_id} взяты из кэша, запрос к Claude не нужен")
+                    return cached_files
+            
+                # Используем оптимизированный промпт, если он доступен
+                prompt = self.prompts.get("OPTIMIZATION_PROMPT_TEMPLATE", OPTIMIZATION_PROMPT_TEMPLATE)
+                # Статический шаблон - в кэшируемом системном промпте, в сообщении только текст пользователя и скриншот
+                system = self._cached_system_prompt(prompt)
+            
+                messages = [
+                    {
+                        "role": "user", 
+                        "content": [
+                            {"type": "text", "text": user_message + (UNREADABLE_IMAGE_HINT if fallback_file_ids else "")},
+                            {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": img_base64}}
+                        ]
+                    }
+                ]
             
-            logger.info("Отправляю запрос к Claude API...")
+                logger.info("Отправляю запрос к Claude API...")
             
-            try:
-                # Отправляем запрос к Claude
-                response = await asyncio.to_thread(
-                    self.client.messages.create,
-                    model="claude-3-opus-20240229",
-                    max_tokens=4000,
-                    messages=messages
-                )
+                try:
+                    if progress:
+                        await progress.set_stage(STAGE_GENERATING)
                 
-                # Обрабатываем ответ
-                response_text = response.content[0].text
+                    # Отправляем потоковый запрос к Claude
+                    response_text = await self._request_claude(
+                        messages, deadline, progress, abort_event,
+                        prevalidated=prevalidated,
+                        system=system,
+                        template_name="OPTIMIZATION_PROMPT_TEMPLATE"
+                    )
                 
-                logger.info(f"Получен ответ от Claude API, длина: {len(response_text)} символов")
-            except Exception as api_error:
-                # Проверяем ошибку баланса API
-                error_str = str(api_error)
-                if "credit balance is too low" in error_str or "Your credit balance is too low" in error_str:
-                    logger.error(f"Ошибка недостаточного баланса API: {api_error}")
-                    error_message = "К сожалению, баланс API-кредитов исчерпан. Пожалуйста, обратитесь к администратору для пополнения баланса."
-                    error_message += "\n\nПока что будет использован резервный подход с шаблонными скриптами."
-                    bot.send_message(message.chat.id, error_message)
-                    
-                    # Используем альтернативный подход с шаблонами
-                    files = self._get_template_scripts()
-                    
-                    # Проверяем и улучшаем шаблонные скрипты
-                    fixed_files, validation_results, errors_corrected = validate_and_fix_scripts(files)
-                    
-                    # Обновляем статистику
-                    self.metrics.record_script_generation({
-                        "timestamp": datetime.now().isoformat(),
-                        "errors": validation_results,
-                        "error_count": sum(len(issues) for issues in validation_results.values()),
-                        "fixed_count": errors_corrected,
-                        "model": "template_fallback",
-                        "api_error": True
-                    })
-                    
-                    # Сохраняем файлы для последующей отправки
-                    user_files[message.chat.id] = fixed_files
-                    
-                    return fixed_files
-                else:
+                    logger.info(f"Получен ответ от Claude API, длина: {len(response_text)} символов")
+                    if fallback_file_ids and is_unreadable_response(response_text):
+                        logger.info("Claude не смог прочитать скриншот, повторяю с большим размером фото")
+                        return await self.generate_new_script(
+                            chat_id, fallback_file_ids[0], user_text, progress, abort_event, deadline,
+                            on_response=on_response, fallback_file_ids=fallback_file_ids[1:]
+                        )
+                    if on_response:
+                        on_response(response_text)
+                except DeadlineExceeded:
+                    logger.error("Claude API не ответил в отведенное время, использую шаблонные скрипты")
+                    return await self._use_template_scripts(
+                        chat_id,
+                        "⏱ Claude отвечает слишком долго. Отправляю проверенные базовые скрипты оптимизации.",
+                        deadline,
+                        api_timeout=True
+                    )
+                except LLMError as api_error:
+                    # Баланс исчерпан, API недоступен после повторов или разомкнут предохранитель
+                    return await self._handle_llm_error(chat_id, api_error, deadline)
+                except Exception as api_error:
                     # Другая ошибка API - просто пробрасываем исключение
                     logger.error(f"Ошибка API: {api_error}")
                     raise api_error
             
             # Извлекаем файлы из ответа
-            files = self.extract_files(response_text)
+            try:
+                files = await deadline.run(BUDGET_EXTRACT, asyncio.to_thread(self.extract_files, response_text))
+            except DeadlineExceeded:
+                return await self._use_template_scripts(
+                    chat_id,
+                    "⏱ Не удалось вовремя разобрать ответ Claude. Отправляю проверенные базовые скрипты оптимизации.",
+                    deadline,
+                    api_timeout=True
+                )
             
             if not files:
                 logger.warning("Не удалось извлечь файлы из ответа API")
                 return "Не удалось создать скрипты оптимизации. Пожалуйста, попробуйте еще раз или отправьте другое изображение."
             
+            if progress:
+                await progress.set_stage(STAGE_VALIDATING)
+            
             # Дополнительная проверка и исправление скриптов
-            fixed_files, validation_results, errors_corrected = validate_and_fix_scripts(files)
+            fixed_files, validation_results, errors_corrected = await self._validate_files(files, deadline, prevalidated)
             
             # Обновляем статистику
-            self.metrics.record_script_generation({
+            await asyncio.to_thread(self.metrics.record_script_generation, {
                 "timestamp": datetime.now().isoformat(),
                 "errors": validation_results,
                 "error_count": sum(len(issues) for issues in validation_results.values()),
                 "fixed_count": errors_corrected,
-                "model": "claude-3-opus-20240229"
+                "model": CLAUDE_MODEL
             })
             
-            # Сохраняем файлы для последующей отправки
-            user_files[message.chat.id] = fixed_files
+            # Запоминаем проверенный набор для таких же скриншотов
+            if fingerprint is not None:
+                await asyncio.to_thread(self.result_cache.put, fingerprint, prompt_version, user_message, fixed_files)
             
             return fixed_files
         
         except Exception as e:
             logger.error(f"Ошибка при генерации скрипта: {e}")
             return f"Произошла ошибка при генерации скрипта: {str(e)}"
+        finally:
+            # Прерывание, переход к шаблонам или повтор с другим фото - проверки не понадобятся
+            self._cancel_prevalidation(prevalidated)
     
     def _get_template_scripts(self, os_type='windows'):
         """Получение шаблонных скриптов в случае ошибки API
@@ -1050,6 +1457,22 @@ pause
         logger.info(f"Всего извлечено {len(template_files)} файлов из ответа API")
         return template_files
     
+    @staticmethod
+    def _prepare_powershell(content):
+        """Добавляет в PowerShell скрипт установку кодировки UTF-8, если ее нет"""
+        if "$OutputEncoding = [System.Text.Encoding]::UTF8" not in content:
+            content = "# Encoding: UTF-8\n$OutputEncoding = [System.Text.Encoding]::UTF8\n\n" + content
+        return content
+    
+    @staticmethod
+    def _prepare_batch(content):
+        """Добавляет в Batch скрипт обязательные команды @echo off и chcp 65001, если их нет"""
+        if "@echo off" not in content:
+            content = "@echo off\n" + content
+        if "chcp 65001" not in content:
+            content = content.replace("@echo off", "@echo off\nchcp 65001 >nul")
+        return content
+    
     def extract_files(self, response_text, os_type='windows'):
         """Извлечение файлов из ответа API
         
@@ -1138,22 +1561,14 @@ pause
             # Извлечение PowerShell скрипта
             ps_matches = re.findall(powershell_pattern, response_text, re.DOTALL)
             if ps_matches:
-                ps_content = ps_matches[0]
-                # Проверяем на наличие кодировки UTF-8
-                if "$OutputEncoding = [System.Text.Encoding]::UTF8" not in ps_content:
-                    ps_content = "# Encoding: UTF-8\n$OutputEncoding = [System.Text.Encoding]::UTF8\n\n" + ps_content
+                ps_content = self._prepare_powershell(ps_matches[0])
                 files["WindowsOptimizer.ps1"] = ps_content
                 logger.info(f"Извлечен PowerShell скрипт длиной {len(ps_content)} символов")
             
             # Извлечение Batch скрипта
             bat_matches = re.findall(batch_pattern, response_text, re.DOTALL)
             if bat_matches:
-                bat_content = bat_matches[0]
-                # Проверяем на наличие обязательных команд
-                if "@echo off" not in bat_content:
-                    bat_content = "@echo off\n" + bat_content
-                if "chcp 65001" not in bat_content:
-                    bat_content = bat_content.replace("@echo off", "@echo off\nchcp 65001 >nul")
+                bat_content = self._prepare_batch(bat_matches[0])
                 files["Start-Optimizer.bat"] = bat_content
                 logger.info(f"Извлечен Batch скрипт длиной {len(bat_content)} символов")
             
@@ -1174,15 +1589,11 @@ pause
                     for i, content in enumerate(alt_matches):
                         # Пытаемся определить тип файла по содержимому
                         if "function" in content and "$" in content:
-                            if "$OutputEncoding = [System.Text.Encoding]::UTF8" not in content:
-                                content = "# Encoding: UTF-8\n$OutputEncoding = [System.Text.Encoding]::UTF8\n\n" + content
+                            content = self._prepare_powershell(content)
                             files["WindowsOptimizer.ps1"] = content
                             logger.info(f"Извлечен PowerShell скрипт (альт.) длиной {len(content)} символов")
                         elif "@echo off" in content or "powershell" in content.lower():
-                            if "@echo off" not in content:
-                                content = "@echo off\n" + content
-                            if "chcp 65001" not in content:
-                                content = content.replace("@echo off", "@echo off\nchcp 65001 >nul")
+                            content = self._prepare_batch(content)
                             files["Start-Optimizer.bat"] = content
                             logger.info(f"Извлечен Batch скрипт (альт.) длиной {len(content)} символов")
                         elif "#" in content and "Windows" in content:
@@ -1206,11 +1617,19 @@ pause
         logger.info(f"Всего извлечено {len(files)} файлов из ответа API")
         return files
     
-    async def send_script_files_to_user(self, chat_id, files):
-        """Отправляет сгенерированные файлы пользователю в виде архива"""
+    async def send_script_files_to_user(self, chat_id, files, deadline=None):
+        """Отправляет сгенерированные файлы пользователю в виде архива
+        
+        Args:
+            chat_id: ID чата пользователя
+            files: словарь с файлами
+            deadline: Deadline запроса (ограничивает время отправки)
+        """
+        deadline = deadline or Deadline()
+        
         try:
             if not files:
-                bot.send_message(chat_id, "Не удалось создать файлы скриптов.")
+                await outbound.send_message(chat_id, "Не удалось создать файлы скриптов.")
                 return False
             
             # Определяем тип ОС по именам файлов
@@ -1297,20 +1716,24 @@ pause
                                 "3. Дождитесь завершения работы скрипта\n\n"\
                                 "ℹ️ Если возникнут ошибки при запуске скрипта, отправьте мне скриншот с ошибкой."
             
-            # Отправляем архив пользователю
-            bot.send_document(
-                chat_id=chat_id,
-                document=zip_buffer,
-                caption=caption,
-                visible_file_name=archive_name
-            )
+            async def send_archive():
+                # Отправляем архив пользователю
+                await outbound.send_document(
+                    chat_id=chat_id,
+                    document=zip_buffer,
+                    caption=caption,
+                    visible_file_name=archive_name
+                )
+                
+                # Отправляем дополнительное сообщение с инструкциями
+                await outbound.send_message(
+                    chat_id=chat_id,
+                    text=additional_msg,
+                    parse_mode="Markdown",
+                    priority=PRIORITY_RESULT
+                )
             
-            # Отправляем дополнительное сообщение с инструкциями
-            bot.send_message(
-                chat_id=chat_id,
-                text=additional_msg,
-                parse_mode="Markdown"
-            )
+            await deadline.run(BUDGET_SEND, send_archive())
             
             # Обновляем состояние пользователя
             user_states[chat_id] = "main_menu"
@@ -1319,91 +1742,146 @@ pause
         
         except Exception as e:
             logger.error(f"Ошибка при отправке файлов пользователю: {e}", exc_info=True)
-            bot.send_message(
+            await outbound.send_message(
                 chat_id=chat_id, 
                 text=f"❌ Произошла ошибка при отправке файлов: {str(e)}"
             )
             return False
 
-    async def fix_script_errors(self, message):
-        """Генерация скриптов с улучшенным промптом после обнаружения ошибок"""
+    async def fix_script_errors(self, chat_id, file_id, user_text=None, progress=None, abort_event=None, deadline=None,
+                                response_text=None, on_response=None, fallback_file_ids=None):
+        """Генерация скриптов с улучшенным промптом после обнаружения ошибок
+        
+        Args:
+            chat_id: ID чата пользователя
+            file_id: file_id скриншота ошибки в Telegram
+            user_text: текст пользователя для промпта
+            progress: ProgressReporter для отображения этапов обработки
+            abort_event: threading.Event для прерывания запроса к Claude
+            deadline: Deadline запроса (если None, используются бюджеты по умолчанию)
+            response_text: ранее полученный ответ Claude (загрузка и запрос к Claude пропускаются)
+            on_response: функция on_response(response_text), вызываемая сразу после получения ответа
+            fallback_file_ids: file_id больших размеров того же фото на случай, если Claude не прочитает скриншот
+        """
+        deadline = deadline or Deadline()
+        # Проверки файлов, запущенные во время генерации
+        prevalidated = {}
+        
         try:
-            logger.info(f"Начинаю исправление ошибок в скрипте для пользователя {message.chat.id}")
+            logger.info(f"Начинаю исправление ошибок в скрипте для пользователя {chat_id}")
             
             # Проверяем наличие фото
-            if not message.photo:
+            if not file_id:
                 return "Не найдено изображение с ошибкой. Пожалуйста, отправьте скриншот ошибки."
             
-            # Получаем файл фото
-            file_id = message.photo[-1].file_id
-            file_info = bot.get_file(file_id)
-            file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file_info.file_path}"
-            
-            # Загружаем изображение
-            img_data = requests.get(file_url).content
-            
-            # Кодируем изображение в base64
-            img_base64 = base64.b64encode(img_data).decode('utf-8')
-            
-            # Формируем сообщение для API
-            user_message = user_messages.get(message.chat.id, "Исправь ошибки в скрипте, показанные на скриншоте")
-            
-            # Используем оптимизированный промпт исправления ошибок
-            prompt = self.prompts.get("ERROR_FIX_PROMPT_TEMPLATE", ERROR_FIX_PROMPT_TEMPLATE)
-            
-            messages = [
-                {
-                    "role": "user", 
-                    "content": [
-                        {"type": "text", "text": prompt + "\n\n" + user_message},
-                        {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": img_base64}}
-                    ]
-                }
-            ]
+            if response_text is not None:
+                logger.info("Использую сохраненный ответ Claude, повторный запрос не нужен")
+            else:
+                if progress:
+                    await progress.set_stage(STAGE_DOWNLOADING)
             
-            logger.info("Отправляю запрос к Claude API для исправления ошибок...")
+                # Загружаем скриншот
+                try:
+                    img_base64, media_type, _ = await self._download_image(file_id, deadline)
+                except DeadlineExceeded:
+                    return "Не удалось загрузить скриншот из Telegram. Пожалуйста, отправьте его еще раз."
+                except FileTooLargeError as e:
+                    logger.warning(f"Скриншот пользователя {chat_id} отклонен: {e}")
+                    return "Скриншот слишком большой. Пожалуйста, отправьте его как фото, а не файлом, или уменьшите размер."
+            
+                # Формируем сообщение для API
+                user_message = user_text or "Исправь ошибки в скрипте, показанные на скриншоте"
+            
+                # Используем оптимизированный промпт исправления ошибок
+                prompt = self.prompts.get("ERROR_FIX_PROMPT_TEMPLATE", ERROR_FIX_PROMPT_TEMPLATE)
+                # Статический шаблон - в кэшируемом системном промпте, в сообщении только текст пользователя и скриншот
+                system = self._cached_system_prompt(prompt)
+            
+                messages = [
+                    {
+                        "role": "user", 
+                        "content": [
+                            {"type": "text", "text": user_message + (UNREADABLE_IMAGE_HINT if fallback_file_ids else "")},
+                            {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": img_base64}}
+                        ]
+                    }
+                ]
             
-            # Отправляем запрос к Claude
-            response = await asyncio.to_thread(
-                self.client.messages.create,
-                model="claude-3-opus-20240229",
-                max_tokens=4000,
-                messages=messages
-            )
+                logger.info("Отправляю запрос к Claude API для исправления ошибок...")
             
-            # Обрабатываем ответ
-            response_text = response.content[0].text
+                if progress:
+                    await progress.set_stage(STAGE_GENERATING)
             
-            logger.info(f"Получен ответ от Claude API, длина: {len(response_text)} символов")
+                # Отправляем потоковый запрос к Claude
+                try:
+                    response_text = await self._request_claude(
+                        messages, deadline, progress, abort_event,
+                        prevalidated=prevalidated,
+                        system=system,
+                        template_name="ERROR_FIX_PROMPT_TEMPLATE"
+                    )
+                
+                    logger.info(f"Получен ответ от Claude API, длина: {len(response_text)} символов")
+                    if fallback_file_ids and is_unreadable_response(response_text):
+                        logger.info("Claude не смог прочитать скриншот, повторяю с большим размером фото")
+                        return await self.fix_script_errors(
+                            chat_id, fallback_file_ids[0], user_text, progress, abort_event, deadline,
+                            on_response=on_response, fallback_file_ids=fallback_file_ids[1:]
+                        )
+                    if on_response:
+                        on_response(response_text)
+                except DeadlineExceeded:
+                    logger.error("Claude API не ответил в отведенное время, использую шаблонные скрипты")
+                    return await self._use_template_scripts(
+                        chat_id,
+                        "⏱ Claude отвечает слишком долго. Отправляю проверенные базовые скрипты вместо исправленных.",
+                        deadline,
+                        api_timeout=True,
+                        is_error_fix=True
+                    )
+                except LLMError as api_error:
+                    return await self._handle_llm_error(chat_id, api_error, deadline, is_error_fix=True)
             
             # Извлекаем файлы из ответа
-            files = self.extract_files(response_text)
+            try:
+                files = await deadline.run(BUDGET_EXTRACT, asyncio.to_thread(self.extract_files, response_text))
+            except DeadlineExceeded:
+                return await self._use_template_scripts(
+                    chat_id,
+                    "⏱ Не удалось вовремя разобрать ответ Claude. Отправляю проверенные базовые скрипты вместо исправленных.",
+                    deadline,
+                    api_timeout=True,
+                    is_error_fix=True
+                )
             
             if not files:
                 logger.warning("Не удалось извлечь исправленные файлы из ответа API")
                 return "Не удалось исправить ошибки в скриптах. Пожалуйста, попробуйте еще раз или отправьте другое изображение."
             
+            if progress:
+                await progress.set_stage(STAGE_VALIDATING)
+            
             # Дополнительная проверка и исправление скриптов
-            fixed_files, validation_results, errors_corrected = validate_and_fix_scripts(files)
+            fixed_files, validation_results, errors_corrected = await self._validate_files(files, deadline, prevalidated)
             
             # Обновляем статистику
-            self.metrics.record_script_generation({
+            await asyncio.to_thread(self.metrics.record_script_generation, {
                 "timestamp": datetime.now().isoformat(),
                 "errors": validation_results,
                 "error_count": sum(len(issues) for issues in validation_results.values()),
                 "fixed_count": errors_corrected,
-                "model": "claude-3-opus-20240229",
+                "model": CLAUDE_MODEL,
                 "is_error_fix": True
             })
             
-            # Сохраняем файлы для последующей отправки
-            user_files[message.chat.id] = fixed_files
-            
             return fixed_files
         
         except Exception as e:
             logger.error(f"Ошибка при исправлении скрипта: {e}", exc_info=True)
             return f"Произошла ошибка при исправлении скрипта: {str(e)}"
+        finally:
+            # Прерывание, переход к шаблонам или повтор с другим фото - проверки не понадобятся
+            self._cancel_prevalidation(prevalidated)
     
     def update_error_stats(self, validation_results):
         """
@@ -1414,13 +1892,32 @@ pause
         """
         self.metrics.record_validation_results(
             validation_results=validation_results,
-            model_name="claude-3-opus-20240229",
+            model_name=CLAUDE_MODEL,
             fixed_count=0  # Здесь можно указать количество исправленных ошибок, если оно известно
         )
 
+# Общий экземпляр конвейера генерации для всех обработчиков
+_optimization_bot = None
+_warm_up_task = None
+_optimization_bot_lock = threading.Lock()
+
+def get_optimization_bot():
+    """
+    Возвращает общий для процесса экземпляр OptimizationBot
+    
+    Экземпляр создается один раз (при запуске или первом обращении) и
+    переиспользуется всеми обработчиками.
+    """
+    global _optimization_bot
+    if _optimization_bot is None:
+        with _optimization_bot_lock:
+            if _optimization_bot is None:
+                _optimization_bot = OptimizationBot(ANTHROPIC_API_KEY)
+    return _optimization_bot
+
 # Обработчик команды /start
 @bot.message_handler(commands=['start'])
-def cmd_start(message):
+async def cmd_start(message):
     """Начало взаимодействия с ботом"""
     try:
         # Сбрасываем все предыдущие состояния пользователя
@@ -1433,7 +1930,7 @@ def cmd_start(message):
         markup.add(btn1, btn2)
         
         # Приветственное сообщение
-        bot.send_message(
+        await outbound.send_message(
             message.chat.id,
             f"👋 Привет, {message.from_user.first_name}!\n\n"
             "Я бот для создания скриптов оптимизации Windows.\n\n"
@@ -1444,11 +1941,11 @@ def cmd_start(message):
         logger.info(f"Пользователь {message.chat.id} запустил бота")
     except Exception as e:
         logger.error(f"Ошибка в обработчике команды /start: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка при запуске бота. Пожалуйста, попробуйте снова.")
+        await outbound.send_message(message.chat.id, "Произошла ошибка при запуске бота. Пожалуйста, попробуйте снова.")
 
 # Обработчик для выбора пользователя
 @bot.message_handler(func=lambda message: user_states.get(message.chat.id) == "main_menu")
-def handle_user_choice(message):
+async def handle_user_choice(message):
     try:
         if "создать скрипт" in message.text.lower():
             # Переходим к созданию скрипта
@@ -1458,7 +1955,7 @@ def handle_user_choice(message):
             user_messages[message.chat.id] = "Создай скрипт оптимизации Windows на основе этого скриншота"
             
             # Запрашиваем скриншот
-            bot.send_message(
+            await outbound.send_message(
                 message.chat.id,
                 "📸 Отправьте скриншот с информацией о вашей системе (например, из приложения 'Сведения о системе' или 'Диспетчер задач').",
                 reply_markup=types.ReplyKeyboardRemove()
@@ -1474,7 +1971,7 @@ def handle_user_choice(message):
             user_messages[message.chat.id] = "Исправь ошибки в скрипте, показанные на этом скриншоте"
             
             # Запрашиваем скриншот с ошибкой
-            bot.send_message(
+            await outbound.send_message(
                 message.chat.id,
                 "📸 Отправьте скриншот с ошибкой, которую нужно исправить.",
                 reply_markup=types.ReplyKeyboardRemove()
@@ -1483,17 +1980,17 @@ def handle_user_choice(message):
             logger.info(f"Пользователь {message.chat.id} выбрал исправление ошибок в скрипте")
             
         else:
-            bot.send_message(
+            await outbound.send_message(
                 message.chat.id,
                 "Пожалуйста, выберите один из вариантов на клавиатуре.",
             )
     except Exception as e:
         logger.error(f"Ошибка в обработчике выбора пользователя: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте снова.")
+        await outbound.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте снова.")
 
 # Обработчик команды /help
 @bot.message_handler(commands=['help'])
-def cmd_help(message):
+async def cmd_help(message):
     """Отправка справочной информации"""
     try:
         help_text = """
@@ -1521,27 +2018,31 @@ def cmd_help(message):
 
 *Важно:* Перед запуском скриптов оптимизации рекомендуется создать точку восстановления системы.
 """
-        bot.send_message(message.chat.id, help_text, parse_mode="Markdown")
+        await outbound.send_message(message.chat.id, help_text, parse_mode="Markdown")
         logger.info(f"Пользователь {message.chat.id} запросил справку")
     except Exception as e:
         logger.error(f"Ошибка в обработчике команды /help: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка при отправке справки. Пожалуйста, попробуйте снова.")
+        await outbound.send_message(message.chat.id, "Произошла ошибка при отправке справки. Пожалуйста, попробуйте снова.")
 
 # Обработчик команды /cancel
 @bot.message_handler(commands=['cancel'])
-def cmd_cancel(message):
-    """Отмена текущей операции"""
+async def cmd_cancel(message):
+    """Отмена текущей операции и выполняемых запросов пользователя"""
     try:
         # Сбрасываем состояние пользователя
         user_states[message.chat.id] = "main_menu"
         
+        # Прерываем ожидающие и выполняемые задачи: запрос к Claude, проверка и упаковка не продолжатся
+        for job in job_queue.find_in_flight(message.chat.id):
+            await cancel_job(job, "❌ Запрос отменен.")
+        
         # Возвращаем главное меню
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=1)
         btn1 = types.KeyboardButton("🔧 Создать скрипт оптимизации")
         btn2 = types.KeyboardButton("🔨 Исправить ошибки в скрипте")
         markup.add(btn1, btn2)
         
-        bot.send_message(
+        await outbound.send_message(
             message.chat.id, 
             "❌ Текущая операция отменена. Выберите, что вы хотите сделать:",
             reply_markup=markup
@@ -1550,172 +2051,328 @@ def cmd_cancel(message):
         logger.info(f"Пользователь {message.chat.id} отменил текущую операцию")
     except Exception as e:
         logger.error(f"Ошибка в обработчике команды /cancel: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка при отмене операции. Пожалуйста, попробуйте снова.")
+        await outbound.send_message(message.chat.id, "Произошла ошибка при отмене операции. Пожалуйста, попробуйте снова.")
+
+async def cancel_job(job, status_text):
+    """
+    Отменяет задачу и сообщает об этом в ее статусном сообщении
+    
+    Args:
+        job (Job): Задача
+        status_text (str): Итоговый текст статусного сообщения
+    """
+    if not job_queue.cancel(job):
+        return
+    
+    # Останавливаем обновление прогресса, чтобы оно не перезаписало итоговый текст
+    if job.progress:
+        await job.progress.finish()
+    await edit_or_send(job.chat_id, job.status_message_id, status_text)
+
+def get_main_menu_markup():
+    """Создает клавиатуру главного меню"""
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=1)
+    btn1 = types.KeyboardButton("🔧 Создать скрипт оптимизации")
+    btn2 = types.KeyboardButton("🔨 Исправить ошибки в скрипте")
+    markup.add(btn1, btn2)
+    return markup
+
+async def edit_or_send(chat_id, message_id, text):
+    """Редактирует сообщение о статусе, а если это невозможно - отправляет новое"""
+    try:
+        await outbound.edit_message_text(text, chat_id, message_id)
+    except ApiTelegramException as api_error:
+        if "message can't be edited" in str(api_error):
+            logger.warning(f"Не удалось отредактировать сообщение - сообщение не может быть отредактировано")
+            # Отправляем новое сообщение вместо редактирования
+            await outbound.send_message(chat_id, text)
+        else:
+            raise
+    except Exception as edit_error:
+        logger.warning(f"Не удалось отредактировать сообщение: {edit_error}")
+        # Отправляем новое сообщение вместо редактирования
+        await outbound.send_message(chat_id, text)
+
+def make_dedup_key(file_unique_id, user_text):
+    """
+    Формирует ключ для поиска повторной отправки того же запроса
+
+    Args:
+        file_unique_id (str): Постоянный идентификатор файла скриншота
+        user_text (str): Текст пользователя для промпта
+
+    Returns:
+        tuple: (file_unique_id изображения, нормализованный текст) или None
+    """
+    if not file_unique_id:
+        return None
+
+    # file_unique_id одинаков для одного и того же файла при повторной отправке
+    text = " ".join((user_text or "").lower().split())
+    return (file_unique_id, text)
+
+# Заголовки статусного сообщения во время обработки
+PROGRESS_HEADERS = {
+    JOB_KIND_GENERATE: "🔄 Генерирую скрипты оптимизации Windows",
+    JOB_KIND_FIX: "🔍 Исправляю ошибки по скриншоту"
+}
+
+def format_queue_position(position):
+    """Формирует текст о позиции задачи в очереди"""
+    if position == 0:
+        return "Запрос принят, начинаю обработку."
+    return f"Запрос поставлен в очередь. Ваша позиция: {position}."
+
+def select_photo_sizes(photo_sizes, min_width=None, min_height=None):
+    """
+    Выбирает наименьший размер фото, на котором текст еще читается
+    
+    Args:
+        photo_sizes (list): PhotoSize из message.photo
+        min_width (int, optional): Минимум по длинной стороне (PHOTO_MIN_WIDTH)
+        min_height (int, optional): Минимум по короткой стороне (PHOTO_MIN_HEIGHT)
+    
+    Returns:
+        list: Выбранный PhotoSize и все большие размеры (от меньшего к большему)
+    """
+    min_width = min_width or PHOTO_MIN_WIDTH
+    min_height = min_height or PHOTO_MIN_HEIGHT
+    sizes = sorted(photo_sizes, key=lambda size: size.width * size.height)
+    
+    for index, size in enumerate(sizes):
+        if max(size.width, size.height) >= min_width and min(size.width, size.height) >= min_height:
+            return sizes[index:]
+    # Ни один размер не дотягивает до минимума - берем самый большой
+    return sizes[-1:]
+
+async def enqueue_job(message, kind, status_text):
+    """
+    Ставит задачу в очередь и сообщает пользователю его позицию
+
+    Args:
+        message: Сообщение Telegram со скриншотом
+        kind (str): Тип задачи (JOB_KIND_GENERATE или JOB_KIND_FIX)
+        status_text (str): Текст сообщения о начале обработки
+    """
+    # Запросы администраторов обрабатываются в отдельном, самом приоритетном классе
+    is_admin = message.from_user is not None and message.from_user.id in ADMIN_USER_IDS
+    # Больший размер фото загружается, только если Claude не прочитает выбранный
+    photo, *fallback_sizes = select_photo_sizes(message.photo)
+    job = Job(
+        kind,
+        message.chat.id,
+        photo.file_id,
+        user_text=message.caption or user_messages.get(message.chat.id),
+        priority=PRIORITY_ADMIN if is_admin else None,
+        file_unique_id=photo.file_unique_id,
+        user_id=message.from_user.id if message.from_user else None,
+        fallback_file_ids=[size.file_id for size in fallback_sizes]
+    )
+    job.dedup_key = make_dedup_key(job.file_unique_id, job.user_text)
+    job.progress = ProgressReporter(outbound.edit_message_text, job.chat_id, None, header=PROGRESS_HEADERS[kind])
+
+    # Тот же скриншот с тем же текстом уже в обработке - не запускаем повторный запрос к Claude
+    leader = job_queue.find_duplicate(job)
+    if leader is not None:
+        job_queue.attach_duplicate(leader)
+        await outbound.send_message(
+            message.chat.id,
+            "⏳ Этот скриншот уже обрабатывается. Результат придет в этот чат, отправлять его повторно не нужно."
+        )
+        return leader
+
+    # Новый запрос заменяет предыдущий запрос того же типа
+    if SUPERSEDE_JOBS:
+        for previous in job_queue.find_in_flight(message.chat.id, kind):
+            await cancel_job(previous, "↩️ Запрос отменен: вы отправили новый скриншот.")
+
+    try:
+        position = job_queue.submit(job)
+    except QueueFullError:
+        logger.warning(f"Очередь переполнена, задача пользователя {message.chat.id} отклонена")
+        await outbound.send_message(
+            message.chat.id,
+            "⚠️ Сейчас слишком много запросов. Пожалуйста, повторите попытку через несколько минут."
+        )
+        return None
+
+    status_msg = await outbound.send_message(
+        message.chat.id,
+        f"{status_text}\n\n{format_queue_position(position)}",
+        reply_markup=types.ReplyKeyboardRemove()
+    )
+    job.status_message_id = job.progress.message_id = status_msg.message_id
+    job_queue.save_status_message(job)
+    return job
 
 # Обработчик для скриншотов с ошибками
 @bot.message_handler(content_types=['photo'], func=lambda message: user_states.get(message.chat.id) == "waiting_for_error_screenshot")
-def process_error_photo(message):
-    """Исправление ошибок в скрипте на основе скриншота ошибки"""
+async def process_error_photo(message):
+    """Ставит в очередь исправление ошибок в скрипте на основе скриншота ошибки"""
     try:
-        # Сообщаем пользователю, что начали обработку
-        processing_msg = bot.send_message(
+        await enqueue_job(message, JOB_KIND_FIX, "🔍 Анализирую ошибку на скриншоте...")
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике фото с ошибкой: {e}", exc_info=True)
+        await outbound.send_message(
             message.chat.id,
-            "🔍 Анализирую ошибку на скриншоте...",
-            reply_markup=types.ReplyKeyboardRemove()
+            f"❌ Произошла ошибка при обработке фото: {str(e)}\n\nПопробуйте отправить другой скриншот или вернитесь в главное меню с помощью команды /cancel."
+        )
+
+# Обработчик для скриншотов с системной информацией
+@bot.message_handler(content_types=['photo'], func=lambda message: user_states.get(message.chat.id) == "waiting_for_screenshot")
+async def process_photo(message):
+    """Ставит в очередь генерацию скриптов на основе скриншота системы"""
+    try:
+        user_id = message.from_user.id
+        logger.info(f"Обработка фото от пользователя {user_id}")
+        
+        # Проверка наличия фото
+        if not message.photo:
+            logger.warning(f"Пользователь {user_id} отправил сообщение без фото")
+            await outbound.send_message(message.chat.id, "⚠️ Пожалуйста, отправьте скриншот в виде фотографии, а не документа.")
+            return
+        
+        await enqueue_job(
+            message,
+            JOB_KIND_GENERATE,
+            "🔄 Начинаю генерацию скриптов оптимизации Windows на основе скриншота...\n\n"
+            "⏳ Это может занять до 2-3 минут. Пожалуйста, подождите."
         )
         
-        # Создаем экземпляр бота
-        optimization_bot = OptimizationBot(ANTHROPIC_API_KEY)
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике фото: {e}", exc_info=True)
+        await outbound.send_message(
+            message.chat.id,
+            "❌ Произошла ошибка при обработке фото. Пожалуйста, попробуйте еще раз или обратитесь к разработчику."
+        )
+        # Возвращаем в главное меню при ошибке
+        user_states[message.chat.id] = "main_menu"
+
+async def run_fix_job(job):
+    """Выполняет задачу исправления ошибок: загрузка, Claude, валидация, отправка архива"""
+    progress = job.progress
+    try:
+        optimization_bot = await asyncio.to_thread(get_optimization_bot)
         
-        # Вызываем асинхронную функцию через asyncio.run
-        result = asyncio.run(optimization_bot.fix_script_errors(message))
+        result = await optimization_bot.fix_script_errors(
+            job.chat_id, job.file_id, job.user_text, progress, job.abort_event, job.deadline,
+            response_text=job.response_text,
+            on_response=lambda response_text: job_queue.save_response(job, response_text),
+            fallback_file_ids=job.fallback_file_ids
+        )
+        await progress.finish()
         
         if isinstance(result, dict) and len(result) > 0:
             # Сообщаем об успешном исправлении
-            try:
-                bot.edit_message_text(
-                    "✅ Ошибки успешно исправлены! Создаю ZIP-архив с исправленными скриптами...",
-                    message.chat.id,
-                    processing_msg.message_id
-                )
-            except telebot.apihelper.ApiTelegramException as api_error:
-                if "message can't be edited" in str(api_error):
-                    logger.warning(f"Не удалось отредактировать сообщение - сообщение не может быть отредактировано")
-                    # Отправляем новое сообщение вместо редактирования
-                    bot.send_message(
-                        message.chat.id,
-                        "✅ Ошибки успешно исправлены! Создаю ZIP-архив с исправленными скриптами..."
-                    )
-                else:
-                    raise
-            except Exception as edit_error:
-                logger.warning(f"Не удалось отредактировать сообщение: {edit_error}")
-                # Отправляем новое сообщение вместо редактирования
-                bot.send_message(
-                    message.chat.id,
-                    "✅ Ошибки успешно исправлены! Создаю ZIP-архив с исправленными скриптами..."
-                )
+            await edit_or_send(
+                job.chat_id,
+                job.status_message_id,
+                "✅ Ошибки успешно исправлены! Создаю ZIP-архив с исправленными скриптами..."
+            )
             
             # Отправляем файлы пользователю
-            asyncio.run(optimization_bot.send_script_files_to_user(message.chat.id, result))
+            await optimization_bot.send_script_files_to_user(job.chat_id, result, job.deadline)
             
             # Возвращаем в главное меню
-            markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=1)
-            btn1 = types.KeyboardButton("🔧 Создать скрипт оптимизации")
-            btn2 = types.KeyboardButton("🔨 Исправить ошибки в скрипте")
-            markup.add(btn1, btn2)
-            
-            bot.send_message(
-                message.chat.id,
+            await outbound.send_message(
+                job.chat_id,
                 "Что еще вы хотите сделать?",
-                reply_markup=markup
+                reply_markup=get_main_menu_markup()
             )
             
             # Сбрасываем состояние
-            user_states[message.chat.id] = "main_menu"
+            user_states[job.chat_id] = "main_menu"
             
         else:
             # В случае ошибки
-            try:
-                bot.edit_message_text(
-                    f"❌ {result}",
-                    message.chat.id,
-                    processing_msg.message_id
-                )
-            except telebot.apihelper.ApiTelegramException as api_error:
-                if "message can't be edited" in str(api_error):
-                    logger.warning(f"Не удалось отредактировать сообщение - сообщение не может быть отредактировано")
-                    # Отправляем новое сообщение вместо редактирования
-                    bot.send_message(
-                        message.chat.id,
-                        f"❌ {result}"
-                    )
-                else:
-                    raise
-            except Exception as edit_error:
-                logger.warning(f"Не удалось отредактировать сообщение: {edit_error}")
-                # Отправляем новое сообщение вместо редактирования
-                bot.send_message(
-                    message.chat.id,
-                    f"❌ {result}"
-                )
+            await edit_or_send(job.chat_id, job.status_message_id, f"❌ {result}")
             
             # Предлагаем попробовать снова
-            bot.send_message(
-                message.chat.id,
+            await outbound.send_message(
+                job.chat_id,
                 "Пожалуйста, отправьте более четкий скриншот с ошибкой или вернитесь в главное меню с помощью команды /cancel."
             )
         
     except Exception as e:
-        logger.error(f"Ошибка в обработчике фото с ошибкой: {e}", exc_info=True)
-        bot.send_message(
-            message.chat.id,
+        logger.error(f"Ошибка при исправлении ошибок по скриншоту: {e}", exc_info=True)
+        await outbound.send_message(
+            job.chat_id,
             f"❌ Произошла ошибка при обработке фото: {str(e)}\n\nПопробуйте отправить другой скриншот или вернитесь в главное меню с помощью команды /cancel."
         )
+    finally:
+        await progress.finish()
 
-# Обработчик для скриншотов с системной информацией
-@bot.message_handler(content_types=['photo'], func=lambda message: user_states.get(message.chat.id) == "waiting_for_screenshot")
-def process_photo(message):
+async def run_generate_job(job):
+    """Выполняет задачу генерации: загрузка, Claude, валидация, отправка архива"""
+    progress = job.progress
     try:
-        user_id = message.from_user.id
-        logger.info(f"Обработка фото от пользователя {user_id}")
+        optimization_bot = await asyncio.to_thread(get_optimization_bot)
         
-        # Проверка наличия фото
-        if not message.photo:
-            logger.warning(f"Пользователь {user_id} отправил сообщение без фото")
-            bot.send_message(message.chat.id, "⚠️ Пожалуйста, отправьте скриншот в виде фотографии, а не документа.")
-            return
-        
-        # Получаем текст сообщения (если есть) для добавления к промпту
-        user_message_text = message.caption or user_messages.get(message.chat.id, "")
-        
-        # Отправляем сообщение о начале генерации
-        bot.send_message(
-            message.chat.id,
-            "🔄 Начинаю генерацию скриптов оптимизации Windows на основе скриншота...\n\n"
-            "⏳ Это может занять до 2-3 минут. Пожалуйста, подождите.",
-            parse_mode='Markdown'
+        results = await optimization_bot.generate_new_script(
+            job.chat_id, job.file_id, job.user_text, progress, job.abort_event, job.deadline,
+            response_text=job.response_text,
+            on_response=lambda response_text: job_queue.save_response(job, response_text),
+            fallback_file_ids=job.fallback_file_ids
         )
         
-        # Создаем экземпляр OptimizationBot с API ключом
-        optimization_bot = OptimizationBot(ANTHROPIC_API_KEY)
-        
-        # Запускаем процесс генерации скрипта асинхронно через asyncio.run
-        results = asyncio.run(optimization_bot.generate_new_script(message))
-        
         if isinstance(results, dict):  # Сгенерированы файлы скриптов
-            # Сохраняем файлы для дальнейшего доступа
-            user_files[message.chat.id] = results
-            
             # Отправляем файлы пользователю
             try:
-                asyncio.run(optimization_bot.send_script_files_to_user(message.chat.id, results))
-                logger.info(f"Скрипты успешно отправлены пользователю {user_id}")
+                await progress.set_stage(STAGE_PACKAGING)
+                await optimization_bot.send_script_files_to_user(job.chat_id, results, job.deadline)
+                await progress.finish("✅ Готово! Архив со скриптами отправлен ниже.")
+                logger.info(f"Скрипты успешно отправлены пользователю {job.chat_id}")
             except Exception as send_error:
                 logger.error(f"Ошибка при отправке файлов: {send_error}")
-                bot.send_message(
-                    message.chat.id, 
+                await outbound.send_message(
+                    job.chat_id, 
                     "❌ Произошла ошибка при отправке файлов. Пожалуйста, попробуйте еще раз."
                 )
         else:  # Получено сообщение об ошибке
+            await progress.finish("❌ Не удалось создать скрипты.")
             logger.error(f"Ошибка при генерации скрипта: {results}")
-            bot.send_message(message.chat.id, results)
+            await outbound.send_message(job.chat_id, results)
         
         # Сбрасываем состояние пользователя на главное меню
-        user_states[message.chat.id] = "main_menu"
+        user_states[job.chat_id] = "main_menu"
         
     except Exception as e:
-        logger.error(f"Ошибка в обработчике фото: {e}", exc_info=True)
-        bot.send_message(
-            message.chat.id,
+        logger.error(f"Ошибка при генерации скриптов по скриншоту: {e}", exc_info=True)
+        await outbound.send_message(
+            job.chat_id,
             "❌ Произошла ошибка при обработке фото. Пожалуйста, попробуйте еще раз или обратитесь к разработчику."
         )
         # Возвращаем в главное меню при ошибке
-        user_states[message.chat.id] = "main_menu"
+        user_states[job.chat_id] = "main_menu"
+    finally:
+        await progress.finish()
+
+async def run_job(job):
+    """Выполняет задачу из очереди в зависимости от ее типа"""
+    # Отсчет крайнего срока начинается, когда задача взята в работу
+    job.deadline = Deadline()
+    
+    # Начало работы над задачей видно по этапам в статусном сообщении
+    if job.kind == JOB_KIND_FIX:
+        await run_fix_job(job)
+    else:
+        await run_generate_job(job)
+
+# Очередь задач генерации и исправления скриптов
+job_queue = JobQueue(run_job)
+
+# Отменять ли выполняемый запрос, если пользователь отправил другой скриншот
+SUPERSEDE_JOBS = os.getenv("BOT_SUPERSEDE_JOBS", "false").lower() in ("1", "true", "yes")
+
+# Сколько ждать завершения выполняемых задач при остановке (в секундах)
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+
+# Как часто процесс-обработчик проверяет сигнал остановки, ожидая обновления (в секундах)
+SHARD_QUEUE_POLL_INTERVAL = 1.0
 
 # Обработчик для текстовых сообщений в других состояниях
 @bot.message_handler(func=lambda message: user_states.get(message.chat.id) in ["waiting_for_screenshot", "waiting_for_error_screenshot"])
-def handle_text_in_photo_states(message):
+async def handle_text_in_photo_states(message):
     """Обработка текстовых сообщений"""
     try:
         # Сохраняем текст сообщения
@@ -1725,27 +2382,28 @@ def handle_text_in_photo_states(message):
         state = user_states.get(message.chat.id)
         
         if state == "waiting_for_screenshot":
-            bot.send_message(
+            await outbound.send_message(
                 message.chat.id,
                 "📸 Отправьте скриншот с информацией о вашей системе.\n\n"
                 "Ваше описание сохранено и будет использовано при генерации скрипта."
             )
         elif state == "waiting_for_error_screenshot":
-            bot.send_message(
+            await outbound.send_message(
                 message.chat.id,
                 "📸 Отправьте скриншот с ошибкой, которую нужно исправить.\n\n"
                 "Ваше описание сохранено и будет использовано при исправлении скрипта."
             )
     except Exception as e:
         logger.error(f"Ошибка в обработчике текстовых сообщений: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте снова.")
+        await outbound.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте снова.")
 
 # Обработчик команды /stats
 @bot.message_handler(commands=['stats'])
-def cmd_stats(message):
+async def cmd_stats(message):
     """Отображает статистику по генерации скриптов"""
     try:
-        metrics = ScriptMetrics()
+        optimization_bot = await asyncio.to_thread(get_optimization_bot)
+        metrics = optimization_bot.metrics
         stats = metrics.get_summary()
         common_errors = metrics.get_common_errors()
         
@@ -1782,77 +2440,486 @@ def cmd_stats(message):
         stats_message += f"  • PowerShell (.ps1): {stats['ps1_errors']}\n"
         stats_message += f"  • Batch (.bat): {stats['bat_errors']}\n"
         
-        bot.send_message(message.chat.id, stats_message, parse_mode='Markdown')
+        # Добавляем статистику очереди запросов
+        queue_stats = job_queue.get_stats()
+        stats_message += f"\n📥 *Очередь запросов:*\n"
+        stats_message += f"  • Ожидают: {queue_stats['pending']}, выполняются: {queue_stats['active']}\n"
+        stats_message += f"  • Повторных отправок объединено: {queue_stats['coalesced']}\n"
+        stats_message += f"  • Отменено: {queue_stats['cancelled']}\n"
+        
+        for class_name, class_stats in queue_stats['wait_by_class'].items():
+            stats_message += (
+                f"  • Ожидание ({class_name}): в среднем {class_stats['avg_wait']:.1f} с, "
+                f"максимум {class_stats['max_wait']:.1f} с, задач {class_stats['count']}, "
+                f"в очереди {class_stats['pending']}\n"
+            )
+        
+        # Добавляем статистику сессий
+        session_stats = sessions.get_stats()
+        stats_message += f"\n👥 *Сессии:* {session_stats['sessions']}\n"
+        stats_message += (
+            f"  • Вытеснено: по простою {session_stats['evicted_ttl']}, "
+            f"по количеству {session_stats['evicted_lru']}, по объему {session_stats['evicted_memory']}\n"
+        )
+        
+        # Добавляем статистику кэша готовых скриптов
+        cache_stats = optimization_bot.result_cache.get_stats()
+        stats_message += f"\n🗂 *Кэш готовых скриптов:* {cache_stats['entries']} записей\n"
+        stats_message += (
+            f"  • Попаданий: {cache_stats['hits_exact']} точных, {cache_stats['hits_perceptual']} похожих, "
+            f"промахов {cache_stats['misses']} (доля попаданий {cache_stats['hit_rate']:.0%})\n"
+        )
+        
+        # Добавляем статистику кэша ответов Claude
+        llm_cache_stats = optimization_bot.llm_cache.get_stats()
+        stats_message += f"\n🧠 *Кэш ответов Claude:* {llm_cache_stats['entries']} записей\n"
+        stats_message += (
+            f"  • Попаданий: {llm_cache_stats['hits_memory']} из памяти, {llm_cache_stats['hits_disk']} с диска, "
+            f"промахов {llm_cache_stats['misses']} (доля попаданий {llm_cache_stats['hit_rate']:.0%})\n"
+        )
+        
+        # Добавляем статистику кэширования промптов по шаблонам и версиям
+        prompt_cache_stats = optimization_bot.metrics.get_prompt_cache_stats()
+        if prompt_cache_stats:
+            stats_message += "\n📎 *Кэш промптов Claude:*\n"
+            for template_key, template_stats in prompt_cache_stats.items():
+                stats_message += (
+                    f"  • {template_key}: запросов {template_stats['requests']}, "
+                    f"попаданий {template_stats['hit_rate']:.0%}, прочитано из кэша {template_stats['cache_read_input_tokens']} "
+                    f"и записано {template_stats['cache_creation_input_tokens']} токенов, "
+                    f"среднее время {template_stats['average_duration']:.1f} с\n"
+                )
+        
+        # Добавляем статистику доступности Claude API
+        llm_stats = optimization_bot.resilience.get_stats()
+        stats_message += f"\n🛡 *Claude API:* предохранитель {llm_stats['state']}, повторов {llm_stats['retries']}\n"
+        stats_message += (
+            f"  • Сбоев подряд: {llm_stats['consecutive_failures']}, размыканий {llm_stats['opened_count']}, "
+            f"отклонено запросов {llm_stats['rejected']}\n"
+        )
+        for error_type, count in llm_stats['errors_by_type'].items():
+            stats_message += f"  • {error_type}: {count}\n"
+        
+        # Добавляем статистику соединений с Telegram
+        http_stats = telegram_http.get_stats()
+        stats_message += f"\n🌐 *Соединения с Telegram:* пул до {http_stats['pool_size']}\n"
+        stats_message += (
+            f"  • Кэш file_path: {http_stats['file_path_entries']} записей, "
+            f"попаданий {http_stats['file_path_hits']}, промахов {http_stats['file_path_misses']}\n"
+        )
+        
+        await outbound.send_message(message.chat.id, stats_message, parse_mode='Markdown')
     
     except Exception as e:
         logger.error(f"Ошибка при получении статистики: {e}")
-        bot.send_message(message.chat.id, "❌ Не удалось загрузить статистику. Попробуйте позже.")
+        await outbound.send_message(message.chat.id, "❌ Не удалось загрузить статистику. Попробуйте позже.")
 
 # Обработчик команды для принудительного обновления промптов
 @bot.message_handler(commands=['update_prompts'])
-def cmd_update_prompts(message):
+async def cmd_update_prompts(message):
     """Обновляет промпты на основе статистики ошибок"""
     try:
-        metrics = ScriptMetrics()
-        optimizer = PromptOptimizer(metrics=metrics)
+        optimization_bot = await asyncio.to_thread(get_optimization_bot)
         
-        success = optimizer.update_prompts_based_on_metrics()
+        # Оптимизатор читает и перезаписывает файлы промптов - вне цикла событий
+        success = await asyncio.to_thread(optimization_bot.prompt_optimizer.update_prompts_based_on_metrics)
         
         if success:
-            bot.send_message(message.chat.id, "✅ Промпты успешно обновлены на основе статистики ошибок")
+            # Применяем обновленные промпты в общем экземпляре
+            await asyncio.to_thread(optimization_bot.reload_prompts)
+            await outbound.send_message(message.chat.id, "✅ Промпты успешно обновлены на основе статистики ошибок")
         else:
-            bot.send_message(message.chat.id, "ℹ️ Недостаточно данных для оптимизации промптов или произошла ошибка")
+            await outbound.send_message(message.chat.id, "ℹ️ Недостаточно данных для оптимизации промптов или произошла ошибка")
     
     except Exception as e:
         logger.error(f"Ошибка при обновлении промптов: {e}")
-        bot.send_message(message.chat.id, "❌ Не удалось обновить промпты. Попробуйте позже.")
+        await outbound.send_message(message.chat.id, "❌ Не удалось обновить промпты. Попробуйте позже.")
 
-def reset_bot_sessions():
-    """Сбрасывает все активные сессии бота"""
+async def reset_bot_sessions(timeout=3.0):
+    """
+    Сбрасывает активный webhook бота без фиксированных пауз
+    
+    Сброс подтверждается запросом getWebhookInfo: как только Telegram
+    сообщает, что webhook не установлен, можно начинать polling.
+    
+    Args:
+        timeout (float): Максимальное время ожидания подтверждения (в секундах)
+    
+    Returns:
+        bool: True, если webhook сброшен
+    """
     try:
-        token = os.getenv('TELEGRAM_BOT_TOKEN')
-        if not token:
+        if not TELEGRAM_TOKEN:
             logger.error("Не найден токен Telegram бота")
             return False
-            
-        url = f"https://api.telegram.org/bot{token}/deleteWebhook"
-        response = requests.get(url)
         
-        if response.status_code == 200:
-            logger.info("Успешно сброшены все активные сессии бота")
-            time.sleep(10)  # Ждем 10 секунд для полного завершения предыдущих сессий
-            return True
-        else:
-            logger.warning(f"Не удалось сбросить сессии бота. Код ответа: {response.status_code}")
-            return False
+        await bot.delete_webhook()
+        
+        deadline = time.monotonic() + timeout
+        while True:
+            webhook_info = await bot.get_webhook_info()
+            if not webhook_info.url:
+                logger.info("Успешно сброшены все активные сессии бота")
+                return True
+            if time.monotonic() >= deadline:
+                logger.warning(f"Webhook все еще установлен: {webhook_info.url}")
+                return False
+            await asyncio.sleep(0.2)
             
     except Exception as e:
         logger.error(f"Ошибка при сбросе сессий бота: {e}")
         return False
 
-def main():
-    """Основная функция запуска бота"""
+async def warm_up_pipeline():
+    """Создает общий конвейер генерации в фоне, не задерживая прием обновлений"""
+    try:
+        optimization_bot = await asyncio.to_thread(get_optimization_bot)
+        await optimization_bot.warm_up()
+        logger.info(f"Конвейер генерации готов через {(time.perf_counter() - startup_timer.started_at) * 1000:.0f} мс после запуска")
+    except Exception as e:
+        logger.error(f"Не удалось инициализировать конвейер генерации при запуске: {e}")
+
+async def restore_jobs(shard_index=None):
+    """
+    Открывает хранилище задач и ставит в очередь задачи, не завершенные до перезапуска
+    
+    Args:
+        shard_index (int, optional): Номер процесса-обработчика (у каждого своя база задач)
+    """
+    from job_store import JobStore
+    
+    path = os.getenv("JOB_DB_PATH", "jobs.db")
+    if shard_index is not None:
+        root, ext = os.path.splitext(path)
+        path = f"{root}-shard{shard_index}{ext}"
+    
+    store = await asyncio.to_thread(JobStore, path)
+    await asyncio.to_thread(store.purge)
+    resumed, exhausted = await asyncio.to_thread(store.load_unfinished)
+    job_queue.store = store
+    
+    for job in exhausted:
+        await edit_or_send(
+            job.chat_id,
+            job.status_message_id,
+            "❌ Не удалось обработать ваш запрос. Пожалуйста, отправьте скриншот еще раз."
+        )
+    
+    for job in resumed:
+        await edit_or_send(
+            job.chat_id,
+            job.status_message_id,
+            "🔁 Бот был перезапущен. Продолжаю обработку вашего запроса, отправлять скриншот повторно не нужно."
+        )
+        job.dedup_key = make_dedup_key(job.file_unique_id, job.user_text)
+        job.progress = ProgressReporter(
+            outbound.edit_message_text, job.chat_id, job.status_message_id, header=PROGRESS_HEADERS[job.kind]
+        )
+        try:
+            job_queue.submit(job)
+        except QueueFullError:
+            logger.warning(f"Очередь переполнена, задача {job} будет восстановлена при следующем запуске")
+
+async def on_startup(shard_index=None):
+    """
+    Общая подготовка к работе для всех режимов получения обновлений
+    
+    Args:
+        shard_index (int, optional): Номер процесса-обработчика в многопроцессном режиме
+    """
+    global _warm_up_task
+    startup_timer.mark("импорт модулей")
+    
+    await outbound.start()
+    await job_queue.start()
+    try:
+        await restore_jobs(shard_index)
+    except Exception as e:
+        logger.error(f"Не удалось восстановить задачи после перезапуска: {e}", exc_info=True)
+    
+    # Конвейер (anthropic, метрики, промпты) загружается параллельно с приемом обновлений
+    _warm_up_task = asyncio.create_task(warm_up_pipeline())
+
+def install_shutdown_handlers():
+    """
+    Перехватывает SIGTERM и SIGINT: первый сигнал запускает плавную остановку,
+    повторный завершает работу немедленно
+    
+    Returns:
+        asyncio.Event: Событие, устанавливаемое при получении сигнала остановки
+    """
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    shutdown_event = asyncio.Event()
+    
+    def handle_signal(sig):
+        if shutdown_event.is_set():
+            logger.warning("Повторный сигнал остановки, завершаем работу немедленно")
+            main_task.cancel()
+            return
+        logger.info(f"Получен сигнал {sig.name}, начинаем плавную остановку")
+        shutdown_event.set()
+    
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, handle_signal, sig)
+        except (NotImplementedError, RuntimeError):
+            # На Windows обработчики сигналов цикла недоступны, Ctrl+C приводит к KeyboardInterrupt
+            pass
+    
+    return shutdown_event
+
+async def run_until_shutdown(coro, shutdown_event):
+    """
+    Выполняет корутину приема обновлений до ее завершения или до сигнала остановки
+    
+    Args:
+        coro: Корутина приема обновлений
+        shutdown_event (asyncio.Event): Событие из install_shutdown_handlers
+    """
+    task = asyncio.create_task(coro)
+    stop_waiter = asyncio.create_task(shutdown_event.wait())
+    try:
+        await asyncio.wait({task, stop_waiter}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for pending in (task, stop_waiter):
+            pending.cancel()
+        await asyncio.gather(task, stop_waiter, return_exceptions=True)
+    
+    if task.done() and not task.cancelled() and task.exception():
+        raise task.exception()
+
+async def drain_jobs():
+    """Дожидается выполняемых задач; не успевшие завершиться продолжатся после перезапуска"""
+    await job_queue.drain(SHUTDOWN_DRAIN_TIMEOUT)
+
+async def close_bot_session():
+    """Закрывает HTTP-сессию бота, если она была создана"""
+    if asyncio_helper.session_manager.session is not None:
+        await bot.close_session()
+
+async def on_shutdown():
+    """Общее завершение работы для всех режимов получения обновлений"""
+    await job_queue.stop()
+    await job_queue.close_store()
+    await outbound.stop()
+    # Дописываем сессии на диск (для SESSION_BACKEND=sqlite)
+    sessions.close()
+    # Закрываем общую HTTP-сессию бота и соединения с Anthropic API
+    try:
+        await close_bot_session()
+    finally:
+        await close_shared_clients()
+
+async def poll_updates():
+    """Получает обновления через long polling, восстанавливаясь после ошибок"""
+    while True:
+        try:
+            await bot.infinity_polling(timeout=15, request_timeout=30)
+            break
+        except ApiTelegramException as e:
+            if e.error_code == 409:
+                logger.warning("Обнаружен конфликт сессий, пытаемся сбросить...")
+                if await reset_bot_sessions():
+                    logger.info("Сессии успешно сброшены, перезапускаем бота...")
+                    continue
+            logger.error(f"Ошибка Telegram API: {e}")
+            await asyncio.sleep(5)
+        except Exception as e:
+            logger.error(f"Ошибка при работе бота: {e}")
+            await asyncio.sleep(5)
+
+async def run_polling():
+    """Запускает long polling в едином цикле событий"""
+    logger.info("Запускаем бота...")
+    shutdown_event = install_shutdown_handlers()
+    await on_startup()
     try:
-        # Сбрасываем все активные сессии бота
-        if not reset_bot_sessions():
+        # Сбрасываем webhook, чтобы getUpdates не конфликтовал с ним
+        if not await reset_bot_sessions():
             logger.warning("Не удалось сбросить сессии бота, продолжаем запуск...")
-            time.sleep(5)  # Даем время на завершение предыдущих сессий
-            
-        logger.info("Запускаем бота...")
+        startup_timer.mark("сброс сессий")
+        startup_timer.report()
+        
+        # После сигнала остановки новые обновления не принимаются, выполняемые задачи завершаются
+        await run_until_shutdown(poll_updates(), shutdown_event)
+        await drain_jobs()
+    finally:
+        await on_shutdown()
+
+async def register_webhook(on_update=None):
+    """
+    Запускает сервер webhook и регистрирует его в Telegram
+    
+    Args:
+        on_update: Корутина, получающая исходный JSON обновлений (вместо бота)
+    
+    Returns:
+        web.AppRunner: Запущенный сервер
+    """
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if not webhook_url:
+        raise ValueError("Для режима webhook необходимо задать WEBHOOK_URL")
+    
+    webhook_path = os.getenv("WEBHOOK_PATH", "/webhook")
+    # Если секрет не задан, генерируем его на время работы процесса
+    secret_token = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+    
+    from webhook_server import create_webhook_app, start_webhook_server
+    
+    runner = await start_webhook_server(create_webhook_app(bot, secret_token, webhook_path, on_update=on_update))
+    try:
+        await bot.set_webhook(
+            url=webhook_url.rstrip("/") + webhook_path,
+            secret_token=secret_token,
+            max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+        )
+    except Exception:
+        await runner.cleanup()
+        raise
+    logger.info(f"Webhook зарегистрирован: {webhook_url.rstrip('/')}{webhook_path}")
+    return runner
+
+async def run_webhook():
+    """Запускает прием обновлений через webhook (без long polling)"""
+    logger.info("Запускаем бота в режиме webhook...")
+    shutdown_event = install_shutdown_handlers()
+    await on_startup()
+    runner = None
+    try:
+        runner = await register_webhook()
+        startup_timer.mark("регистрация webhook")
+        startup_timer.report()
+        
+        # Работаем до сигнала остановки
+        await shutdown_event.wait()
+        
+        # Закрываем сервер, чтобы не принимать новые обновления, и завершаем выполняемые задачи
+        await runner.cleanup()
+        runner = None
+        await drain_jobs()
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        await on_shutdown()
+
+async def serve_shard(index, update_queue, processes=1):
+    """
+    Обрабатывает обновления, переданные координатором, в процессе-обработчике
+    
+    Обновления одного чата обрабатываются строго по очереди, обновления
+    разных чатов - параллельно.
+    
+    Args:
+        index (int): Номер процесса
+        update_queue: Очередь multiprocessing с обновлениями (None - завершение работы)
+        processes (int): Общее количество процессов-обработчиков
+    """
+    from shard_coordinator import extract_chat_id
+    
+    logger.info(f"Процесс-обработчик {index} запущен (PID: {os.getpid()})")
+    # Все процессы отправляют сообщения от имени одного бота
+    outbound.limit_global_share(processes)
+    shutdown_event = install_shutdown_handlers()
+    await on_startup(index)
+    startup_timer.report()
+    
+    # Последняя задача обработки для каждого чата: chat_id -> Task
+    chat_tails = {}
+    
+    async def process_in_order(previous, update):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        await bot.process_new_updates([types.Update.de_json(update)])
+    
+    async def receive_updates():
         while True:
+            # Ожидание с тайм-аутом не держит поток пула бесконечно: после сигнала
+            # остановки поток освобождается, и процесс может завершиться
             try:
-                bot.infinity_polling(timeout=30, long_polling_timeout=15)
-            except ApiTelegramException as e:
-                if e.error_code == 409:
-                    logger.warning("Обнаружен конфликт сессий, пытаемся сбросить...")
-                    if reset_bot_sessions():
-                        logger.info("Сессии успешно сброшены, перезапускаем бота...")
-                        continue
-                logger.error(f"Ошибка Telegram API: {e}")
-                time.sleep(5)
-            except Exception as e:
-                logger.error(f"Ошибка при работе бота: {e}")
-                time.sleep(5)
+                update = await asyncio.to_thread(update_queue.get, True, SHARD_QUEUE_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if update is None:
+                break
+            
+            chat_id = extract_chat_id(update)
+            task = asyncio.create_task(process_in_order(chat_tails.get(chat_id), update))
+            chat_tails[chat_id] = task
+            task.add_done_callback(
+                lambda done, key=chat_id: chat_tails.pop(key, None) if chat_tails.get(key) is done else None
+            )
+    
+    try:
+        # Работаем до сигнала завершения от координатора или до сигнала остановки
+        await run_until_shutdown(receive_updates(), shutdown_event)
+        
+        # Дожидаемся обработки уже полученных обновлений и выполняемых задач
+        await asyncio.gather(*list(chat_tails.values()), return_exceptions=True)
+        await drain_jobs()
+    finally:
+        await on_shutdown()
+        logger.info(f"Процесс-обработчик {index} остановлен")
+
+async def run_sharded(bot_mode, processes):
+    """
+    Запускает координатор и процессы-обработчики
+    
+    Args:
+        bot_mode (str): Режим получения обновлений (polling или webhook)
+        processes (int): Количество процессов-обработчиков
+    """
+    from shard_coordinator import ShardCoordinator
+    
+    shutdown_event = install_shutdown_handlers()
+    coordinator = ShardCoordinator(bot, processes)
+    coordinator.start()
+    startup_timer.mark("запуск процессов-обработчиков")
+    runner = None
+    
+    async def watch_workers():
+        while True:
+            await asyncio.sleep(5)
+            coordinator.ensure_workers_alive()
+    
+    try:
+        if bot_mode == "webhook":
+            runner = await register_webhook(on_update=coordinator.dispatch)
+            startup_timer.report()
+            await run_until_shutdown(watch_workers(), shutdown_event)
+        else:
+            if not await reset_bot_sessions():
+                logger.warning("Не удалось сбросить сессии бота, продолжаем запуск...")
+            startup_timer.report()
+            await run_until_shutdown(coordinator.run_polling(), shutdown_event)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        await close_bot_session()
+        # Процессы-обработчики завершают выполняемые задачи в пределах SHUTDOWN_DRAIN_TIMEOUT
+        await asyncio.to_thread(coordinator.stop, SHUTDOWN_DRAIN_TIMEOUT + 10)
+
+def main():
+    """Основная функция запуска бота"""
+    try:
+        # Режим получения обновлений: polling (по умолчанию) или webhook
+        bot_mode = os.getenv("BOT_MODE", "polling").lower()
+        worker_processes = int(os.getenv("BOT_WORKER_PROCESSES", "1"))
+        
+        if worker_processes > 1:
+            # Обновления получает только координатор, поэтому блокировка нужна лишь ему
+            if not ensure_single_instance():
+                return
+            logger.info(f"Запускаем бота в многопроцессном режиме: {worker_processes} процессов")
+            asyncio.run(run_sharded(bot_mode, worker_processes))
+            return
+        
+        if bot_mode == "webhook":
+            asyncio.run(run_webhook())
+            return
+        
+        # Все обработчики выполняются в одном долгоживущем цикле событий
+        asyncio.run(run_polling())
                 
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
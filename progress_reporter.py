@@ -0,0 +1,150 @@
+import os
+import time
+import asyncio
+import logging
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Этапы обработки запроса
+STAGE_DOWNLOADING = "downloading"
+STAGE_GENERATING = "generating"
+STAGE_VALIDATING = "validating"
+STAGE_PACKAGING = "packaging"
+
+STAGE_TEXTS = {
+    STAGE_DOWNLOADING: "📥 Загружаю скриншот...",
+    STAGE_GENERATING: "🧠 Claude пишет скрипты...",
+    STAGE_VALIDATING: "🔍 Проверяю и исправляю скрипты...",
+    STAGE_PACKAGING: "📦 Упаковываю архив..."
+}
+
+# Примерное количество символов ответа на один токен
+CHARS_PER_TOKEN = 4
+
+
+class ProgressReporter:
+    """
+    Отображает ход обработки запроса в статусном сообщении
+
+    Сообщение редактируется не чаще одного раза в min_interval секунд,
+    чтобы не упираться в лимиты Telegram. Количество сгенерированных
+    токенов можно обновлять из любого потока - отрисовкой занимается
+    фоновая задача в цикле событий.
+    """
+
+    def __init__(self, edit, chat_id, message_id, header="", min_interval=None):
+        """
+        Инициализация
+
+        Args:
+            edit: Корутина edit(text, chat_id, message_id) для редактирования сообщения
+            chat_id (int): ID чата
+            message_id (int): ID статусного сообщения (можно указать позже, пока его нет - правки откладываются)
+            header (str): Заголовок над строкой этапа
+            min_interval (float, optional): Минимальный интервал между правками (PROGRESS_UPDATE_INTERVAL или 3)
+        """
+        self.edit = edit
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.header = header
+        self.min_interval = min_interval or float(os.getenv("PROGRESS_UPDATE_INTERVAL", "3"))
+
+        self.stage = None
+        self.output_chars = 0
+        self._last_text = None
+        self._last_edit_at = 0.0
+        self._ticker = None
+        self._closed = False
+
+    @property
+    def tokens(self):
+        """Примерное количество сгенерированных токенов"""
+        return self.output_chars // CHARS_PER_TOKEN
+
+    def render(self):
+        """
+        Формирует текст статусного сообщения
+
+        Returns:
+            str: Текст сообщения
+        """
+        line = STAGE_TEXTS.get(self.stage, "")
+        if self.stage == STAGE_GENERATING and self.tokens:
+            line = f"🧠 Claude пишет скрипты: ~{self.tokens} токенов"
+        return f"{self.header}\n\n{line}" if self.header else line
+
+    async def set_stage(self, stage):
+        """
+        Переходит к новому этапу и сразу обновляет сообщение, если позволяет интервал
+
+        Args:
+            stage (str): Один из STAGE_*
+        """
+        self.stage = stage
+        if self._closed:
+            return
+
+        if self._ticker is None:
+            self._ticker = asyncio.create_task(self._tick())
+
+        if time.monotonic() - self._last_edit_at >= self.min_interval:
+            await self._flush()
+
+    def add_output(self, text):
+        """
+        Учитывает очередной фрагмент ответа Claude (можно вызывать из другого потока)
+
+        Args:
+            text (str): Фрагмент ответа
+        """
+        self.output_chars += len(text)
+
+    def reset_output(self):
+        """Сбрасывает счетчик ответа перед новой попыткой запроса к Claude"""
+        self.output_chars = 0
+
+    async def finish(self, text=None):
+        """
+        Останавливает обновления и при необходимости выводит итоговый текст
+
+        Args:
+            text (str, optional): Итоговый текст статусного сообщения
+        """
+        if self._closed:
+            return
+        if self._ticker is not None:
+            self._ticker.cancel()
+            await asyncio.gather(self._ticker, return_exceptions=True)
+            self._ticker = None
+
+        if text and self.message_id is not None and text != self._last_text:
+            await self._edit(text)
+        self._closed = True
+
+    async def _tick(self):
+        """Периодически отображает изменения, накопленные между правками"""
+        while True:
+            await asyncio.sleep(self.min_interval)
+            await self._flush()
+
+    async def _flush(self):
+        """Редактирует сообщение, если его текст изменился"""
+        text = self.render()
+        if self.message_id is not None and text and text != self._last_text:
+            await self._edit(text)
+
+    async def _edit(self, text):
+        """Редактирует статусное сообщение, ошибки только логируются"""
+        self._last_text = text
+        self._last_edit_at = time.monotonic()
+        try:
+            await self.edit(text, self.chat_id, self.message_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"Не удалось обновить статусное сообщение: {e}")
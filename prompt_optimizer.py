@@ -49,9 +49,9 @@ class PromptOptimizer:
     
     def _create_default_prompts(self):
         """Создание структуры с промптами по умолчанию"""
-        # Импортируем шаблоны из основного файла
+        # Импортируем шаблоны из легкого модуля (без загрузки всего бота)
         try:
-            from optimization_bot import OPTIMIZATION_PROMPT_TEMPLATE, ERROR_FIX_PROMPT_TEMPLATE
+            from prompt_templates import OPTIMIZATION_PROMPT_TEMPLATE, ERROR_FIX_PROMPT_TEMPLATE
             
             return {
                 "OPTIMIZATION_PROMPT_TEMPLATE": OPTIMIZATION_PROMPT_TEMPLATE,
@@ -61,7 +61,7 @@ class PromptOptimizer:
             }
         except ImportError:
             # Если не удалось импортировать, создаем пустую структуру
-            logger.warning("Не удалось импортировать шаблоны из основного файла")
+            logger.warning("Не удалось импортировать шаблоны промптов")
             return {
                 "OPTIMIZATION_PROMPT_TEMPLATE": "",
                 "ERROR_FIX_PROMPT_TEMPLATE": "",
@@ -176,9 +176,9 @@ class PromptOptimizer:
     
     def _create_default_prompts(self):
         """Создание структуры с промптами по умолчанию"""
-        # Импортируем шаблоны из основного файла
+        # Импортируем шаблоны из легкого модуля (без загрузки всего бота)
         try:
-            from optimization_bot import OPTIMIZATION_PROMPT_TEMPLATE, ERROR_FIX_PROMPT_TEMPLATE
+            from prompt_templates import OPTIMIZATION_PROMPT_TEMPLATE, ERROR_FIX_PROMPT_TEMPLATE
             
             return {
                 "OPTIMIZATION_PROMPT_TEMPLATE": OPTIMIZATION_PROMPT_TEMPLATE,
@@ -188,7 +188,7 @@ class PromptOptimizer:
             }
         except ImportError:
             # Если не удалось импортировать, создаем пустую структуру
-            logger.warning("Не удалось импортировать шаблоны из основного файла")
+            logger.warning("Не удалось импортировать шаблоны промптов")
             return {
                 "OPTIMIZATION_PROMPT_TEMPLATE": "",
                 "ERROR_FIX_PROMPT_TEMPLATE": "",
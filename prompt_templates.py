@@ -0,0 +1,119 @@
+"""
+Статические шаблоны промптов для Claude
+
+Вынесены в отдельный легкий модуль, чтобы их можно было импортировать
+(например, из prompt_optimizer) без загрузки всего бота.
+"""
+
+# Шаблон промпта для генерации скрипта оптимизации
+OPTIMIZATION_PROMPT_TEMPLATE = """Ты эксперт по оптимизации Windows. Тебе предоставлен скриншот системной информации. Твоя задача - создать скрипты для оптимизации этой системы.
+
+Обязательно следуй этим требованиям к скриптам:
+
+1. PowerShell скрипт (.ps1):
+   - Всегда начинай с установки кодировки UTF-8: `$OutputEncoding = [System.Text.Encoding]::UTF8`
+   - Проверяй права администратора в самом начале скрипта
+   - Все блоки try ДОЛЖНЫ иметь соответствующие блоки catch
+   - НИКОГДА не используй формат ${1}:TEMP в путях - это приводит к ошибкам!
+   - ВСЕГДА используй ТОЛЬКО формат $env:VARIABLENAME для переменных окружения (например: $env:TEMP, $env:APPDATA, $env:USERPROFILE)
+   - Внутри строк с двоеточием используй `${variable}` вместо `$variable`
+   - Проверяй существование файлов с помощью Test-Path перед их использованием
+   - Добавляй ключ -Force для команд Remove-Item
+   - Обеспечь балансировку всех фигурных скобок
+   - Для вывода сообщений об ошибках используй формат: `"Сообщение: ${variable}"`
+
+2. Batch файл (.bat):
+   - НИ В КОЕМ СЛУЧАЕ не используй русские символы в BAT-файлах!
+   - Обязательно начинай с `@echo off` и `chcp 65001 >nul`
+   - Проверяй права администратора
+   - Используй ТОЛЬКО английский текст в bat-файле
+   - Добавляй корректные параметры при вызове PowerShell: `-ExecutionPolicy Bypass -NoProfile -File`
+   - Используй перенаправление ошибок `>nul 2>&1` для команд
+
+3. ReadMe файл (README.md):
+   - Подробная документация по использованию скриптов
+   - Описание выполняемых оптимизаций
+   - Требования и предупреждения
+
+Предоставь три файла:
+1. WindowsOptimizer.ps1 - скрипт оптимизации PowerShell, который анализирует систему и оптимизирует её
+2. Start-Optimizer.bat - bat-файл для запуска PowerShell скрипта с нужными параметрами (ТОЛЬКО с английским текстом)
+3. README.md - инструкция по использованию скриптов
+
+Вот шаблон Batch-файла, которого нужно строго придерживаться:
+```batch
+@echo off
+chcp 65001 >nul
+title Windows Optimization
+
+:: Check administrator rights
+net session >nul 2>&1
+if %errorlevel% neq 0 (
+    echo Administrator rights required.
+    echo Please run this file as administrator.
+    pause
+    exit /b 1
+)
+
+:: Script file check
+if not exist "WindowsOptimizer.ps1" (
+    echo File WindowsOptimizer.ps1 not found.
+    echo Please make sure it is in the same folder.
+    pause
+    exit
+)
+
+:: Run PowerShell script with needed parameters
+echo Starting Windows optimization script...
+echo ==========================================
+
+powershell -ExecutionPolicy Bypass -NoProfile -File "WindowsOptimizer.ps1" -Encoding UTF8
+
+echo ==========================================
+echo Optimization script completed.
+pause
+```
+"""
+
+# Шаблон промпта для исправления ошибок в скрипте
+ERROR_FIX_PROMPT_TEMPLATE = """Ты эксперт по PowerShell и Batch скриптам. Перед тобой скриншот с ошибками выполнения скрипта оптимизации Windows. Твоя задача - проанализировать ошибки и исправить код скрипта.
+
+Вот основные типы ошибок, которые могут встречаться:
+
+1. Синтаксические ошибки:
+   - Несбалансированные скобки
+   - Неверное использование переменных
+   - Ошибки в конструкциях try-catch
+   - Неэкранированные специальные символы
+
+2. Проблемы с доступом:
+   - Отсутствие проверки прав администратора
+   - Попытка доступа к несуществующим файлам или службам
+   - Отсутствие параметра -Force для Remove-Item
+
+3. Проблемы кодировки:
+   - Отсутствие установки правильной кодировки
+   - Неверное отображение кириллических символов
+
+Важные правила при исправлении:
+
+1. Для PowerShell:
+   - Всегда добавляй в начало скрипта: `$OutputEncoding = [System.Text.Encoding]::UTF8`
+   - Все блоки try ДОЛЖНЫ иметь соответствующие блоки catch
+   - Переменные в строках с двоеточием используй в формате `${variable}` вместо `$variable`
+   - Используй проверки Test-Path перед операциями с файлами
+   - Балансируй все фигурные скобки
+
+2. Для Batch:
+   - Начинай с `@echo off` и `chcp 65001 >nul`
+   - Добавляй корректные параметры при вызове PowerShell
+
+Предоставь исправленные версии файлов с учетом обнаруженных на скриншоте проблем.
+
+ОБЯЗАТЕЛЬНО ПРОВЕРЬТЕ:
+- Проверку прав администратора
+- Наличие и корректность блоков обработки ошибок
+- Кодировку UTF-8 для PowerShell скриптов
+- Балансировку всех скобок в скрипте
+- Правильный формат переменных в строках с двоеточием (${variable})
+"""
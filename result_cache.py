@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Кэш готовых наборов скриптов
+
+Многие пользователи присылают одинаковые или почти одинаковые скриншоты
+"Сведений о системе". Для них уже проверенный и исправленный набор
+скриптов отдается из кэша без запроса к Claude.
+
+TieredCache - общий двухуровневый кэш: LRU в памяти и SQLite на диске,
+оба уровня с ограничением по количеству записей и времени жизни.
+ScreenshotResultCache строит ключи по скриншоту: точный хэш содержимого
+и перцептивный хэш (dHash), который совпадает у пережатых и уменьшенных
+копий одного изображения. Поиск по dHash выключен по умолчанию: хэш не
+различает мелкие отличия в тексте (например, другую модель процессора
+на том же окне), и такие скриншоты получили бы чужой набор скриптов.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+class TieredCache:
+    """
+    Двухуровневый кэш: LRU в памяти и SQLite на диске
+
+    Значения должны сериализоваться в JSON. Запись, найденная на диске,
+    поднимается в память. Устаревшие записи удаляются при обращении и
+    периодически при записи.
+    """
+
+    def __init__(self, name, path=None, max_entries=200, max_disk_entries=5000, ttl=7 * 24 * 3600,
+                 cleanup_interval=100):
+        """
+        Инициализация
+
+        Args:
+            name (str): Имя кэша (для логов)
+            path (str, optional): Путь к базе SQLite (без него кэш только в памяти)
+            max_entries (int): Максимум записей в памяти
+            max_disk_entries (int): Максимум записей на диске
+            ttl (float): Время жизни записи (в секундах)
+            cleanup_interval (int): Через сколько записей выполнять очистку диска
+        """
+        self.name = name
+        self.path = path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._memory = OrderedDict()   # key -> (value, expires_at)
+        self._writes = 0
+        self._lock = threading.RLock()
+
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+            self._conn.commit()
+
+    def get(self, key):
+        """
+        Возвращает значение по ключу
+
+        Args:
+            key (str): Ключ
+
+        Returns:
+            Значение или None, если записи нет или она устарела
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return entry[0]
+                del self._memory[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    self._conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._conn.commit()
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.hits_disk += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """
+        Сохраняет значение в оба уровня
+
+        Args:
+            key (str): Ключ
+            value: Значение (сериализуемое в JSON)
+        """
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at, now)
+                )
+                self._conn.commit()
+
+                self._writes += 1
+                if self._writes % self.cleanup_interval == 0:
+                    self.cleanup()
+
+    def _remember(self, key, value, expires_at):
+        """Кладет запись в память, вытесняя давно не использованные"""
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def cleanup(self):
+        """Удаляет с диска устаревшие записи и самые старые записи сверх лимита"""
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+            cursor = self._conn.execute(
+                "DELETE FROM entries WHERE key NOT IN "
+                "(SELECT key FROM entries ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_disk_entries,)
+            )
+            self.evictions += cursor.rowcount
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            if self._conn is not None:
+                return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return len(self._memory)
+
+    def get_stats(self):
+        """
+        Возвращает статистику кэша
+
+        Returns:
+            dict: Записи, попадания по уровням, промахи, доля попаданий и вытеснения
+        """
+        hits = self.hits_memory + self.hits_disk
+        lookups = hits + self.misses
+        return {
+            "entries": len(self),
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+    def close(self):
+        """Закрывает соединение с базой"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class ImageFingerprint:
+    """Отпечаток скриншота: точный хэш содержимого и перцептивный хэш (если доступен)"""
+
+    def __init__(self, exact, perceptual=None):
+        self.exact = exact
+        self.perceptual = perceptual
+
+    def __repr__(self):
+        return f"ImageFingerprint(exact={self.exact[:12]}, perceptual={self.perceptual})"
+
+
+def normalize_user_text(text):
+    """
+    Приводит текст запроса к виду, в котором несущественные различия не влияют на ключ
+
+    Args:
+        text (str): Текст пользователя
+
+    Returns:
+        str: Текст в нижнем регистре без лишних пробелов и знаков в конце
+    """
+    text = re.sub(r"\s+", " ", (text or "").strip().lower())
+    return text.rstrip(".!?")
+
+
+class ScreenshotResultCache:
+    """Кэш готовых наборов скриптов по скриншоту, версии промпта и тексту запроса"""
+
+    def __init__(self, cache=None, use_perceptual=None):
+        """
+        Инициализация
+
+        Args:
+            cache (TieredCache, optional): Хранилище (по умолчанию настраивается переменными RESULT_CACHE_*)
+            use_perceptual (bool, optional): Искать ли по перцептивному хэшу (RESULT_CACHE_PERCEPTUAL или false)
+        """
+        if cache is None:
+            cache = TieredCache(
+                "results",
+                path=os.getenv("RESULT_CACHE_DB_PATH", "result_cache.db"),
+                max_entries=int(os.getenv("RESULT_CACHE_SIZE", "200")),
+                max_disk_entries=int(os.getenv("RESULT_CACHE_DISK_ENTRIES", "5000")),
+                ttl=float(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+            )
+        self.cache = cache
+        if use_perceptual is None:
+            use_perceptual = os.getenv("RESULT_CACHE_PERCEPTUAL", "false").lower() in ("1", "true", "yes")
+        self.use_perceptual = use_perceptual
+
+        self.hits_exact = 0
+        self.hits_perceptual = 0
+        self.misses = 0
+
+    def _keys(self, fingerprint, prompt_version, user_text):
+        """Ключи для поиска: сначала точный, затем перцептивный"""
+        context = hashlib.sha256(f"{prompt_version}\n{normalize_user_text(user_text)}".encode("utf-8")).hexdigest()
+        keys = [f"exact:{fingerprint.exact}:{context}"]
+        if self.use_perceptual and fingerprint.perceptual:
+            keys.append(f"dhash:{fingerprint.perceptual}:{context}")
+        return keys
+
+    def get(self, fingerprint, prompt_version, user_text):
+        """
+        Ищет готовый набор скриптов
+
+        Args:
+            fingerprint (ImageFingerprint): Отпечаток скриншота
+            prompt_version: Версия промпта генерации
+            user_text (str): Текст запроса пользователя
+
+        Returns:
+            dict: Файлы (имя -> содержимое) или None
+        """
+        for key in self._keys(fingerprint, prompt_version, user_text):
+            files = self.cache.get(key)
+            if files:
+                if key.startswith("exact:"):
+                    self.hits_exact += 1
+                else:
+                    self.hits_perceptual += 1
+                logger.info(f"Найден готовый набор скриптов в кэше ({key.split(':', 1)[0]})")
+                return files
+        self.misses += 1
+        return None
+
+    def put(self, fingerprint, prompt_version, user_text, files):
+        """
+        Сохраняет проверенный набор скриптов
+
+        Args:
+            fingerprint (ImageFingerprint): Отпечаток скриншота
+            prompt_version: Версия промпта генерации
+            user_text (str): Текст запроса пользователя
+            files (dict): Файлы (имя -> содержимое)
+        """
+        for key in self._keys(fingerprint, prompt_version, user_text):
+            self.cache.put(key, files)
+
+    def get_stats(self):
+        """
+        Возвращает статистику кэша
+
+        Returns:
+            dict: Записи, попадания по точному и перцептивному хэшу, промахи и доля попаданий
+        """
+        hits = self.hits_exact + self.hits_perceptual
+        lookups = hits + self.misses
+        stats = self.cache.get_stats()
+        stats.update({
+            "hits_exact": self.hits_exact,
+            "hits_perceptual": self.hits_perceptual,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0
+        })
+        return stats
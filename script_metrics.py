@@ -1,6 +1,7 @@
 import json
 import os
 import time
+import threading
 from datetime import datetime
 from collections import defaultdict, Counter
 import logging
@@ -23,6 +24,9 @@ class ScriptMetrics:
         """
         self.metrics_file = metrics_file
         self.metrics = self._load_metrics()
+        
+        # Блокировка для безопасной записи из нескольких обработчиков
+        self._lock = threading.RLock()
     
     def _load_metrics(self):
         """Загрузка метрик из файла"""
@@ -44,15 +48,17 @@ class ScriptMetrics:
             "error_types": {},
             "error_trends": [],
             "model_performance": {},
+            "prompt_cache": {},
             "last_updated": datetime.now().isoformat()
         }
     
     def _save_metrics(self):
         """Сохранение метрик в файл"""
-        self.metrics["last_updated"] = datetime.now().isoformat()
-        
-        with open(self.metrics_file, 'w', encoding='utf-8') as f:
-            json.dump(self.metrics, f, indent=4, ensure_ascii=False)
+        with self._lock:
+            self.metrics["last_updated"] = datetime.now().isoformat()
+            
+            with open(self.metrics_file, 'w', encoding='utf-8') as f:
+                json.dump(self.metrics, f, indent=4, ensure_ascii=False)
     
     def record_script_generation(self, data=None):
         """Записывает информацию о генерации скрипта
@@ -60,32 +66,33 @@ class ScriptMetrics:
         Args:
             data (dict, optional): Данные о генерации. Если None, то просто увеличивает счетчик.
         """
-        try:
-            # Увеличиваем счетчик сгенерированных скриптов
-            self.metrics["total_scripts_generated"] += 1
+        with self._lock:
+            try:
+                # Увеличиваем счетчик сгенерированных скриптов
+                self.metrics["total_scripts_generated"] += 1
             
-            # Если переданы данные для записи
-            if isinstance(data, dict):
-                # Проверяем наличие поля errors или validation_results
-                if "errors" in data or "validation_results" in data:
-                    # Сохраняем данные об ошибках, если они есть
-                    validation_results = data.get("validation_results") or data.get("errors") or {}
+                # Если переданы данные для записи
+                if isinstance(data, dict):
+                    # Проверяем наличие поля errors или validation_results
+                    if "errors" in data or "validation_results" in data:
+                        # Сохраняем данные об ошибках, если они есть
+                        validation_results = data.get("validation_results") or data.get("errors") or {}
                     
-                    # Записываем результаты валидации
-                    self.record_validation_results(validation_results)
+                        # Записываем результаты валидации
+                        self.record_validation_results(validation_results)
                     
-                    # Если переданы данные о количестве исправленных ошибок
-                    if "fixed_count" in data:
-                        self.metrics["total_errors_fixed"] += data["fixed_count"]
-                        self.record_script_fix()
+                        # Если переданы данные о количестве исправленных ошибок
+                        if "fixed_count" in data:
+                            self.metrics["total_errors_fixed"] += data["fixed_count"]
+                            self.record_script_fix()
             
-            # Сохраняем изменения
-            self._save_metrics()
+                # Сохраняем изменения
+                self._save_metrics()
             
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка при записи информации о генерации скрипта: {e}")
-            return False
+                return True
+            except Exception as e:
+                logger.error(f"Ошибка при записи информации о генерации скрипта: {e}")
+                return False
     
     def record_validation_results(self, validation_results, model_name="unknown", fixed_count=0):
         """Запись результатов валидации скрипта
@@ -95,68 +102,117 @@ class ScriptMetrics:
             model_name (str, optional): Название модели
             fixed_count (int, optional): Количество исправленных ошибок
         """
-        # Подсчет ошибок
-        error_count = 0
-        error_types = Counter()
+        with self._lock:
+            # Подсчет ошибок
+            error_count = 0
+            error_types = Counter()
         
-        for filename, issues in validation_results.items():
-            error_count += len(issues)
+            for filename, issues in validation_results.items():
+                error_count += len(issues)
             
-            # Группировка ошибок по типу
-            for issue in issues:
-                # Извлекаем тип ошибки из сообщения (например, "ps_syntax", "bat_syntax", и т.д.)
-                if "(" in issue and ")" in issue:
-                    error_type = issue.split("(")[1].split(")")[0]
-                    error_types[error_type] += 1
+                # Группировка ошибок по типу
+                for issue in issues:
+                    # Извлекаем тип ошибки из сообщения (например, "ps_syntax", "bat_syntax", и т.д.)
+                    if "(" in issue and ")" in issue:
+                        error_type = issue.split("(")[1].split(")")[0]
+                        error_types[error_type] += 1
+                    else:
+                        error_types["other"] += 1
+        
+            # Обновляем общее количество найденных ошибок
+            self.metrics["total_errors_found"] += error_count
+        
+            # Обновляем типы ошибок
+            for error_type, count in error_types.items():
+                if error_type in self.metrics["error_types"]:
+                    self.metrics["error_types"][error_type] += count
                 else:
-                    error_types["other"] += 1
+                    self.metrics["error_types"][error_type] = count
         
-        # Обновляем общее количество найденных ошибок
-        self.metrics["total_errors_found"] += error_count
+            # Добавляем запись в тренды
+            trend_entry = {
+                "timestamp": datetime.now().isoformat(),
+                "model": model_name,
+                "errors_found": error_count,
+                "errors_fixed": fixed_count,
+                "error_types": dict(error_types)
+            }
+            self.metrics["error_trends"].append(trend_entry)
         
-        # Обновляем типы ошибок
-        for error_type, count in error_types.items():
-            if error_type in self.metrics["error_types"]:
-                self.metrics["error_types"][error_type] += count
-            else:
-                self.metrics["error_types"][error_type] = count
+            # Обновляем статистику по модели
+            if model_name not in self.metrics["model_performance"]:
+                self.metrics["model_performance"][model_name] = {
+                    "total_scripts": 0,
+                    "total_errors": 0,
+                    "total_fixed": 0,
+                    "average_errors_per_script": 0
+                }
         
-        # Добавляем запись в тренды
-        trend_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "model": model_name,
-            "errors_found": error_count,
-            "errors_fixed": fixed_count,
-            "error_types": dict(error_types)
-        }
-        self.metrics["error_trends"].append(trend_entry)
+            model_stats = self.metrics["model_performance"][model_name]
+            model_stats["total_scripts"] += 1
+            model_stats["total_errors"] += error_count
+            model_stats["total_fixed"] += fixed_count
+            model_stats["average_errors_per_script"] = (
+                model_stats["total_errors"] / model_stats["total_scripts"]
+            )
         
-        # Обновляем статистику по модели
-        if model_name not in self.metrics["model_performance"]:
-            self.metrics["model_performance"][model_name] = {
-                "total_scripts": 0,
-                "total_errors": 0,
-                "total_fixed": 0,
-                "average_errors_per_script": 0
-            }
+            # Сохраняем обновленные метрики
+            self._save_metrics()
         
-        model_stats = self.metrics["model_performance"][model_name]
-        model_stats["total_scripts"] += 1
-        model_stats["total_errors"] += error_count
-        model_stats["total_fixed"] += fixed_count
-        model_stats["average_errors_per_script"] = (
-            model_stats["total_errors"] / model_stats["total_scripts"]
-        )
+            return {
+                "total_errors": error_count,
+                "fixed_errors": fixed_count,
+                "improvement_percentage": 
+                    (fixed_count / error_count * 100) if error_count > 0 else 0
+            }
+    
+    def record_prompt_cache_usage(self, template_name, version, usage, duration=None):
+        """Запись расхода токенов запроса к Claude с кэшированием промпта
         
-        # Сохраняем обновленные метрики
-        self._save_metrics()
+        Args:
+            template_name (str): Имя шаблона промпта (например, "OPTIMIZATION_PROMPT_TEMPLATE")
+            version: Версия промптов
+            usage (dict): Токены запроса: input_tokens, output_tokens,
+                cache_read_input_tokens, cache_creation_input_tokens
+            duration (float, optional): Длительность запроса (в секундах)
+        """
+        with self._lock:
+            key = f"{template_name}:v{version}"
+            stats = self.metrics.setdefault("prompt_cache", {}).setdefault(key, {
+                "requests": 0,
+                "cache_hits": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cache_read_input_tokens": 0,
+                "cache_creation_input_tokens": 0,
+                "total_duration": 0.0
+            })
+            
+            stats["requests"] += 1
+            for field in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+                stats[field] += usage.get(field) or 0
+            if usage.get("cache_read_input_tokens"):
+                stats["cache_hits"] += 1
+            if duration is not None:
+                stats["total_duration"] += duration
+            
+            self._save_metrics()
+    
+    def get_prompt_cache_stats(self):
+        """Получение статистики кэширования промптов
         
-        return {
-            "total_errors": error_count,
-            "fixed_errors": fixed_count,
-            "improvement_percentage": 
-                (fixed_count / error_count * 100) if error_count > 0 else 0
-        }
+        Returns:
+            dict: Статистика по шаблонам и версиям ("шаблон:vN" -> счетчики, доля попаданий, среднее время)
+        """
+        with self._lock:
+            result = {}
+            for key, stats in self.metrics.get("prompt_cache", {}).items():
+                stats = dict(stats)
+                requests = stats["requests"]
+                stats["hit_rate"] = stats["cache_hits"] / requests if requests else 0.0
+                stats["average_duration"] = stats["total_duration"] / requests if requests else 0.0
+                result[key] = stats
+            return result
     
     def get_model_stats(self, model_name=None):
         """Получение статистики по модели
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Хранилище сессий пользователей (состояние диалога и текст запроса)
+
+Заменяет словари user_states и user_messages, которые росли без
+ограничений. Поддерживаются два варианта хранения:
+
+- memory: словарь в памяти с вытеснением по LRU, времени простоя и объему
+- sqlite: то же в памяти, с фоновым сохранением в SQLite для перезапусков
+"""
+
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Поля сессии, доступные через view()
+SESSION_FIELDS = ("state", "message")
+
+
+class ChatSession:
+    """Компактная запись о сессии одного чата"""
+
+    __slots__ = ("chat_id", "state", "message", "size", "updated_at")
+
+    def __init__(self, chat_id, state=None, message=None, updated_at=None):
+        self.chat_id = chat_id
+        self.state = state
+        self.message = message
+        self.updated_at = updated_at or time.monotonic()
+        self.size = self.estimate_size()
+
+    def estimate_size(self):
+        """Объем данных сессии (в байтах UTF-8)"""
+        return len((self.message or "").encode("utf-8")) + len((self.state or "").encode("utf-8"))
+
+    def __repr__(self):
+        return f"ChatSession(chat_id={self.chat_id}, state={self.state})"
+
+
+class SessionFieldView:
+    """
+    Доступ к одному полю сессий в виде словаря chat_id -> значение
+
+    Позволяет использовать хранилище там, где раньше был обычный словарь.
+    """
+
+    def __init__(self, store, field):
+        self.store = store
+        self.field = field
+
+    def get(self, chat_id, default=None):
+        session = self.store.get(chat_id)
+        value = getattr(session, self.field) if session is not None else None
+        return default if value is None else value
+
+    def __getitem__(self, chat_id):
+        value = self.get(chat_id)
+        if value is None:
+            raise KeyError(chat_id)
+        return value
+
+    def __setitem__(self, chat_id, value):
+        self.store.update(chat_id, **{self.field: value})
+
+    def __contains__(self, chat_id):
+        return self.get(chat_id) is not None
+
+    def pop(self, chat_id, default=None):
+        value = self.get(chat_id, default)
+        self.store.update(chat_id, **{self.field: None})
+        return value
+
+
+class SessionStore(ABC):
+    """Базовый класс хранилища сессий"""
+
+    def __init__(self, max_sessions=None, idle_ttl=None):
+        """
+        Инициализация
+
+        Args:
+            max_sessions (int, optional): Максимум сессий (SESSION_MAX_SESSIONS или 10000)
+            idle_ttl (float, optional): Время простоя до удаления сессии в секундах (SESSION_IDLE_TTL или 86400)
+        """
+        self.max_sessions = max_sessions or int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+        self.idle_ttl = idle_ttl or float(os.getenv("SESSION_IDLE_TTL", "86400"))
+        self.evictions = {"lru": 0, "ttl": 0, "memory": 0}
+
+    def view(self, field):
+        """
+        Возвращает словарь-представление поля сессий
+
+        Args:
+            field (str): Одно из SESSION_FIELDS
+
+        Returns:
+            SessionFieldView: Представление поля
+        """
+        if field not in SESSION_FIELDS:
+            raise ValueError(f"Неизвестное поле сессии: {field}")
+        return SessionFieldView(self, field)
+
+    @abstractmethod
+    def get(self, chat_id):
+        """Возвращает сессию чата или None"""
+
+    @abstractmethod
+    def update(self, chat_id, **fields):
+        """Обновляет поля сессии чата (создает сессию при необходимости)"""
+
+    @abstractmethod
+    def delete(self, chat_id):
+        """Удаляет сессию чата"""
+
+    @abstractmethod
+    def __len__(self):
+        """Количество сессий"""
+
+    def close(self):
+        """Освобождает ресурсы хранилища"""
+
+    def get_stats(self):
+        """
+        Возвращает статистику хранилища
+
+        Returns:
+            dict: Количество сессий и вытеснений по причинам
+        """
+        return {
+            "sessions": len(self),
+            "evicted_lru": self.evictions["lru"],
+            "evicted_ttl": self.evictions["ttl"],
+            "evicted_memory": self.evictions["memory"]
+        }
+
+
+class MemorySessionStore(SessionStore):
+    """Хранилище сессий в памяти с вытеснением по LRU, времени простоя и объему"""
+
+    def __init__(self, max_sessions=None, idle_ttl=None, max_memory_mb=None):
+        """
+        Инициализация
+
+        Args:
+            max_sessions (int, optional): Максимум сессий (SESSION_MAX_SESSIONS или 10000)
+            idle_ttl (float, optional): Время простоя до удаления сессии (SESSION_IDLE_TTL или 86400)
+            max_memory_mb (float, optional): Максимальный объем данных сессий (SESSION_MAX_MEMORY_MB или 64)
+        """
+        super().__init__(max_sessions, idle_ttl)
+        self.max_memory = int((max_memory_mb or float(os.getenv("SESSION_MAX_MEMORY_MB", "64"))) * 1024 * 1024)
+
+        # Порядок - от давно не использованных к недавним
+        self._sessions = OrderedDict()
+        self._total_size = 0
+        self._lock = threading.RLock()
+
+    def get(self, chat_id):
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is None:
+                return None
+
+            now = time.monotonic()
+            if now - session.updated_at > self.idle_ttl:
+                self._remove(chat_id, "ttl")
+                return None
+
+            session.updated_at = now
+            self._sessions.move_to_end(chat_id)
+            return session
+
+    def update(self, chat_id, **fields):
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is None:
+                session = ChatSession(chat_id)
+                self._sessions[chat_id] = session
+            else:
+                self._total_size -= session.size
+                self._sessions.move_to_end(chat_id)
+
+            for field, value in fields.items():
+                setattr(session, field, value)
+            session.updated_at = time.monotonic()
+            session.size = session.estimate_size()
+            self._total_size += session.size
+
+            self._enforce_limits(protect=chat_id)
+            return session
+
+    def delete(self, chat_id):
+        with self._lock:
+            if chat_id in self._sessions:
+                self._remove(chat_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats["memory_bytes"] = self._total_size
+        return stats
+
+    def _remove(self, chat_id, reason=None):
+        """Удаляет сессию и учитывает причину вытеснения"""
+        session = self._sessions.pop(chat_id)
+        self._total_size -= session.size
+        if reason:
+            self.evictions[reason] += 1
+
+    def _enforce_limits(self, protect=None):
+        """Вытесняет сессии, пока не выполнены ограничения по времени, количеству и объему"""
+        now = time.monotonic()
+
+        while self._sessions:
+            chat_id, session = next(iter(self._sessions.items()))
+            if chat_id == protect:
+                break
+
+            if now - session.updated_at > self.idle_ttl:
+                self._remove(chat_id, "ttl")
+            elif len(self._sessions) > self.max_sessions:
+                self._remove(chat_id, "lru")
+            elif self._total_size > self.max_memory:
+                self._remove(chat_id, "memory")
+            else:
+                break
+
+
+class SqliteSessionStore(MemorySessionStore):
+    """
+    Хранилище сессий в памяти с сохранением в SQLite
+
+    Чтение и изменение сессий выполняются в памяти (они вызываются в том
+    числе из фильтров обработчиков в цикле событий), а запись в базу идет в
+    фоновом потоке. При запуске сессии загружаются из базы, поэтому
+    состояние диалогов переживает перезапуск бота.
+    """
+
+    def __init__(self, path=None, max_sessions=None, idle_ttl=None, max_memory_mb=None, cleanup_interval=100):
+        """
+        Инициализация
+
+        Args:
+            path (str, optional): Путь к базе (SESSION_DB_PATH или sessions.db)
+            max_sessions (int, optional): Максимум сессий (SESSION_MAX_SESSIONS или 10000)
+            idle_ttl (float, optional): Время простоя до удаления сессии (SESSION_IDLE_TTL или 86400)
+            max_memory_mb (float, optional): Максимальный объем данных сессий (SESSION_MAX_MEMORY_MB или 64)
+            cleanup_interval (int): Через сколько записей выполнять очистку базы
+        """
+        super().__init__(max_sessions, idle_ttl, max_memory_mb)
+        self.path = path or os.getenv("SESSION_DB_PATH", "sessions.db")
+        self.cleanup_interval = cleanup_interval
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "chat_id INTEGER PRIMARY KEY, state TEXT, message TEXT, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        self._conn.commit()
+        self._load()
+
+        # Очередь записи: (chat_id, state, message, updated_at) или (chat_id, None) для удаления
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+        self._writer.start()
+
+    def _load(self):
+        """Загружает в память неустаревшие сессии (не больше max_sessions самых свежих)"""
+        wall_now, now = time.time(), time.monotonic()
+        rows = self._conn.execute(
+            "SELECT chat_id, state, message, updated_at FROM sessions WHERE updated_at >= ? "
+            "ORDER BY updated_at DESC LIMIT ?",
+            (wall_now - self.idle_ttl, self.max_sessions)
+        ).fetchall()
+        with self._lock:
+            for chat_id, state, message, updated_at in reversed(rows):
+                session = ChatSession(chat_id, state, message, now - (wall_now - updated_at))
+                self._sessions[chat_id] = session
+                self._total_size += session.size
+        logger.info(f"Загружено {len(rows)} сессий из {self.path}")
+
+    def update(self, chat_id, **fields):
+        session = super().update(chat_id, **fields)
+        self._writes.put((chat_id, session.state, session.message, time.time()))
+        return session
+
+    def _remove(self, chat_id, reason=None):
+        super()._remove(chat_id, reason)
+        self._writes.put((chat_id, None))
+
+    def _write_loop(self):
+        """Фоновая запись изменений в базу"""
+        written = 0
+        while True:
+            item = self._writes.get()
+            if item is None:
+                break
+            try:
+                if len(item) == 2:
+                    self._conn.execute("DELETE FROM sessions WHERE chat_id = ?", (item[0],))
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO sessions (chat_id, state, message, updated_at) VALUES (?, ?, ?, ?)",
+                        item
+                    )
+                # Накопившиеся изменения сохраняем одной транзакцией
+                if self._writes.empty():
+                    self._conn.commit()
+
+                written += 1
+                if written % self.cleanup_interval == 0:
+                    self.cleanup()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка записи сессии в базу: {e}")
+        self._conn.commit()
+
+    def cleanup(self):
+        """Удаляет из базы устаревшие сессии и самые старые сессии сверх лимита"""
+        self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.idle_ttl,))
+        self._conn.execute(
+            "DELETE FROM sessions WHERE chat_id NOT IN "
+            "(SELECT chat_id FROM sessions ORDER BY updated_at DESC LIMIT ?)",
+            (self.max_sessions,)
+        )
+        self._conn.commit()
+
+    def close(self):
+        """Дописывает накопившиеся изменения и закрывает соединение с базой"""
+        if self._writer.is_alive():
+            self._writes.put(None)
+            self._writer.join()
+        self._conn.close()
+
+
+def create_session_store(backend=None):
+    """
+    Создает хранилище сессий
+
+    Args:
+        backend (str, optional): memory или sqlite (по умолчанию SESSION_BACKEND или memory)
+
+    Returns:
+        SessionStore: Хранилище
+    """
+    backend = (backend or os.getenv("SESSION_BACKEND", "memory")).lower()
+    if backend == "sqlite":
+        store = SqliteSessionStore()
+    else:
+        store = MemorySessionStore()
+    logger.info(f"Хранилище сессий: {type(store).__name__}")
+    return store
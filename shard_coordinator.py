@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Многопроцессный режим работы бота с шардированием по chat_id
+
+Координатор получает обновления Telegram (polling или webhook) и передает
+каждое из них одному из N процессов-обработчиков. Процесс выбирается по
+chat_id с помощью консистентного хеширования, поэтому все сообщения одного
+пользователя обрабатываются одним процессом в исходном порядке, а его
+состояние остается локальным для этого процесса.
+"""
+
+import os
+import sys
+import time
+import bisect
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+
+from telebot import asyncio_helper
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Поля обновления, в которых может находиться чат
+_CHAT_UPDATE_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "my_chat_member", "chat_member", "chat_join_request"
+)
+
+
+class HashRing:
+    """Кольцо консистентного хеширования с виртуальными узлами"""
+
+    def __init__(self, nodes, replicas=100):
+        """
+        Инициализация кольца
+
+        Args:
+            nodes (list): Идентификаторы узлов (номера процессов)
+            replicas (int): Количество виртуальных узлов на один реальный
+        """
+        self.replicas = replicas
+        self._ring = []
+        self._nodes = {}
+
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(key):
+        """Стабильный между процессами хеш ключа"""
+        return int(hashlib.md5(str(key).encode("utf-8")).hexdigest()[:16], 16)
+
+    def add_node(self, node):
+        """Добавляет узел в кольцо"""
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}:{replica}")
+            self._nodes[point] = node
+            bisect.insort(self._ring, point)
+
+    def get_node(self, key):
+        """
+        Возвращает узел, ответственный за ключ
+
+        Args:
+            key: Ключ (например, chat_id)
+
+        Returns:
+            Идентификатор узла
+        """
+        if not self._ring:
+            raise ValueError("Кольцо хеширования пусто")
+
+        index = bisect.bisect(self._ring, self._hash(key)) % len(self._ring)
+        return self._nodes[self._ring[index]]
+
+
+def extract_chat_id(update):
+    """
+    Извлекает chat_id из обновления Telegram в формате Bot API
+
+    Args:
+        update (dict): Обновление
+
+    Returns:
+        int: chat_id или None, если обновление не относится к чату
+    """
+    for field in _CHAT_UPDATE_FIELDS:
+        chat = (update.get(field) or {}).get("chat")
+        if chat:
+            return chat.get("id")
+
+    callback_query = update.get("callback_query")
+    if callback_query:
+        message = callback_query.get("message") or {}
+        chat_id = (message.get("chat") or {}).get("id")
+        return chat_id if chat_id is not None else (callback_query.get("from") or {}).get("id")
+
+    for field in ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query"):
+        if update.get(field):
+            return (update[field].get("from") or {}).get("id")
+
+    return None
+
+
+def run_shard_worker(index, update_queue, processes):
+    """
+    Точка входа процесса-обработчика
+
+    Args:
+        index (int): Номер процесса
+        update_queue: Очередь multiprocessing с обновлениями для этого процесса
+        processes (int): Общее количество процессов-обработчиков
+    """
+    # При spawn дочерний процесс уже выполнил главный скрипт родителя как __mp_main__.
+    # Если это optimization_bot.py, используем загруженный модуль: повторный импорт
+    # создал бы второй экземпляр бота, пулов соединений и хранилищ
+    main_module = sys.modules.get("__mp_main__")
+    main_path = getattr(main_module, "__file__", None) or ""
+    if os.path.basename(main_path) == "optimization_bot.py":
+        sys.modules.setdefault("optimization_bot", main_module)
+
+    # Импортируем бота только в процессе-обработчике
+    import optimization_bot
+
+    try:
+        asyncio.run(optimization_bot.serve_shard(index, update_queue, processes))
+    except KeyboardInterrupt:
+        pass
+
+
+class ShardCoordinator:
+    """Координатор, распределяющий обновления между процессами-обработчиками"""
+
+    def __init__(self, bot, processes=None):
+        """
+        Инициализация координатора
+
+        Args:
+            bot: Экземпляр AsyncTeleBot (используется для работы с Bot API)
+            processes (int, optional): Количество процессов (по умолчанию BOT_WORKER_PROCESSES)
+        """
+        self.bot = bot
+        self.processes = processes or int(os.getenv("BOT_WORKER_PROCESSES", "2"))
+        self.ring = HashRing(range(self.processes))
+
+        # spawn работает одинаково на Linux, macOS и Windows
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue() for _ in range(self.processes)]
+        self._workers = [None] * self.processes
+
+    def _start_worker(self, index):
+        """Запускает (или перезапускает) процесс-обработчик"""
+        process = self._context.Process(
+            target=run_shard_worker,
+            args=(index, self._queues[index], self.processes),
+            name=f"bot-shard-{index}",
+            daemon=True
+        )
+        process.start()
+        self._workers[index] = process
+        logger.info(f"Запущен процесс-обработчик {index} (PID: {process.pid})")
+
+    def start(self):
+        """Запускает все процессы-обработчики"""
+        for index in range(self.processes):
+            self._start_worker(index)
+
+    def ensure_workers_alive(self):
+        """Перезапускает завершившиеся процессы-обработчики"""
+        for index, process in enumerate(self._workers):
+            if process is not None and not process.is_alive():
+                logger.warning(f"Процесс-обработчик {index} завершился (код {process.exitcode}), перезапускаем")
+                self._start_worker(index)
+
+    def stop(self, timeout=30):
+        """
+        Останавливает процессы-обработчики
+
+        Args:
+            timeout (float): Общее время ожидания завершения всех процессов (в секундах)
+        """
+        for update_queue in self._queues:
+            update_queue.put(None)
+
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self._workers):
+            if process is None:
+                continue
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Процесс-обработчик {index} не завершился вовремя, принудительная остановка")
+                process.terminate()
+                process.join(1)
+
+        # Поток отправки очереди не должен ждать остановленный процесс при выходе
+        for update_queue in self._queues:
+            update_queue.close()
+            update_queue.cancel_join_thread()
+
+    def route(self, update):
+        """
+        Передает обновление процессу, ответственному за его чат
+
+        Args:
+            update (dict): Обновление в формате Bot API
+
+        Returns:
+            int: Номер процесса, получившего обновление
+        """
+        chat_id = extract_chat_id(update)
+        key = chat_id if chat_id is not None else update.get("update_id", 0)
+        index = self.ring.get_node(key)
+        self._queues[index].put(update)
+        return index
+
+    async def dispatch(self, update):
+        """Асинхронная обертка над route() для сервера webhook"""
+        self.route(update)
+
+    async def run_polling(self, timeout=15, request_timeout=30):
+        """Получает обновления через getUpdates и распределяет их между процессами"""
+        offset = None
+        while True:
+            try:
+                updates = await asyncio_helper.get_updates(
+                    self.bot.token, offset=offset, timeout=timeout, request_timeout=request_timeout
+                )
+            except asyncio_helper.ApiTelegramException as e:
+                logger.error(f"Ошибка Telegram API при получении обновлений: {e}")
+                await asyncio.sleep(5)
+                continue
+            except Exception as e:
+                logger.error(f"Ошибка при получении обновлений: {e}")
+                await asyncio.sleep(5)
+                continue
+
+            for update in updates:
+                offset = update["update_id"] + 1
+                self.route(update)
+
+            self.ensure_workers_alive()
@@ -0,0 +1,44 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Замер длительности этапов запуска бота"""
+
+    def __init__(self):
+        """Начинает отсчет времени запуска"""
+        self.started_at = time.perf_counter()
+        self._last_mark = self.started_at
+        self.stages = []
+        self._reported = False
+
+    def mark(self, stage):
+        """
+        Фиксирует завершение этапа запуска
+
+        Args:
+            stage (str): Название этапа
+        """
+        now = time.perf_counter()
+        self.stages.append((stage, now - self._last_mark))
+        self._last_mark = now
+
+    def total(self):
+        """Время от начала запуска до последнего этапа (в секундах)"""
+        return self._last_mark - self.started_at
+
+    def report(self):
+        """
+        Выводит в лог отчет о времени запуска (один раз за время работы процесса)
+
+        Returns:
+            str: Текст отчета
+        """
+        stages = ", ".join(f"{stage}: {duration * 1000:.0f} мс" for stage, duration in self.stages)
+        text = f"Бот готов к работе за {self.total() * 1000:.0f} мс ({stages})"
+        if not self._reported:
+            logger.info(text)
+            self._reported = True
+        return text
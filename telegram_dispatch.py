@@ -0,0 +1,331 @@
+import os
+import time
+import asyncio
+import logging
+import itertools
+
+from telebot.asyncio_helper import ApiTelegramException
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих сообщений (меньше - важнее)
+PRIORITY_RESULT = 0   # Готовые архивы и инструкции к ним
+PRIORITY_STATUS = 1   # Служебные и статусные сообщения
+
+
+class TokenBucket:
+    """Ведро токенов для ограничения частоты запросов"""
+
+    def __init__(self, rate, capacity):
+        """
+        Инициализация ведра
+
+        Args:
+            rate (float): Скорость пополнения (токенов в секунду)
+            capacity (float): Максимальное количество токенов
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        """Пополняет ведро на момент времени now"""
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def delay(self, now=None):
+        """
+        Возвращает время ожидания до появления одного токена
+
+        Returns:
+            float: Задержка в секундах (0, если токен доступен сейчас)
+        """
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now=None):
+        """Забирает один токен"""
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now=None):
+        """Проверяет, что ведро полностью пополнено (им давно не пользовались)"""
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _OutboundRequest:
+    """Исходящий запрос к Bot API, ожидающий отправки"""
+
+    _seq = itertools.count()
+
+    def __init__(self, method, chat_id, args, kwargs, priority, future):
+        self.method = method
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.seq = next(self._seq)
+        self.attempts = 0
+
+    @property
+    def sort_key(self):
+        return (self.priority, self.seq)
+
+
+def get_retry_after(error):
+    """
+    Извлекает retry_after из ошибки 429 Telegram
+
+    Args:
+        error (ApiTelegramException): Ошибка Bot API
+
+    Returns:
+        float: Время ожидания в секундах
+    """
+    parameters = (getattr(error, "result_json", None) or {}).get("parameters") or {}
+    try:
+        return float(parameters.get("retry_after", 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class OutboundDispatcher:
+    """
+    Очередь исходящих сообщений Telegram с ограничением частоты
+
+    Соблюдает общие лимиты Bot API (около 30 сообщений в секунду),
+    лимит на чат (около 1 сообщения в секунду, 20 в минуту для групп),
+    отправляет результаты раньше статусных сообщений и повторяет запросы
+    после ответа 429 с учетом retry_after.
+    """
+
+    def __init__(self, bot, global_rate=None, chat_rate=None, chat_burst=None, group_rate_per_minute=None,
+                 group_burst=None, concurrency=None, max_retries=3):
+        """
+        Инициализация диспетчера
+
+        Args:
+            bot: Экземпляр AsyncTeleBot
+            global_rate (float, optional): Сообщений в секунду для всего бота (TELEGRAM_GLOBAL_RATE или 30)
+            chat_rate (float, optional): Сообщений в секунду для личного чата (TELEGRAM_CHAT_RATE или 1)
+            chat_burst (int, optional): Допустимая короткая серия сообщений в чат (TELEGRAM_CHAT_BURST или 3)
+            group_rate_per_minute (float, optional): Сообщений в минуту для группы (TELEGRAM_GROUP_RATE_PER_MINUTE или 20)
+            group_burst (int, optional): Допустимая короткая серия сообщений в группу (TELEGRAM_GROUP_BURST или 3)
+            concurrency (int, optional): Одновременных запросов к Bot API (TELEGRAM_SEND_CONCURRENCY или 10)
+            max_retries (int): Количество повторов после ответа 429
+        """
+        self.bot = bot
+        self.global_rate = global_rate or float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+        self.chat_rate = chat_rate or float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+        self.chat_burst = chat_burst or int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+        self.group_rate_per_minute = group_rate_per_minute or float(os.getenv("TELEGRAM_GROUP_RATE_PER_MINUTE", "20"))
+        self.group_burst = group_burst or int(os.getenv("TELEGRAM_GROUP_BURST", "3"))
+        self.concurrency = concurrency or int(os.getenv("TELEGRAM_SEND_CONCURRENCY", "10"))
+        self.max_retries = max_retries
+
+        self._global_bucket = TokenBucket(self.global_rate, self.global_rate)
+        self._chat_buckets = {}
+        self._blocked_until = {}   # chat_id -> момент окончания retry_after
+        self._pending = []
+        self._wakeup = None
+        self._slots = None
+        self._task = None
+        self._send_tasks = set()
+
+    def limit_global_share(self, parts):
+        """
+        Оставляет этому процессу долю общего лимита бота
+
+        В многопроцессном режиме каждый процесс-обработчик отправляет сообщения
+        сам, поэтому общий лимит делится между ними поровну.
+
+        Args:
+            parts (int): Количество процессов, отправляющих сообщения
+        """
+        if parts <= 1:
+            return
+        self.global_rate = self.global_rate / parts
+        self._global_bucket = TokenBucket(self.global_rate, max(1.0, self.global_rate))
+        logger.info(f"Общий лимит отправки процесса: {self.global_rate:.1f} сообщений в секунду")
+
+    async def start(self):
+        """Запускает цикл отправки"""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.create_task(self._run(), name="telegram-outbound")
+
+    async def stop(self):
+        """Останавливает цикл отправки, неотправленные запросы отменяются"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await asyncio.gather(*self._send_tasks, return_exceptions=True)
+        for request in self._pending:
+            if not request.future.done():
+                request.future.cancel()
+        self._pending = []
+        self._task = None
+
+    async def send_message(self, chat_id, text, priority=PRIORITY_STATUS, **kwargs):
+        """Отправляет текстовое сообщение (аналог bot.send_message)"""
+        return await self.call("send_message", chat_id, chat_id, text, priority=priority, **kwargs)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, priority=PRIORITY_STATUS, **kwargs):
+        """Редактирует сообщение (аналог bot.edit_message_text)"""
+        return await self.call("edit_message_text", chat_id, text, chat_id, message_id, priority=priority, **kwargs)
+
+    async def send_document(self, chat_id, document, priority=PRIORITY_RESULT, **kwargs):
+        """Отправляет документ (аналог bot.send_document)"""
+        return await self.call("send_document", chat_id, chat_id, document, priority=priority, **kwargs)
+
+    async def call(self, method, chat_id, *args, priority=PRIORITY_STATUS, **kwargs):
+        """
+        Ставит вызов метода бота в очередь и дожидается результата
+
+        Args:
+            method (str): Имя метода AsyncTeleBot
+            chat_id (int): Чат, к лимитам которого относится вызов
+            *args: Позиционные аргументы метода
+            priority (int): PRIORITY_RESULT или PRIORITY_STATUS
+            **kwargs: Именованные аргументы метода
+
+        Returns:
+            Результат вызова метода
+        """
+        if self._task is None:
+            # Диспетчер не запущен - отправляем напрямую
+            return await getattr(self.bot, method)(*args, **kwargs)
+
+        future = asyncio.get_running_loop().create_future()
+        request = _OutboundRequest(method, chat_id, args, kwargs, priority, future)
+        self._pending.append(request)
+        self._wakeup.set()
+
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if request in self._pending:
+                self._pending.remove(request)
+            raise
+
+    def _chat_bucket(self, chat_id):
+        """Возвращает ведро токенов для чата"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id < 0:
+                rate = self.group_rate_per_minute / 60
+                bucket = TokenBucket(rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_buckets(self, now):
+        """Удаляет ведра давно неактивных чатов"""
+        if len(self._chat_buckets) < 10000:
+            return
+        for chat_id in [key for key, bucket in self._chat_buckets.items() if bucket.is_full(now)]:
+            del self._chat_buckets[chat_id]
+            self._blocked_until.pop(chat_id, None)
+
+    def _next_ready(self, now):
+        """
+        Выбирает следующий запрос, который можно отправить сейчас
+
+        Returns:
+            tuple: (запрос или None, время ожидания до следующей попытки или None)
+        """
+        if not self._pending:
+            return None, None
+
+        global_delay = self._global_bucket.delay(now)
+        if global_delay > 0:
+            return None, global_delay
+
+        min_delay = None
+        for request in sorted(self._pending, key=lambda item: item.sort_key):
+            delay = max(
+                self._chat_bucket(request.chat_id).delay(now),
+                self._blocked_until.get(request.chat_id, 0) - now
+            )
+            if delay <= 0:
+                return request, 0
+            min_delay = delay if min_delay is None else min(min_delay, delay)
+        return None, min_delay
+
+    async def _run(self):
+        """Цикл выбора и отправки запросов с учетом лимитов и приоритетов"""
+        while True:
+            now = time.monotonic()
+            request, delay = self._next_ready(now)
+
+            if request is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._slots.acquire()
+            if request not in self._pending:
+                # Запрос отменили, пока ждали свободный слот
+                self._slots.release()
+                continue
+
+            self._pending.remove(request)
+            now = time.monotonic()
+            self._global_bucket.consume(now)
+            self._chat_bucket(request.chat_id).consume(now)
+            self._prune_buckets(now)
+
+            task = asyncio.create_task(self._execute(request))
+            self._send_tasks.add(task)
+            task.add_done_callback(self._send_tasks.discard)
+
+    async def _execute(self, request):
+        """Выполняет запрос и обрабатывает ответ 429"""
+        try:
+            if request.future.done():
+                return
+            result = await getattr(self.bot, request.method)(*request.args, **request.kwargs)
+            if not request.future.done():
+                request.future.set_result(result)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and request.attempts < self.max_retries:
+                retry_after = get_retry_after(e)
+                request.attempts += 1
+                self._blocked_until[request.chat_id] = time.monotonic() + retry_after
+                logger.warning(f"Telegram ограничил отправку в чат {request.chat_id}, повтор через {retry_after:.0f} с")
+
+                # Документ нужно отправить заново с начала
+                for value in list(request.args) + list(request.kwargs.values()):
+                    if hasattr(value, "seek"):
+                        value.seek(0)
+
+                self._pending.append(request)
+            elif not request.future.done():
+                request.future.set_exception(e)
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        finally:
+            self._slots.release()
+            self._wakeup.set()
@@ -0,0 +1,48 @@
+import asyncio
+
+from deadline import Deadline, DeadlineExceeded, BUDGET_LLM, BUDGET_SEND
+
+
+def test_stage_completes_within_budget():
+    async def stage():
+        await asyncio.sleep(0)
+        return "готово"
+
+    deadline = Deadline(total=10, budgets={BUDGET_LLM: 5})
+    assert asyncio.run(deadline.run(BUDGET_LLM, stage())) == "готово"
+
+
+def test_stage_over_budget_raises():
+    deadline = Deadline(total=10, budgets={BUDGET_LLM: 0.05})
+    try:
+        asyncio.run(deadline.run(BUDGET_LLM, asyncio.sleep(1)))
+    except DeadlineExceeded as e:
+        assert e.stage == BUDGET_LLM
+        assert 0 < e.budget <= 0.05
+        assert str(e) == f"Этап '{BUDGET_LLM}' не завершился за 0.1 с"
+    else:
+        raise AssertionError("ожидалась DeadlineExceeded")
+
+
+def test_budget_is_capped_by_remaining_time():
+    deadline = Deadline(total=2, budgets={BUDGET_SEND: 60})
+    assert deadline.budget(BUDGET_SEND) <= 2
+    assert not deadline.expired
+
+
+def test_expired_deadline_rejects_stage_without_running_it():
+    deadline = Deadline(total=1)
+    deadline.expires_at = deadline.started_at
+    started = []
+
+    async def stage():
+        started.append(1)
+
+    try:
+        asyncio.run(deadline.run(BUDGET_LLM, stage()))
+    except DeadlineExceeded as e:
+        assert e.budget == 0
+    else:
+        raise AssertionError("ожидалась DeadlineExceeded")
+    assert deadline.expired
+    assert started == []
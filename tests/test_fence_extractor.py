@@ -0,0 +1,64 @@
+from fence_extractor import FenceExtractor
+
+RESPONSE = (
+    "Вот скрипты:\n"
+    "```powershell\n"
+    "Write-Host \"Готово\"\n"
+    "if ($true) {\n"
+    "    exit 0\n"
+    "}\n"
+    "```\n"
+    "И запуск:\n"
+    "```Batch\r\n"
+    "@echo off\r\n"
+    "```\n"
+    "```markdown\n"
+    "# Инструкция\n"
+)
+
+
+def test_blocks_are_returned_as_soon_as_they_close():
+    extractor = FenceExtractor()
+    assert extractor.feed(RESPONSE[:40]) == []
+    blocks = extractor.feed(RESPONSE[40:])
+    assert blocks == [
+        ("powershell", "Write-Host \"Готово\"\nif ($true) {\n    exit 0\n}\n"),
+        ("batch", "@echo off\n")
+    ]
+
+
+def test_result_does_not_depend_on_chunking():
+    whole = FenceExtractor().feed(RESPONSE)
+    for size in (1, 2, 3, 7, 64):
+        extractor = FenceExtractor()
+        blocks = []
+        for start in range(0, len(RESPONSE), size):
+            blocks.extend(extractor.feed(RESPONSE[start:start + size]))
+        assert blocks == whole
+
+
+def test_unclosed_block_is_not_returned():
+    extractor = FenceExtractor()
+    extractor.feed(RESPONSE)
+    assert extractor.feed("ещё строка\n") == []
+    assert extractor.feed("```\n") == [("markdown", "# Инструкция\nещё строка\n")]
+
+
+def test_closing_fence_needs_its_own_line():
+    extractor = FenceExtractor()
+    blocks = extractor.feed("```python\nprint('```')\n```\n")
+    assert blocks == [("python", "print('```')\n")]
+
+
+def test_finish_emits_block_closed_by_last_line_without_newline():
+    extractor = FenceExtractor()
+    assert extractor.feed("```batch\n@echo off\n```") == []
+    assert extractor.finish() == [("batch", "@echo off\n")]
+    assert extractor.finish() == []
+
+
+def test_finish_ignores_unclosed_block():
+    extractor = FenceExtractor()
+    extractor.feed("```powershell\nWrite-Host 1\nWrite-Host 2")
+    assert extractor.finish() == []
+
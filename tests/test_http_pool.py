@@ -0,0 +1,41 @@
+import base64
+import hashlib
+import os
+
+from http_pool import Base64StreamEncoder
+
+
+def encode_in_chunks(data, size):
+    encoder = Base64StreamEncoder()
+    for start in range(0, len(data), size):
+        encoder.update(data[start:start + size])
+    return encoder, encoder.finish()
+
+
+def test_stream_encoding_matches_b64encode_for_any_chunk_size():
+    data = os.urandom(1000)
+    expected = base64.b64encode(data).decode("ascii")
+    for size in (1, 2, 3, 4, 5, 16, 999, 1000, 4096):
+        encoder, encoded = encode_in_chunks(data, size)
+        assert encoded == expected
+        assert encoder.size == len(data)
+
+
+def test_header_and_digest():
+    data = b"\x89PNG\r\n\x1a\n" + os.urandom(100)
+    encoder, _ = encode_in_chunks(data, 5)
+    assert encoder.header == data[:Base64StreamEncoder.HEADER_SIZE]
+    assert encoder.digest.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_empty_input():
+    encoder = Base64StreamEncoder()
+    assert encoder.finish() == ""
+    assert encoder.size == 0
+
+
+def test_finish_releases_buffer():
+    encoder, encoded = encode_in_chunks(b"abcd", 3)
+    assert encoded == "YWJjZA=="
+    # Повторный вызов не отдает уже возвращенный текст
+    assert encoder.finish() == ""
@@ -0,0 +1,128 @@
+import io
+import os
+
+from PIL import Image
+
+import image_preprocessor
+from image_preprocessor import ImagePreprocessor
+
+
+def encode(image, image_format, **options):
+    output = io.BytesIO()
+    image.save(output, format=image_format, **options)
+    return output.getvalue()
+
+
+def flat_screenshot(width, height):
+    """Скриншот с крупными однотонными областями"""
+    image = Image.new("RGB", (width, height), (30, 30, 30))
+    image.paste((240, 240, 240), (0, 0, width // 2, height // 3))
+    image.paste((0, 90, 200), (width // 3, height // 2, width, height))
+    return image
+
+
+def noise(width, height, mode="RGB"):
+    """Изображение без однотонных областей (плохо жмется в PNG)"""
+    return Image.frombytes(mode, (width, height), os.urandom(width * height * len(mode)))
+
+
+def test_downscales_above_max_dimension():
+    data = encode(noise(1600, 800), "JPEG", quality=95)
+    prepared = ImagePreprocessor(max_dimension=800, enabled=True).process(data)
+
+    assert prepared.media_type == "image/jpeg"
+    with Image.open(io.BytesIO(prepared.data)) as result:
+        assert result.size == (800, 400)
+    assert prepared.tokens_after < prepared.tokens_before
+    assert prepared.bytes_saved > 0
+    assert prepared.perceptual_hash
+
+
+def test_flat_png_stays_png():
+    data = encode(flat_screenshot(1600, 800), "PNG")
+    prepared = ImagePreprocessor(max_dimension=800, enabled=True).process(data)
+
+    assert prepared.media_type == "image/png"
+    with Image.open(io.BytesIO(prepared.data)) as result:
+        assert (result.format, result.size) == ("PNG", (800, 400))
+
+
+def test_noisy_png_with_alpha_becomes_jpeg():
+    data = encode(noise(1200, 600, "RGBA"), "PNG")
+    prepared = ImagePreprocessor(max_dimension=600, enabled=True).process(data)
+
+    assert prepared.media_type == "image/jpeg"
+    with Image.open(io.BytesIO(prepared.data)) as result:
+        assert (result.format, result.mode, result.size) == ("JPEG", "RGB", (600, 300))
+
+
+def test_passes_original_through_when_not_smaller():
+    data = encode(noise(400, 300), "JPEG", quality=40)
+    prepared = ImagePreprocessor(max_dimension=800, jpeg_quality=95, enabled=True).process(data)
+
+    assert prepared.data == data
+    assert prepared.media_type == "image/jpeg"
+    assert prepared.bytes_saved == 0
+    assert prepared.tokens_saved == 0
+    assert prepared.tokens_before == prepared.tokens_after
+
+
+def test_undecodable_bytes_fall_back_to_original():
+    data = b"\x89PNG\r\n\x1a\n" + b"not really a png" * 10
+    prepared = ImagePreprocessor(enabled=True).process(data)
+
+    assert prepared.data == data
+    assert prepared.media_type == "image/png"
+    assert prepared.tokens_before is None
+    assert prepared.tokens_saved == 0
+
+
+def test_accepts_bytesio():
+    data = encode(noise(1600, 800), "JPEG", quality=95)
+    prepared = ImagePreprocessor(max_dimension=800, enabled=True).process(io.BytesIO(data))
+
+    with Image.open(io.BytesIO(prepared.data)) as result:
+        assert result.size == (800, 400)
+    assert prepared.original_bytes == len(data)
+
+
+def test_without_pillow_sends_original(monkeypatch):
+    monkeypatch.setattr(image_preprocessor, "Image", None)
+    data = encode(noise(1600, 800), "PNG")
+    preprocessor = ImagePreprocessor(max_dimension=800, enabled=True)
+    prepared = preprocessor.process(io.BytesIO(data))
+
+    assert not preprocessor.available
+    assert bytes(prepared.data) == data
+    assert prepared.media_type == "image/png"
+    assert prepared.perceptual_hash is None
+
+
+def test_disabled_preprocessing_sends_original():
+    data = encode(noise(1600, 800), "JPEG")
+    prepared = ImagePreprocessor(max_dimension=800, enabled=False).process(data)
+
+    assert prepared.data == data
+    assert prepared.media_type == "image/jpeg"
+
+
+def test_converted_copy_is_closed(monkeypatch):
+    converted, closed = [], []
+    original_convert, original_close = Image.Image.convert, Image.Image.close
+
+    def convert(self, *args, **kwargs):
+        result = original_convert(self, *args, **kwargs)
+        if args and args[0] == "RGB":
+            converted.append(result)
+        return result
+
+    def close(self):
+        closed.append(self)
+        original_close(self)
+
+    monkeypatch.setattr(Image.Image, "convert", convert)
+    monkeypatch.setattr(Image.Image, "close", close)
+    ImagePreprocessor(max_dimension=600, enabled=True).process(encode(noise(1200, 600, "RGBA"), "PNG"))
+
+    assert len(converted) == 1
+    assert any(image is converted[0] for image in closed)
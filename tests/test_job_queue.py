@@ -0,0 +1,192 @@
+import asyncio
+import threading
+
+from job_queue import (
+    Job, JobQueue, QueueFullError, JOB_KIND_GENERATE, JOB_KIND_FIX, PRIORITY_ADMIN,
+    JOB_STATE_RUNNING, JOB_STATE_DONE, JOB_STATE_CANCELLED
+)
+
+
+class RecordingStore:
+    """Хранилище, запоминающее переходы состояний задач"""
+
+    def __init__(self):
+        self.states = []
+        self.threads = set()
+        self.closed = False
+
+    def _record(self, job, state):
+        self.threads.add(threading.get_ident())
+        self.states.append((job.id, state))
+
+    def add(self, job):
+        self._record(job, "added")
+
+    def mark_running(self, job):
+        self._record(job, JOB_STATE_RUNNING)
+
+    def mark_finished(self, job, state):
+        self._record(job, state)
+
+    def close(self):
+        self.closed = True
+
+
+async def wait_until(predicate, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline, "условие не выполнилось вовремя"
+        await asyncio.sleep(0.01)
+
+
+def test_priority_classes_and_round_robin_between_chats():
+    async def scenario():
+        gate = asyncio.Event()
+        order = []
+
+        async def handler(job):
+            if job.user_text == "blocker":
+                await gate.wait()
+            else:
+                order.append(job.user_text)
+
+        queue = JobQueue(handler, workers=1, max_size=10)
+        await queue.start()
+
+        queue.submit(Job(JOB_KIND_GENERATE, 1, "file", user_text="blocker"))
+        await wait_until(lambda: queue.get_stats()["active"] == 1)
+
+        queue.submit(Job(JOB_KIND_GENERATE, 1, "file", user_text="chat1-first"))
+        queue.submit(Job(JOB_KIND_GENERATE, 1, "file", user_text="chat1-second"))
+        queue.submit(Job(JOB_KIND_GENERATE, 2, "file", user_text="chat2"))
+        queue.submit(Job(JOB_KIND_FIX, 3, "file", user_text="fix"))
+        queue.submit(Job(JOB_KIND_GENERATE, 4, "file", user_text="admin", priority=PRIORITY_ADMIN))
+
+        gate.set()
+        await wait_until(lambda: len(order) == 5)
+        await queue.stop()
+        return order
+
+    assert asyncio.run(scenario()) == ["admin", "fix", "chat1-first", "chat2", "chat1-second"]
+
+
+def test_submit_rejects_jobs_beyond_max_size():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def handler(job):
+            await gate.wait()
+
+        queue = JobQueue(handler, workers=1, max_size=1)
+        await queue.start()
+        queue.submit(Job(JOB_KIND_GENERATE, 1, "file"))
+        await wait_until(lambda: queue.get_stats()["active"] == 1)
+        queue.submit(Job(JOB_KIND_GENERATE, 2, "file"))
+        try:
+            queue.submit(Job(JOB_KIND_GENERATE, 3, "file"))
+        except QueueFullError:
+            rejected = True
+        else:
+            rejected = False
+        gate.set()
+        await queue.stop()
+        return rejected
+
+    assert asyncio.run(scenario())
+
+
+def test_cancel_pending_and_running_jobs():
+    async def scenario():
+        store = RecordingStore()
+        started = asyncio.Event()
+
+        async def handler(job):
+            started.set()
+            await asyncio.Event().wait()
+
+        queue = JobQueue(handler, workers=1, max_size=10, store=store)
+        await queue.start()
+
+        running = Job(JOB_KIND_GENERATE, 1, "file")
+        pending = Job(JOB_KIND_GENERATE, 2, "file")
+        queue.submit(running)
+        await started.wait()
+        queue.submit(pending)
+
+        assert queue.cancel(pending)
+        assert queue.cancel(running)
+        assert not queue.cancel(running)
+        await wait_until(lambda: running.finished_at is not None)
+
+        stats = queue.get_stats()
+        await queue.stop()
+        await queue.close_store()
+        return store, running, pending, stats
+
+    store, running, pending, stats = asyncio.run(scenario())
+    assert running.abort_event.is_set() and pending.abort_event.is_set()
+    assert (pending.id, JOB_STATE_CANCELLED) in store.states
+    assert (running.id, JOB_STATE_CANCELLED) in store.states
+    assert (pending.id, JOB_STATE_RUNNING) not in store.states
+    assert stats["cancelled"] == 2
+    assert stats["pending"] == 0 and stats["active"] == 0
+
+
+def test_drain_waits_for_running_jobs_and_leaves_pending_ones():
+    async def scenario():
+        store = RecordingStore()
+        gate = asyncio.Event()
+
+        async def handler(job):
+            await gate.wait()
+
+        queue = JobQueue(handler, workers=1, max_size=10, store=store)
+        await queue.start()
+        running = Job(JOB_KIND_GENERATE, 1, "file")
+        pending = Job(JOB_KIND_GENERATE, 2, "file")
+        queue.submit(running)
+        await wait_until(lambda: queue.get_stats()["active"] == 1)
+        queue.submit(pending)
+
+        unfinished_on_timeout = await queue.drain(0.05)
+        gate.set()
+        unfinished = await queue.drain(1.0)
+        await asyncio.sleep(0.05)
+        await queue.stop()
+        await queue.close_store()
+        return store, running, pending, unfinished_on_timeout, unfinished
+
+    store, running, pending, unfinished_on_timeout, unfinished = asyncio.run(scenario())
+    assert unfinished_on_timeout == 1
+    assert unfinished == 0
+    assert (running.id, JOB_STATE_DONE) in store.states
+    # Ожидающая задача не начиналась и будет выполнена после перезапуска
+    assert pending.started_at is None
+    assert [state for job_id, state in store.states if job_id == pending.id] == ["added"]
+
+
+def test_store_writes_run_off_the_loop_in_order():
+    async def scenario():
+        store = RecordingStore()
+
+        async def handler(job):
+            pass
+
+        queue = JobQueue(handler, workers=1, max_size=10, store=store)
+        await queue.start()
+        jobs = [Job(JOB_KIND_GENERATE, chat_id, "file") for chat_id in range(3)]
+        for job in jobs:
+            queue.submit(job)
+        await wait_until(lambda: all(job.finished_at is not None for job in jobs))
+        await queue.stop()
+        await queue.close_store()
+        return store, jobs, threading.get_ident()
+
+    store, jobs, loop_thread = asyncio.run(scenario())
+    assert store.closed
+    assert loop_thread not in store.threads and len(store.threads) == 1
+    for job in jobs:
+        assert [state for job_id, state in store.states if job_id == job.id] == [
+            "added", JOB_STATE_RUNNING, JOB_STATE_DONE
+        ]
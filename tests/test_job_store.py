@@ -0,0 +1,72 @@
+from job_queue import Job, JOB_KIND_GENERATE, JOB_KIND_FIX, JOB_STATE_DONE, JOB_STATE_FAILED
+from job_store import JobStore
+
+
+def test_unfinished_jobs_are_resumed_with_saved_fields(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    store = JobStore(path, max_attempts=3)
+
+    queued = Job(JOB_KIND_GENERATE, 1, "file-a", user_text="текст", file_unique_id="uniq",
+                 fallback_file_ids=["file-a-large"])
+    running = Job(JOB_KIND_FIX, 2, "file-b")
+    done = Job(JOB_KIND_GENERATE, 3, "file-c")
+    for job in (queued, running, done):
+        store.add(job)
+
+    queued.status_message_id = 42
+    store.set_status_message(queued)
+    store.mark_running(running)
+    running.response_text = "ответ Claude"
+    store.save_response(running)
+    store.mark_running(done)
+    store.mark_finished(done, JOB_STATE_DONE)
+    store.close()
+
+    reopened = JobStore(path, max_attempts=3)
+    resumed, exhausted = reopened.load_unfinished()
+    reopened.close()
+
+    assert exhausted == []
+    by_id = {job.id: job for job in resumed}
+    assert set(by_id) == {queued.id, running.id}
+
+    restored = by_id[queued.id]
+    assert restored.user_text == "текст"
+    assert restored.file_unique_id == "uniq"
+    assert restored.fallback_file_ids == ["file-a-large"]
+    assert restored.status_message_id == 42
+    assert restored.attempts == 0
+
+    restored = by_id[running.id]
+    assert restored.kind == JOB_KIND_FIX
+    assert restored.attempts == 1
+    assert restored.response_text == "ответ Claude"
+
+
+def test_jobs_out_of_attempts_are_marked_failed(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    store = JobStore(path, max_attempts=2)
+    job = Job(JOB_KIND_GENERATE, 1, "file")
+    store.add(job)
+    store.mark_running(job)
+    store.mark_running(job)
+
+    resumed, exhausted = store.load_unfinished()
+    assert resumed == []
+    assert [item.id for item in exhausted] == [job.id]
+
+    state = store._conn.execute("SELECT state FROM jobs WHERE id = ?", (job.id,)).fetchone()[0]
+    assert state == JOB_STATE_FAILED
+    # Неудавшаяся задача больше не загружается
+    assert store.load_unfinished() == ([], [])
+    store.close()
+
+
+def test_add_ignores_repeated_job_id(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job = Job(JOB_KIND_GENERATE, 1, "file")
+    store.add(job)
+    store.add(job)
+    resumed, _ = store.load_unfinished()
+    store.close()
+    assert [item.id for item in resumed] == [job.id]
@@ -0,0 +1,62 @@
+from llm_cache import LLMResponseCache, normalize_messages
+from result_cache import TieredCache
+
+SYSTEM = [{"type": "text", "text": "Ты - эксперт по оптимизации Windows", "cache_control": {"type": "ephemeral"}}]
+
+
+def make_messages(text, image="aW1hZ2U="):
+    return [{
+        "role": "user",
+        "content": [
+            {"type": "text", "text": text},
+            {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": image}}
+        ]
+    }]
+
+
+def make_key(model="claude-3-7-sonnet", max_tokens=4096, prompt_version=1, text="Создай скрипт",
+             system=SYSTEM, image="aW1hZ2U="):
+    return LLMResponseCache.make_key(model, max_tokens, prompt_version, make_messages(text, image), system)
+
+
+def test_key_changes_with_request_parameters():
+    base = make_key()
+    assert make_key(model="claude-3-5-haiku") != base
+    assert make_key(max_tokens=2048) != base
+    assert make_key(prompt_version=2) != base
+    assert make_key(system=[{"type": "text", "text": "Другой промпт"}]) != base
+    assert make_key(system=None) != base
+    assert make_key(image="b3RoZXI=") != base
+    assert make_key(text="Создай другой скрипт") != base
+
+
+def test_whitespace_differences_give_same_key():
+    base = make_key(text="Создай скрипт оптимизации")
+    assert make_key(text="  Создай   скрипт\nоптимизации \n") == base
+    spaced_system = [{"type": "text", "text": "Ты -  эксперт\nпо оптимизации Windows "}]
+    assert make_key(text="Создай скрипт оптимизации", system=spaced_system) == base
+
+
+def test_images_are_replaced_by_hash():
+    [message] = normalize_messages(make_messages("текст"))
+    image_block = message["content"][1]
+    assert "data" not in image_block
+    assert len(image_block["sha256"]) == 64
+    assert normalize_messages([{"role": "user", "content": "a  b"}]) == [
+        {"role": "user", "content": [{"type": "text", "text": "a b"}]}
+    ]
+
+
+def test_get_put_round_trip(tmp_path):
+    path = str(tmp_path / "llm_cache.db")
+    cache = LLMResponseCache(TieredCache("llm", path=path))
+    key = make_key()
+    assert cache.get(key) is None
+    cache.put(key, "```powershell\nWrite-Host 1\n```")
+    assert cache.get(key) == "```powershell\nWrite-Host 1\n```"
+    cache.cache.close()
+
+    reopened = LLMResponseCache(TieredCache("llm", path=path))
+    assert reopened.get(key) == "```powershell\nWrite-Host 1\n```"
+    stats = reopened.get_stats()
+    assert (stats["hits_disk"], stats["misses"]) == (1, 0)
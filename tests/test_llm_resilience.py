@@ -0,0 +1,138 @@
+import asyncio
+
+from llm_resilience import (
+    CircuitBreaker, RetryPolicy, ResilientCaller, classify_error,
+    LLMOverloadedError, LLMRateLimitError, LLMCreditBalanceError, LLMCircuitOpenError, LLMTimeoutError,
+    CIRCUIT_CLOSED, CIRCUIT_OPEN, CIRCUIT_HALF_OPEN
+)
+
+
+class StatusError(Exception):
+    """Ошибка API с кодом ответа и заголовками"""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": headers or {}})()
+
+
+def test_classify_error():
+    assert isinstance(classify_error(StatusError(529)), LLMOverloadedError)
+    rate_limit = classify_error(StatusError(429, {"retry-after": "3"}))
+    assert isinstance(rate_limit, LLMRateLimitError) and rate_limit.retry_after == 3.0
+    assert classify_error(StatusError(429, {"retry-after-ms": "250"})).retry_after == 0.25
+    assert isinstance(classify_error(Exception("Your credit balance is too low")), LLMCreditBalanceError)
+    assert isinstance(classify_error(asyncio.TimeoutError()), LLMTimeoutError)
+    assert classify_error(StatusError(400)) is None
+
+
+def test_retry_policy_delay_bounds():
+    policy = RetryPolicy(max_attempts=5, base_delay=1, max_delay=4)
+    for attempt in range(6):
+        delay = policy.delay(attempt)
+        assert 0 <= delay <= min(4, 2 ** attempt)
+    assert policy.delay(0, retry_after=10) == 10
+
+
+def test_breaker_opens_after_threshold_and_probes_after_timeout(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("llm_resilience.time.monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow()
+
+    clock[0] += 30
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert breaker.allow()
+    # Одновременно пропускается только один пробный запрос
+    assert not breaker.allow()
+
+    # Неудачная проба снова размыкает предохранитель
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CIRCUIT_CLOSED
+    assert breaker.get_stats()["opened_count"] == 2
+    assert breaker.get_stats()["rejected"] == 2
+
+
+def test_caller_retries_transient_errors_then_succeeds():
+    attempts = []
+
+    async def attempt():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise StatusError(529)
+        return "ok"
+
+    caller = ResilientCaller(RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.001),
+                             CircuitBreaker(failure_threshold=5, reset_timeout=60))
+    assert asyncio.run(caller.call(attempt)) == "ok"
+    stats = caller.get_stats()
+    assert stats["retries"] == 2
+    assert stats["errors_by_type"] == {"LLMOverloadedError": 2}
+    assert stats["consecutive_failures"] == 0
+
+
+def test_caller_does_not_retry_permanent_errors_and_rejects_when_open():
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        raise Exception("credit balance is too low")
+
+    caller = ResilientCaller(RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.001),
+                             CircuitBreaker(failure_threshold=1, reset_timeout=60))
+    try:
+        asyncio.run(caller.call(attempt))
+    except LLMCreditBalanceError:
+        pass
+    else:
+        raise AssertionError("ожидалась LLMCreditBalanceError")
+    assert len(calls) == 1
+
+    try:
+        asyncio.run(caller.call(attempt))
+    except LLMCircuitOpenError:
+        pass
+    else:
+        raise AssertionError("ожидалась LLMCircuitOpenError")
+    assert len(calls) == 1
+
+
+def test_caller_gives_up_when_retry_does_not_fit_in_time_left():
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        raise StatusError(429, {"retry-after": "10"})
+
+    caller = ResilientCaller(RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.001),
+                             CircuitBreaker(failure_threshold=5, reset_timeout=60))
+    try:
+        asyncio.run(caller.call(attempt, time_left=lambda: 5))
+    except LLMRateLimitError:
+        pass
+    else:
+        raise AssertionError("ожидалась LLMRateLimitError")
+    assert len(calls) == 1
+
+
+def test_cancelled_probe_releases_breaker():
+    async def attempt():
+        raise asyncio.CancelledError()
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    caller = ResilientCaller(RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.001), breaker)
+    try:
+        asyncio.run(caller.call(attempt))
+    except asyncio.CancelledError:
+        pass
+    assert breaker.consecutive_failures == 0
+    assert breaker.state == CIRCUIT_CLOSED
@@ -0,0 +1,227 @@
+import types
+import asyncio
+
+import optimization_bot
+from llm_cache import LLMResponseCache
+from llm_resilience import ResilientCaller, RetryPolicy, CircuitBreaker
+from result_cache import TieredCache, ScreenshotResultCache, ImageFingerprint
+from deadline import Deadline
+from progress_reporter import ProgressReporter
+
+
+class OverloadedError(Exception):
+    """Ответ API 529"""
+    status_code = 529
+
+
+class FakeStream:
+    """Потоковый ответ Claude из заранее заданных фрагментов"""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    @property
+    async def text_stream(self):
+        for chunk in self.chunks:
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+    async def get_final_message(self):
+        usage = types.SimpleNamespace(input_tokens=10, output_tokens=20)
+        return types.SimpleNamespace(usage=usage, content=[types.SimpleNamespace(text="".join(self.chunks))])
+
+
+class FakeMessages:
+    """messages.stream, возвращающий ответы попыток по очереди"""
+
+    def __init__(self, *attempts):
+        self.attempts = list(attempts)
+        self.calls = []
+
+    def stream(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.attempts.pop(0)
+
+
+class NullMetrics:
+    def record_prompt_cache_usage(self, *args):
+        pass
+
+    def record_script_generation(self, data):
+        pass
+
+
+def make_pipeline(*attempts):
+    from script_validator import ScriptValidator
+
+    pipeline = optimization_bot.OptimizationBot.__new__(optimization_bot.OptimizationBot)
+    pipeline.client = types.SimpleNamespace(messages=FakeMessages(*attempts))
+    pipeline.validator = ScriptValidator()
+    pipeline.metrics = NullMetrics()
+    pipeline.prompts = {"version": 1}
+    pipeline.llm_cache = LLMResponseCache(TieredCache("llm"))
+    pipeline.resilience = ResilientCaller(RetryPolicy(max_attempts=2, base_delay=0.001, max_delay=0.001),
+                                          CircuitBreaker(failure_threshold=5, reset_timeout=60))
+    return pipeline
+
+
+def test_stream_passes_block_closed_at_end_of_response_to_handler():
+    pipeline = make_pipeline(FakeStream(["```markdown\n# Инстру", "кция\n```"]))
+    blocks = []
+
+    message = asyncio.run(pipeline._stream_message([], on_block=lambda language, content: blocks.append((language, content))))
+    assert message.content[0].text == "```markdown\n# Инструкция\n```"
+    assert blocks == [("markdown", "# Инструкция\n")]
+
+
+def test_retried_stream_discards_blocks_of_failed_attempt(monkeypatch):
+    # Поддельный клиент не использует тайм-аут
+    monkeypatch.setattr("llm_client.request_timeout", lambda total: total)
+    pipeline = make_pipeline(
+        FakeStream(["```batch\n@echo first\n```\n"], error=OverloadedError("overloaded")),
+        FakeStream(["```batch\n@echo second\n```\n"])
+    )
+    prevalidated = {}
+    progress = ProgressReporter(None, 1, None)
+
+    async def scenario():
+        text = await pipeline._request_claude([{"role": "user", "content": "текст"}], Deadline(total=30),
+                                              progress=progress, prevalidated=prevalidated)
+        content, task = prevalidated["Start-Optimizer.bat"]
+        result = await task
+        return text, content, result
+
+    text, content, (fixed, _, _) = asyncio.run(scenario())
+    assert text == "```batch\n@echo second\n```\n"
+    assert "@echo second" in content and "@echo first" not in content
+    assert "@echo second" in fixed["Start-Optimizer.bat"]
+    assert len(pipeline.client.messages.calls) == 2
+    # Счетчик токенов учитывает только ответ последней попытки
+    assert progress.output_chars == len(text)
+
+
+def test_cancel_prevalidation_cancels_pending_checks():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_check():
+            await release.wait()
+
+        pending = asyncio.ensure_future(slow_check())
+        finished = asyncio.ensure_future(asyncio.sleep(0))
+        await finished
+        prevalidated = {"WindowsOptimizer.ps1": ("a", pending), "README.md": ("b", finished)}
+        optimization_bot.OptimizationBot._cancel_prevalidation(prevalidated)
+        await asyncio.gather(pending, return_exceptions=True)
+        return prevalidated, pending
+
+    prevalidated, pending = asyncio.run(scenario())
+    assert prevalidated == {}
+    assert pending.cancelled()
+
+
+def test_stream_without_timeout_keeps_client_default():
+    from anthropic import NOT_GIVEN
+
+    pipeline = make_pipeline(FakeStream(["ответ"]))
+    asyncio.run(pipeline._stream_message([]))
+    assert pipeline.client.messages.calls[0]["timeout"] is NOT_GIVEN
+
+
+def test_stream_with_spent_budget_is_not_sent():
+    from deadline import DeadlineExceeded
+
+    pipeline = make_pipeline(FakeStream(["ответ"]))
+    for timeout in (0.0, -1.0):
+        try:
+            asyncio.run(pipeline._stream_message([], timeout=timeout))
+        except DeadlineExceeded as e:
+            assert e.budget == 0
+        else:
+            raise AssertionError("ожидалась DeadlineExceeded")
+    assert pipeline.client.messages.calls == []
+
+
+def photo_size(file_id, width, height):
+    return types.SimpleNamespace(file_id=file_id, width=width, height=height)
+
+
+def test_select_photo_sizes_picks_smallest_readable_size():
+    sizes = [photo_size("large", 1280, 720), photo_size("thumb", 320, 180),
+             photo_size("full", 2560, 1440), photo_size("medium", 800, 450)]
+
+    selected = optimization_bot.select_photo_sizes(sizes, min_width=800, min_height=450)
+    # Выбранный размер первый, за ним большие размеры для повтора - от меньшего к большему
+    assert [size.file_id for size in selected] == ["medium", "large", "full"]
+
+
+def test_select_photo_sizes_checks_both_sides_for_portrait_photos():
+    sizes = [photo_size("narrow", 400, 1000), photo_size("tall", 720, 1280)]
+
+    selected = optimization_bot.select_photo_sizes(sizes, min_width=800, min_height=450)
+    assert [size.file_id for size in selected] == ["tall"]
+
+
+def test_select_photo_sizes_falls_back_to_largest_below_minimum():
+    sizes = [photo_size("medium", 640, 360), photo_size("thumb", 320, 180)]
+
+    selected = optimization_bot.select_photo_sizes(sizes, min_width=800, min_height=450)
+    assert [size.file_id for size in selected] == ["medium"]
+
+
+RESPONSE = (
+    "```powershell\nWrite-Host \"Оптимизация\"\n```\n"
+    "```batch\n@echo off\npowershell -File WindowsOptimizer.ps1\n```\n"
+    "```markdown\n# Инструкция\n```\n"
+)
+
+
+def make_generation_pipeline(monkeypatch, responses):
+    pipeline = make_pipeline()
+    pipeline.result_cache = ScreenshotResultCache(TieredCache("results"))
+    downloaded, prompts = [], []
+
+    async def download_image(file_id, deadline):
+        downloaded.append(file_id)
+        return "aW1n", "image/jpeg", ImageFingerprint(file_id.ljust(64, "0"))
+
+    async def request_claude(messages, deadline, *args, **kwargs):
+        prompts.append(messages[0]["content"][0]["text"])
+        return responses.pop(0)
+
+    monkeypatch.setattr(pipeline, "_download_image", download_image)
+    monkeypatch.setattr(pipeline, "_request_claude", request_claude)
+    return pipeline, downloaded, prompts
+
+
+def test_unreadable_screenshot_is_retried_with_next_size(monkeypatch):
+    pipeline, downloaded, prompts = make_generation_pipeline(
+        monkeypatch, [optimization_bot.UNREADABLE_IMAGE_MARKER, optimization_bot.UNREADABLE_IMAGE_MARKER, RESPONSE]
+    )
+    answers = []
+
+    files = asyncio.run(pipeline.generate_new_script(
+        1, "medium", on_response=answers.append, fallback_file_ids=["large", "full"]
+    ))
+    assert isinstance(files, dict) and "WindowsOptimizer.ps1" in files
+    assert downloaded == ["medium", "large", "full"]
+    # Подсказка про IMAGE_UNREADABLE есть, только пока остаются большие размеры
+    assert [optimization_bot.UNREADABLE_IMAGE_HINT in prompt for prompt in prompts] == [True, True, False]
+    # Сохраняется только ответ, по которому собраны скрипты
+    assert answers == [RESPONSE]
+
+
+def test_readable_screenshot_does_not_download_larger_sizes(monkeypatch):
+    pipeline, downloaded, prompts = make_generation_pipeline(monkeypatch, [RESPONSE])
+
+    files = asyncio.run(pipeline.generate_new_script(1, "medium", fallback_file_ids=["large"]))
+    assert isinstance(files, dict)
+    assert downloaded == ["medium"]
@@ -0,0 +1,101 @@
+import asyncio
+
+from progress_reporter import ProgressReporter, STAGE_DOWNLOADING, STAGE_GENERATING, STAGE_VALIDATING
+
+
+class RecordingEdit:
+    """edit(text, chat_id, message_id), запоминающий правки"""
+
+    def __init__(self):
+        self.texts = []
+
+    async def __call__(self, text, chat_id, message_id):
+        self.texts.append(text)
+
+
+def test_edits_are_throttled_and_flushed_by_ticker():
+    async def scenario():
+        edit = RecordingEdit()
+        progress = ProgressReporter(edit, 1, 10, header="Заголовок", min_interval=0.2)
+
+        await progress.set_stage(STAGE_DOWNLOADING)
+        await progress.set_stage(STAGE_GENERATING)
+        progress.add_output("x" * 400)
+        # Вторая правка в пределах интервала отложена
+        edits_before_tick = list(edit.texts)
+
+        await asyncio.sleep(0.3)
+        edits_after_tick = list(edit.texts)
+        await asyncio.sleep(0.25)
+        await progress.finish()
+        return edits_before_tick, edits_after_tick, edit.texts
+
+    before, after, final = asyncio.run(scenario())
+    assert before == ["Заголовок\n\n📥 Загружаю скриншот..."]
+    assert after == before + ["Заголовок\n\n🧠 Claude пишет скрипты: ~100 токенов"]
+    # Неизменившийся текст повторно не отправляется
+    assert final == after
+
+
+def test_finish_writes_final_state_once_and_stops_updates():
+    async def scenario():
+        edit = RecordingEdit()
+        progress = ProgressReporter(edit, 1, 10, min_interval=0.05)
+        await progress.set_stage(STAGE_VALIDATING)
+        await progress.finish("✅ Готово")
+        await progress.finish("✅ Еще раз")
+        await progress.set_stage(STAGE_GENERATING)
+        await asyncio.sleep(0.1)
+        return progress, edit.texts
+
+    progress, texts = asyncio.run(scenario())
+    assert texts == ["🔍 Проверяю и исправляю скрипты...", "✅ Готово"]
+    assert progress._ticker is None
+
+
+def test_edits_wait_for_message_id():
+    async def scenario():
+        edit = RecordingEdit()
+        progress = ProgressReporter(edit, 1, None, min_interval=0.05)
+        await progress.set_stage(STAGE_DOWNLOADING)
+        await asyncio.sleep(0.08)
+        deferred = list(edit.texts)
+
+        progress.message_id = 10
+        await asyncio.sleep(0.08)
+        await progress.finish()
+        return deferred, edit.texts
+
+    deferred, texts = asyncio.run(scenario())
+    assert deferred == []
+    assert texts == ["📥 Загружаю скриншот..."]
+
+
+def test_edit_errors_do_not_stop_reporting():
+    calls = []
+
+    async def failing_edit(text, chat_id, message_id):
+        calls.append(text)
+        raise RuntimeError("message is not modified")
+
+    async def scenario():
+        progress = ProgressReporter(failing_edit, 1, 10, min_interval=0.01)
+        await progress.set_stage(STAGE_DOWNLOADING)
+        await asyncio.sleep(0.02)
+        await progress.set_stage(STAGE_VALIDATING)
+        await progress.finish("готово")
+
+    asyncio.run(scenario())
+    assert calls[0] == "📥 Загружаю скриншот..."
+    assert calls[-1] == "готово"
+
+
+def test_token_estimate_and_reset():
+    progress = ProgressReporter(None, 1, 10)
+    progress.stage = STAGE_GENERATING
+    progress.add_output("a" * 10)
+    assert progress.tokens == 2
+    assert progress.render() == "🧠 Claude пишет скрипты: ~2 токенов"
+    progress.reset_output()
+    assert progress.tokens == 0
+    assert progress.render() == "🧠 Claude пишет скрипты..."
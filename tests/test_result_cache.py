@@ -0,0 +1,177 @@
+import asyncio
+
+import optimization_bot
+from llm_resilience import LLMOverloadedError
+from deadline import DeadlineExceeded, BUDGET_LLM
+from result_cache import TieredCache, ScreenshotResultCache, ImageFingerprint, normalize_user_text
+
+
+class Clock:
+    """Управляемое время для проверки срока жизни записей"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(tmp_path, monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr("result_cache.time.time", clock)
+    cache = TieredCache("test", path=str(tmp_path / "cache.db"), **kwargs)
+    return cache, clock
+
+
+def test_entries_expire_in_memory_and_on_disk(tmp_path, monkeypatch):
+    cache, clock = make_cache(tmp_path, monkeypatch, ttl=60)
+    cache.put("key", {"a": 1})
+    clock.now += 59
+    assert cache.get("key") == {"a": 1}
+
+    clock.now += 2
+    assert cache.get("key") is None
+    # Запись не поднимается с диска после истечения срока
+    cache._memory.clear()
+    assert cache.get("key") is None
+    stats = cache.get_stats()
+    assert (stats["hits_memory"], stats["hits_disk"], stats["misses"]) == (1, 0, 2)
+    cache.close()
+
+
+def test_memory_tier_evicts_least_recently_used(tmp_path, monkeypatch):
+    cache, _ = make_cache(tmp_path, monkeypatch, max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert list(cache._memory) == ["a", "c"]
+    assert cache.evictions == 1
+    # Вытесненная из памяти запись остается на диске
+    assert cache.get("b") == 2
+    assert cache.get_stats()["hits_disk"] == 1
+    cache.close()
+
+
+def test_disk_hit_is_promoted_to_memory(tmp_path, monkeypatch):
+    cache, _ = make_cache(tmp_path, monkeypatch)
+    cache.put("key", ["файл"])
+    cache.close()
+
+    reopened = TieredCache("test", path=str(tmp_path / "cache.db"))
+    assert reopened.get("key") == ["файл"]
+    assert "key" in reopened._memory
+    assert reopened.get("key") == ["файл"]
+    stats = reopened.get_stats()
+    assert (stats["hits_disk"], stats["hits_memory"]) == (1, 1)
+    assert stats["hit_rate"] == 1.0
+    reopened.close()
+
+
+def test_disk_tier_is_trimmed_to_size_and_ttl(tmp_path, monkeypatch):
+    cache, clock = make_cache(tmp_path, monkeypatch, max_disk_entries=3, ttl=100, cleanup_interval=5)
+    cache.put("stale", 0)
+    clock.now += 101
+    for index in range(4):
+        clock.now += 1
+        cache.put(f"key{index}", index)
+
+    # Пятая запись запускает очистку: устаревшая и самая старая сверх лимита удаляются
+    assert len(cache) == 3
+    keys = {row[0] for row in cache._conn.execute("SELECT key FROM entries")}
+    assert keys == {"key1", "key2", "key3"}
+    cache.close()
+
+
+def test_memory_only_cache_without_path():
+    cache = TieredCache("memory", max_entries=1)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") is None and cache.get("b") == 2
+    assert len(cache) == 1
+
+
+def test_result_key_depends_on_image_prompt_version_and_normalized_text():
+    results = ScreenshotResultCache(TieredCache("results"), use_perceptual=False)
+    fingerprint = ImageFingerprint("a" * 64, perceptual="ff00")
+    files = {"WindowsOptimizer.ps1": "Write-Host 1"}
+    results.put(fingerprint, 1, "Создай скрипт  оптимизации!", files)
+
+    assert results.get(fingerprint, 1, "  создай скрипт оптимизации ") == files
+    assert results.get(ImageFingerprint("b" * 64, perceptual="ff00"), 1, "создай скрипт оптимизации") is None
+    assert results.get(fingerprint, 2, "создай скрипт оптимизации") is None
+    assert results.get(fingerprint, 1, "другой запрос") is None
+    assert normalize_user_text("  Ускорь   ИГРЫ?! ") == "ускорь игры"
+
+    stats = results.get_stats()
+    assert (stats["hits_exact"], stats["misses"]) == (1, 3)
+
+
+def test_perceptual_lookup_only_when_enabled():
+    files = {"README.md": "# readme"}
+    original = ImageFingerprint("a" * 64, perceptual="ff00")
+    recompressed = ImageFingerprint("c" * 64, perceptual="ff00")
+
+    strict = ScreenshotResultCache(TieredCache("strict"), use_perceptual=False)
+    strict.put(original, 1, None, files)
+    assert strict.get(recompressed, 1, None) is None
+
+    fuzzy = ScreenshotResultCache(TieredCache("fuzzy"), use_perceptual=True)
+    fuzzy.put(original, 1, None, files)
+    assert fuzzy.get(recompressed, 1, None) == files
+    assert fuzzy.get_stats()["hits_perceptual"] == 1
+
+
+class NullMetrics:
+    def record_script_generation(self, data):
+        pass
+
+
+RESPONSE = (
+    "```powershell\nWrite-Host \"Оптимизация\"\n```\n"
+    "```batch\n@echo off\npowershell -File WindowsOptimizer.ps1\n```\n"
+    "```markdown\n# Инструкция\n```\n"
+)
+
+
+def make_pipeline(monkeypatch, request_claude):
+    from script_validator import ScriptValidator
+
+    pipeline = optimization_bot.OptimizationBot.__new__(optimization_bot.OptimizationBot)
+    pipeline.validator = ScriptValidator()
+    pipeline.metrics = NullMetrics()
+    pipeline.result_cache = ScreenshotResultCache(TieredCache("results"))
+    pipeline.prompts = {"version": 1}
+
+    async def download_image(file_id, deadline):
+        return "aW1n", "image/png", ImageFingerprint("d" * 64)
+
+    async def send_message(chat_id, text, **kwargs):
+        return None
+
+    monkeypatch.setattr(pipeline, "_download_image", download_image)
+    monkeypatch.setattr(pipeline, "_request_claude", request_claude)
+    monkeypatch.setattr(optimization_bot.outbound, "send_message", send_message)
+    return pipeline
+
+
+def test_template_fallbacks_are_never_cached(monkeypatch):
+    for error in (LLMOverloadedError("overloaded"), DeadlineExceeded(BUDGET_LLM, 1)):
+        async def request_claude(*args, error=error, **kwargs):
+            raise error
+
+        pipeline = make_pipeline(monkeypatch, request_claude)
+        files = asyncio.run(pipeline.generate_new_script(1, "file"))
+        assert isinstance(files, dict) and files
+        assert len(pipeline.result_cache.cache) == 0
+
+
+def test_validated_claude_bundle_is_cached(monkeypatch):
+    async def request_claude(*args, **kwargs):
+        return RESPONSE
+
+    pipeline = make_pipeline(monkeypatch, request_claude)
+    files = asyncio.run(pipeline.generate_new_script(1, "file"))
+    assert isinstance(files, dict)
+    assert pipeline.result_cache.get(ImageFingerprint("d" * 64), 1, "Создай скрипт оптимизации Windows") == files
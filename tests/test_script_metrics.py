@@ -0,0 +1,67 @@
+import json
+
+from script_metrics import ScriptMetrics
+
+
+def test_prompt_cache_usage_is_aggregated_per_template_and_version(tmp_path):
+    metrics = ScriptMetrics(str(tmp_path / "metrics.json"))
+    metrics.record_prompt_cache_usage("OPTIMIZATION_PROMPT_TEMPLATE", 2, {
+        "input_tokens": 100, "output_tokens": 900,
+        "cache_creation_input_tokens": 3000, "cache_read_input_tokens": 0
+    }, duration=12.0)
+    metrics.record_prompt_cache_usage("OPTIMIZATION_PROMPT_TEMPLATE", 2, {
+        "input_tokens": 120, "output_tokens": 800,
+        "cache_creation_input_tokens": 0, "cache_read_input_tokens": 3000
+    }, duration=6.0)
+    metrics.record_prompt_cache_usage("OPTIMIZATION_PROMPT_TEMPLATE", 2, {
+        "input_tokens": 80, "output_tokens": 700,
+        "cache_creation_input_tokens": None, "cache_read_input_tokens": 3000
+    })
+    metrics.record_prompt_cache_usage("ERROR_FIX_PROMPT_TEMPLATE", 2, {"input_tokens": 50, "output_tokens": 60})
+
+    stats = metrics.get_prompt_cache_stats()
+    assert set(stats) == {"OPTIMIZATION_PROMPT_TEMPLATE:v2", "ERROR_FIX_PROMPT_TEMPLATE:v2"}
+
+    optimization = stats["OPTIMIZATION_PROMPT_TEMPLATE:v2"]
+    assert optimization["requests"] == 3
+    assert optimization["cache_hits"] == 2
+    assert optimization["cache_creation_input_tokens"] == 3000
+    assert optimization["cache_read_input_tokens"] == 6000
+    assert (optimization["input_tokens"], optimization["output_tokens"]) == (300, 2400)
+    assert optimization["hit_rate"] == 2 / 3
+    assert optimization["average_duration"] == 6.0
+
+    error_fix = stats["ERROR_FIX_PROMPT_TEMPLATE:v2"]
+    assert (error_fix["cache_hits"], error_fix["hit_rate"]) == (0, 0.0)
+    assert error_fix["cache_read_input_tokens"] == error_fix["cache_creation_input_tokens"] == 0
+
+
+def test_new_prompt_version_gets_separate_stats(tmp_path):
+    metrics = ScriptMetrics(str(tmp_path / "metrics.json"))
+    metrics.record_prompt_cache_usage("OPTIMIZATION_PROMPT_TEMPLATE", 1, {"cache_read_input_tokens": 3000})
+    metrics.record_prompt_cache_usage("OPTIMIZATION_PROMPT_TEMPLATE", 2, {"cache_creation_input_tokens": 3100})
+
+    stats = metrics.get_prompt_cache_stats()
+    assert stats["OPTIMIZATION_PROMPT_TEMPLATE:v1"]["hit_rate"] == 1.0
+    assert stats["OPTIMIZATION_PROMPT_TEMPLATE:v2"]["hit_rate"] == 0.0
+
+
+def test_prompt_cache_stats_survive_restart(tmp_path):
+    path = str(tmp_path / "metrics.json")
+    ScriptMetrics(path).record_prompt_cache_usage("OPTIMIZATION_PROMPT_TEMPLATE", 1, {"cache_read_input_tokens": 10})
+
+    stats = ScriptMetrics(path).get_prompt_cache_stats()
+    assert stats["OPTIMIZATION_PROMPT_TEMPLATE:v1"]["cache_read_input_tokens"] == 10
+    # Расчетные поля не сохраняются в файл
+    with open(path, encoding="utf-8") as f:
+        assert "hit_rate" not in json.load(f)["prompt_cache"]["OPTIMIZATION_PROMPT_TEMPLATE:v1"]
+
+
+def test_metrics_file_without_prompt_cache_section(tmp_path):
+    path = tmp_path / "metrics.json"
+    path.write_text(json.dumps({"total_scripts_generated": 5}), encoding="utf-8")
+
+    metrics = ScriptMetrics(str(path))
+    assert metrics.get_prompt_cache_stats() == {}
+    metrics.record_prompt_cache_usage("OPTIMIZATION_PROMPT_TEMPLATE", 1, {"cache_read_input_tokens": 10})
+    assert metrics.get_prompt_cache_stats()["OPTIMIZATION_PROMPT_TEMPLATE:v1"]["requests"] == 1
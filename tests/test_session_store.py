@@ -0,0 +1,107 @@
+import time
+import sqlite3
+
+from session_store import SessionStore, MemorySessionStore, SqliteSessionStore
+
+# 20 байт в мегабайтах
+TWENTY_BYTES_MB = 20 / (1024 * 1024)
+
+
+def test_base_class_is_abstract():
+    try:
+        SessionStore()
+    except TypeError:
+        return
+    raise AssertionError("ожидалась TypeError")
+
+
+def test_lru_eviction_at_session_cap():
+    store = MemorySessionStore(max_sessions=2, idle_ttl=60, max_memory_mb=1)
+    store.update(1, state="a")
+    store.update(2, state="b")
+    # Чтение делает сессию 1 недавно использованной
+    assert store.get(1).state == "a"
+    store.update(3, state="c")
+
+    assert store.get(2) is None
+    assert store.get(1).state == "a" and store.get(3).state == "c"
+    assert len(store) == 2
+    assert store.get_stats()["evicted_lru"] == 1
+
+
+def test_idle_sessions_expire():
+    store = MemorySessionStore(max_sessions=10, idle_ttl=10, max_memory_mb=1)
+    store.update(1, state="a")
+    store.update(2, state="b")
+    store.get(1).updated_at -= 11
+
+    assert store.get(1) is None
+    assert store.get(2).state == "b"
+    assert store.get_stats()["evicted_ttl"] == 1
+
+    # Устаревшие сессии вытесняются и при записи других чатов
+    store.get(2).updated_at -= 11
+    store.update(3, state="c")
+    assert len(store) == 1
+    assert store.get_stats()["evicted_ttl"] == 2
+
+
+def test_eviction_at_text_size_cap_counts_utf8_bytes():
+    store = MemorySessionStore(max_sessions=10, idle_ttl=60, max_memory_mb=TWENTY_BYTES_MB)
+    store.update(1, message="а" * 5)   # 10 байт в UTF-8
+    store.update(2, message="b" * 8)
+    assert store.get_stats()["memory_bytes"] == 18
+
+    store.update(3, message="c" * 5)
+    assert store.get(1) is None
+    assert store.get(2) is not None and store.get(3) is not None
+    stats = store.get_stats()
+    assert stats["memory_bytes"] == 13
+    assert (stats["evicted_memory"], stats["evicted_lru"], stats["evicted_ttl"]) == (1, 0, 0)
+
+
+def test_field_views_behave_like_dicts():
+    store = MemorySessionStore(max_sessions=10, idle_ttl=60, max_memory_mb=1)
+    states = store.view("state")
+    states[1] = "waiting_for_screenshot"
+    assert 1 in states and states[1] == "waiting_for_screenshot"
+    assert states.pop(1) == "waiting_for_screenshot"
+    assert states.get(1, "none") == "none"
+
+
+def test_sqlite_store_reloads_sessions_after_restart(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SqliteSessionStore(path, max_sessions=10, idle_ttl=60, max_memory_mb=1)
+    store.update(1, state="waiting_for_screenshot", message="текст")
+    store.update(2, state="waiting_for_error_screenshot")
+    store.delete(2)
+    store.close()
+
+    reopened = SqliteSessionStore(path, max_sessions=10, idle_ttl=60, max_memory_mb=1)
+    session = reopened.get(1)
+    assert (session.state, session.message) == ("waiting_for_screenshot", "текст")
+    assert reopened.get(2) is None
+    assert len(reopened) == 1
+    reopened.close()
+
+
+def test_sqlite_store_prunes_stale_rows_periodically(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE sessions (chat_id INTEGER PRIMARY KEY, state TEXT, message TEXT, updated_at REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO sessions VALUES (100, 'old', NULL, ?)", (time.time() - 3600,))
+    conn.commit()
+    conn.close()
+
+    store = SqliteSessionStore(path, max_sessions=10, idle_ttl=60, max_memory_mb=1, cleanup_interval=2)
+    assert store.get(100) is None
+    store.update(1, state="a")
+    store.update(2, state="b")
+    store.close()
+
+    conn = sqlite3.connect(path)
+    chat_ids = sorted(row[0] for row in conn.execute("SELECT chat_id FROM sessions"))
+    conn.close()
+    assert chat_ids == [1, 2]
@@ -0,0 +1,83 @@
+import time
+from collections import Counter
+
+from shard_coordinator import HashRing, ShardCoordinator, extract_chat_id
+
+
+def test_same_key_maps_to_same_node_across_instances():
+    first = HashRing(range(4))
+    second = HashRing(range(4))
+    keys = list(range(-500, 500)) + ["update-1", "update-2"]
+    assert [first.get_node(key) for key in keys] == [second.get_node(key) for key in keys]
+
+
+def test_keys_are_spread_over_all_nodes():
+    ring = HashRing(range(4))
+    counts = Counter(ring.get_node(chat_id) for chat_id in range(10000))
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > 1500
+
+
+def test_adding_node_moves_only_keys_taken_by_new_node():
+    ring = HashRing(range(3))
+    before = {chat_id: ring.get_node(chat_id) for chat_id in range(5000)}
+    ring.add_node(3)
+    after = {chat_id: ring.get_node(chat_id) for chat_id in range(5000)}
+
+    moved = [chat_id for chat_id in before if before[chat_id] != after[chat_id]]
+    assert all(after[chat_id] == 3 for chat_id in moved)
+    assert len(moved) < 5000 * 0.4
+
+
+def test_empty_ring_raises():
+    try:
+        HashRing([]).get_node(1)
+    except ValueError:
+        return
+    raise AssertionError("ожидалась ValueError")
+
+
+def test_extract_chat_id():
+    assert extract_chat_id({"update_id": 1, "message": {"chat": {"id": 10}}}) == 10
+    assert extract_chat_id({"update_id": 2, "edited_message": {"chat": {"id": -20}}}) == -20
+    callback = {"update_id": 3, "callback_query": {"from": {"id": 30}, "message": {"chat": {"id": 31}}}}
+    assert extract_chat_id(callback) == 31
+    assert extract_chat_id({"update_id": 4, "callback_query": {"from": {"id": 40}}}) == 40
+    assert extract_chat_id({"update_id": 5, "inline_query": {"from": {"id": 50}}}) == 50
+    assert extract_chat_id({"update_id": 6}) is None
+
+
+class StuckProcess:
+    """Процесс, который не завершается до terminate()"""
+
+    def __init__(self):
+        self.join_timeouts = []
+        self.terminated = False
+
+    def join(self, timeout=None):
+        self.join_timeouts.append(timeout)
+        if not self.terminated:
+            time.sleep(timeout)
+
+    def is_alive(self):
+        return not self.terminated
+
+    def terminate(self):
+        self.terminated = True
+
+
+def test_stop_shares_one_deadline_between_workers_and_closes_queues():
+    coordinator = ShardCoordinator(None, processes=3)
+    coordinator._workers = [StuckProcess(), None, StuckProcess()]
+
+    started = time.monotonic()
+    coordinator.stop(timeout=0.2)
+    elapsed = time.monotonic() - started
+
+    first, _, last = coordinator._workers
+    assert elapsed < 0.35
+    assert first.terminated and last.terminated
+    # Второй ждущий процесс получает только остаток общего времени
+    assert last.join_timeouts[0] < 0.05
+    for update_queue in coordinator._queues:
+        assert update_queue._closed
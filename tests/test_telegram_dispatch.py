@@ -0,0 +1,126 @@
+import time
+import asyncio
+
+from telebot.asyncio_helper import ApiTelegramException
+
+from telegram_dispatch import (
+    TokenBucket, OutboundDispatcher, _OutboundRequest, get_retry_after, PRIORITY_RESULT, PRIORITY_STATUS
+)
+
+
+def make_429(retry_after):
+    result_json = {
+        "ok": False,
+        "error_code": 429,
+        "description": f"Too Many Requests: retry after {retry_after}",
+        "parameters": {"retry_after": retry_after}
+    }
+    return ApiTelegramException("sendMessage", None, result_json)
+
+
+def test_token_bucket_allows_burst_then_waits_for_refill():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated_at
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.consume(now)
+
+    assert bucket.delay(now) == 0.5
+    assert bucket.delay(now + 0.5) == 0
+    assert not bucket.is_full(now + 0.5)
+    assert bucket.is_full(now + 10)
+    # Пополнение не превышает емкость
+    assert bucket.tokens == 3
+
+
+def test_get_retry_after_reads_parameters():
+    assert get_retry_after(make_429(7)) == 7.0
+    assert get_retry_after(ApiTelegramException("sendMessage", None, {"error_code": 429, "description": "Too Many Requests"})) == 1.0
+
+
+def test_group_chats_use_group_bucket():
+    dispatcher = OutboundDispatcher(None, global_rate=30, chat_rate=1, chat_burst=3,
+                                    group_rate_per_minute=20, group_burst=2)
+    group = dispatcher._chat_bucket(-100)
+    private = dispatcher._chat_bucket(100)
+    assert (group.rate, group.capacity) == (20 / 60, 2)
+    assert (private.rate, private.capacity) == (1, 3)
+
+
+def test_limit_global_share_splits_rate_between_processes():
+    dispatcher = OutboundDispatcher(None, global_rate=30)
+    dispatcher.limit_global_share(4)
+    assert dispatcher.global_rate == 7.5
+    assert dispatcher._global_bucket.capacity == 7.5
+
+
+class FlakyBot:
+    """Бот, отвечающий 429 на первые запросы в чат"""
+
+    def __init__(self, failures, retry_after):
+        self.failures = failures
+        self.retry_after = retry_after
+        self.calls = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append((asyncio.get_running_loop().time(), chat_id, text))
+        if self.failures:
+            self.failures -= 1
+            raise make_429(self.retry_after)
+        return text
+
+
+def test_dispatcher_retries_after_429_respecting_retry_after():
+    async def scenario():
+        bot = FlakyBot(failures=1, retry_after=0.2)
+        dispatcher = OutboundDispatcher(bot, global_rate=30, chat_rate=100, chat_burst=10)
+        await dispatcher.start()
+        result = await dispatcher.send_message(1, "привет", priority=PRIORITY_RESULT)
+        await dispatcher.stop()
+        return bot, result
+
+    bot, result = asyncio.run(scenario())
+    assert result == "привет"
+    assert len(bot.calls) == 2
+    assert bot.calls[1][0] - bot.calls[0][0] >= 0.2
+
+
+def test_dispatcher_gives_up_after_max_retries():
+    async def scenario():
+        bot = FlakyBot(failures=10, retry_after=0.01)
+        dispatcher = OutboundDispatcher(bot, global_rate=30, chat_rate=100, chat_burst=10, max_retries=2)
+        await dispatcher.start()
+        try:
+            await dispatcher.send_message(1, "привет")
+        except ApiTelegramException as e:
+            error = e
+        await dispatcher.stop()
+        return bot, error
+
+    bot, error = asyncio.run(scenario())
+    assert error.error_code == 429
+    assert len(bot.calls) == 3
+
+
+def test_results_are_sent_before_status_messages():
+    dispatcher = OutboundDispatcher(None, global_rate=30, chat_rate=1, chat_burst=3)
+    status = _OutboundRequest("send_message", 1, (1, "статус"), {}, PRIORITY_STATUS, None)
+    result = _OutboundRequest("send_document", 2, (2, "архив"), {}, PRIORITY_RESULT, None)
+    dispatcher._pending = [status, result]
+
+    request, delay = dispatcher._next_ready(time.monotonic())
+    assert request is result and delay == 0
+
+
+def test_chat_waiting_for_retry_after_does_not_block_other_chats():
+    dispatcher = OutboundDispatcher(None, global_rate=30, chat_rate=1, chat_burst=3)
+    blocked = _OutboundRequest("send_document", 1, (1, "архив"), {}, PRIORITY_RESULT, None)
+    other = _OutboundRequest("send_message", 2, (2, "статус"), {}, PRIORITY_STATUS, None)
+    dispatcher._pending = [blocked, other]
+    now = time.monotonic()
+    dispatcher._blocked_until[1] = now + 5
+
+    assert dispatcher._next_ready(now) == (other, 0)
+    dispatcher._pending = [blocked]
+    request, delay = dispatcher._next_ready(now)
+    assert request is None and 4.9 < delay <= 5
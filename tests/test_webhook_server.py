@@ -0,0 +1,103 @@
+import json
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+from telebot import types
+
+from webhook_server import create_webhook_app, make_fake_update, post_fake_update, SECRET_TOKEN_HEADER
+
+SECRET = "secret-token"
+
+
+class RecordingBot:
+    """Бот, запоминающий переданные ему обновления"""
+
+    def __init__(self):
+        self.updates = []
+        self.received = asyncio.Event()
+
+    async def process_new_updates(self, updates):
+        self.updates.extend(updates)
+        self.received.set()
+
+
+async def post(app, body, secret=SECRET):
+    headers = {"Content-Type": "application/json"}
+    if secret is not None:
+        headers[SECRET_TOKEN_HEADER] = secret
+    async with TestClient(TestServer(app)) as client:
+        response = await client.post("/webhook", data=body, headers=headers)
+        return response.status
+
+
+def test_wrong_or_missing_secret_is_rejected():
+    bot = RecordingBot()
+    body = json.dumps(make_fake_update(1, "/start"))
+
+    async def scenario():
+        app = create_webhook_app(bot, SECRET)
+        return await post(app, body, secret="wrong"), await post(app, body, secret=None)
+
+    assert asyncio.run(scenario()) == (403, 403)
+    assert bot.updates == []
+
+
+def test_malformed_json_is_rejected():
+    bot = RecordingBot()
+    status = asyncio.run(post(create_webhook_app(bot, SECRET), "{not json"))
+    assert status == 400
+    assert bot.updates == []
+
+
+def test_valid_update_reaches_bot():
+    bot = RecordingBot()
+
+    async def scenario():
+        status = await post(create_webhook_app(bot, SECRET), json.dumps(make_fake_update(7, "/start", update_id=5)))
+        await asyncio.wait_for(bot.received.wait(), 1)
+        return status
+
+    assert asyncio.run(scenario()) == 200
+    [update] = bot.updates
+    assert update.update_id == 5
+    assert update.message.chat.id == 7
+    assert update.message.text == "/start"
+
+
+def test_valid_update_reaches_on_update_in_sharded_mode():
+    received = []
+
+    async def on_update(data):
+        received.append(data)
+
+    update = make_fake_update(8, "привет", update_id=6)
+    status = asyncio.run(post(create_webhook_app(None, SECRET, on_update=on_update), json.dumps(update)))
+    assert status == 200
+    assert received == [update]
+
+
+def test_fake_poster_round_trip():
+    bot = RecordingBot()
+
+    async def scenario():
+        async with TestServer(create_webhook_app(bot, SECRET)) as server:
+            status = await post_fake_update(str(server.make_url("/webhook")), SECRET, make_fake_update(9, "/help"))
+            await asyncio.wait_for(bot.received.wait(), 1)
+            return status
+
+    assert asyncio.run(scenario()) == 200
+    assert bot.updates[0].message.text == "/help"
+
+
+def test_make_fake_update_round_trips_through_bot_api_types():
+    data = make_fake_update(10, "/cancel now", update_id=11)
+    update = types.Update.de_json(json.loads(json.dumps(data)))
+    assert update.update_id == 11
+    assert update.message.from_user.id == 10
+    assert update.message.content_type == "text"
+    assert update.message.entities[0].type == "bot_command"
+    assert update.message.entities[0].length == len("/cancel")
+
+    plain = make_fake_update(10, "текст")
+    assert "entities" not in plain["message"]
+    assert types.Update.de_json(plain).message.text == "текст"
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Прием обновлений Telegram через webhook (aiohttp)
+
+Модуль можно запустить напрямую, чтобы отправить локальному серверу
+поддельное обновление от имени Telegram:
+
+    python webhook_server.py --url http://127.0.0.1:8080/webhook --secret SECRET --chat-id 1 --text /start
+"""
+
+import os
+import time
+import hmac
+import json
+import asyncio
+import logging
+import argparse
+
+from aiohttp import web, ClientSession
+from telebot import types
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передает секретный токен webhook
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def create_webhook_app(bot, secret_token, path="/webhook", on_update=None):
+    """
+    Создает aiohttp-приложение для приема обновлений Telegram
+
+    Args:
+        bot: Экземпляр AsyncTeleBot, которому передаются обновления
+        secret_token (str): Секретный токен, указанный при setWebhook
+        path (str): Путь, на который Telegram отправляет обновления
+        on_update: Корутина on_update(data), получающая исходный JSON обновления
+                   вместо бота (например, для маршрутизации между процессами)
+
+    Returns:
+        web.Application: Приложение aiohttp
+    """
+    app = web.Application()
+    # Ссылки на фоновые задачи обработки, чтобы их не удалил сборщик мусора
+    app["update_tasks"] = set()
+
+    async def handle_update(request):
+        """Принимает одно обновление и передает его диспетчеру бота"""
+        received_token = request.headers.get(SECRET_TOKEN_HEADER, "")
+        if not secret_token or not hmac.compare_digest(received_token, secret_token):
+            logger.warning(f"Отклонен запрос webhook с неверным секретным токеном от {request.remote}")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            update = None if on_update else types.Update.de_json(data)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Некорректное обновление в webhook: {e}")
+            return web.Response(status=400)
+
+        if on_update:
+            await on_update(data)
+            return web.Response(text="ok")
+
+        # Отвечаем Telegram сразу, обновление обрабатывается в фоне
+        task = asyncio.create_task(bot.process_new_updates([update]))
+        app["update_tasks"].add(task)
+        task.add_done_callback(app["update_tasks"].discard)
+        return web.Response(text="ok")
+
+    async def handle_health(request):
+        """Проверка работоспособности для платформы развертывания"""
+        return web.json_response({"status": "ok"})
+
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/health", handle_health)
+    return app
+
+
+async def start_webhook_server(app, host=None, port=None):
+    """
+    Запускает HTTP-сервер webhook
+
+    Args:
+        app (web.Application): Приложение из create_webhook_app
+        host (str, optional): Адрес (по умолчанию WEBHOOK_HOST или 0.0.0.0)
+        port (int, optional): Порт (по умолчанию PORT или 8080)
+
+    Returns:
+        web.AppRunner: Запущенный runner (для остановки вызовите runner.cleanup())
+    """
+    host = host or os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    port = port or int(os.getenv("PORT", "8080"))
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Webhook сервер слушает {host}:{port}")
+    return runner
+
+
+def make_fake_update(chat_id, text, update_id=None):
+    """
+    Формирует обновление Telegram с текстовым сообщением (для локальной проверки)
+
+    Args:
+        chat_id (int): ID чата и пользователя
+        text (str): Текст сообщения (команды распознаются автоматически)
+        update_id (int, optional): ID обновления
+
+    Returns:
+        dict: Обновление в формате Bot API
+    """
+    update_id = update_id or int(time.time() * 1000) % 2_000_000_000
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+        "text": text
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+async def post_fake_update(url, secret_token, update):
+    """
+    Отправляет обновление на webhook так же, как это делает Telegram
+
+    Args:
+        url (str): Адрес webhook
+        secret_token (str): Секретный токен
+        update (dict): Обновление в формате Bot API
+
+    Returns:
+        int: HTTP-код ответа сервера
+    """
+    headers = {SECRET_TOKEN_HEADER: secret_token} if secret_token else {}
+    async with ClientSession() as session:
+        async with session.post(url, data=json.dumps(update), headers={**headers, "Content-Type": "application/json"}) as response:
+            logger.info(f"Webhook ответил: {response.status}")
+            return response.status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отправка поддельного обновления Telegram на локальный webhook")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook", help="Адрес webhook")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""), help="Секретный токен webhook")
+    parser.add_argument("--chat-id", type=int, default=1, help="ID чата")
+    parser.add_argument("--text", default="/start", help="Текст сообщения")
+    args = parser.parse_args()
+
+    status = asyncio.run(post_fake_update(args.url, args.secret, make_fake_update(args.chat_id, args.text)))
+    raise SystemExit(0 if status == 200 else 1)